@@ -8,9 +8,19 @@ import asyncio
 import json
 import logging
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
 import os
 
-from server import get_current_user, db, serialize_mongo_doc, log_compliance_action, moov_api
+from server import get_current_user, db, serialize_mongo_doc, log_compliance_action, moov_api, transfer_engine, ledger, idempotency_store, index_manager, velocity_counters, risk_features, rescreening_job, audit_log, metric_rollups, scheduler, fraud_monitor, alert_store, log_pipeline, query_monitor
+from principal_cache import principal_cache
+from password_hashing import password_hasher
+from sanctions_screening import sanctions_screener
+from ledger import from_cents
+
+try:
+    from real_banking import plaid_runner
+except ImportError:
+    plaid_runner = None
 
 # Admin API Router
 admin_router = APIRouter(prefix="/admin")
@@ -198,21 +208,15 @@ class AIQualityOfficer:
                     "severity": "high" if user_activity["total_amount"] > 5000 else "medium"
                 })
                 
-                # Create alert
-                alert_id = str(uuid.uuid4())
-                alert = {
-                    "id": alert_id,
+                # Create alert, or count a repeat against the user's open one
+                alert = await alert_store.raise_alert({
                     "type": "fraud_alert",
                     "user_id": user_activity["_id"],
                     "description": f"Suspicious activity: {user_activity['count']} transfers totaling ${user_activity['total_amount']}",
-                    "severity": "high",
-                    "status": "open",
-                    "created_at": datetime.utcnow(),
-                    "reviewed_by": None
-                }
-                
-                await db.alerts.insert_one(alert)
-                fraud_scan["alerts_created"].append(alert_id)
+                    "severity": "high"
+                })
+                if alert["occurrences"] == 1:
+                    fraud_scan["alerts_created"].append(alert["id"])
             
             # Log fraud scan
             await db.fraud_scans.insert_one(fraud_scan)
@@ -232,28 +236,8 @@ ai_officer = AIQualityOfficer()
 async def admin_dashboard(admin_user: dict = Depends(get_admin_user)):
     """Main admin dashboard with system overview"""
     try:
-        # Get system statistics
-        total_users = await db.users.count_documents({})
-        active_users = await db.users.count_documents({"account_status": "active"})
-        pending_kyc = await db.users.count_documents({"kyc_status": "pending"})
-        
-        # Get transaction statistics
-        today = datetime.utcnow().date()
-        today_start = datetime.combine(today, datetime.min.time())
-        
-        daily_transactions = await db.transactions.count_documents({
-            "created_at": {"$gte": today_start}
-        })
-        
-        daily_volume = await db.transactions.aggregate([
-            {"$match": {"created_at": {"$gte": today_start}, "status": "completed"}},
-            {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-        ]).to_list(1)
-        
-        daily_revenue = await db.transactions.aggregate([
-            {"$match": {"created_at": {"$gte": today_start}, "status": "completed"}},
-            {"$group": {"_id": None, "total": {"$sum": "$fee"}}}
-        ]).to_list(1)
+        # Users and today's transactions come from the pre-aggregated rollups
+        rollups = await metric_rollups.summary()
         
         # Get recent alerts
         recent_alerts = await db.alerts.find({
@@ -265,12 +249,13 @@ async def admin_dashboard(admin_user: dict = Depends(get_admin_user)):
         
         return {
             "statistics": {
-                "total_users": total_users,
-                "active_users": active_users,
-                "pending_kyc": pending_kyc,
-                "daily_transactions": daily_transactions,
-                "daily_volume": float(daily_volume[0]["total"]) if daily_volume else 0,
-                "daily_revenue": float(daily_revenue[0]["total"]) if daily_revenue else 0
+                "total_users": rollups["users"],
+                "active_users": rollups["account_status"].get("active", 0),
+                "pending_kyc": rollups["kyc_status"].get("pending", 0),
+                "daily_transactions": rollups["today"]["transactions"],
+                "daily_volume": from_cents(rollups["today"]["volume_cents"]),
+                "daily_revenue": from_cents(rollups["today"]["fee_cents"]),
+                "daily_signups": rollups["today"]["signups"]
             },
             "system_health": {
                 "status": last_scan.get("status", "unknown") if last_scan else "unknown",
@@ -332,7 +317,7 @@ async def get_users(
 async def freeze_user_account(user_id: str, reason: str, admin_user: dict = Depends(get_admin_user)):
     """Freeze user account"""
     try:
-        result = await db.users.update_one(
+        previous = await db.users.find_one_and_update(
             {"id": user_id},
             {
                 "$set": {
@@ -341,12 +326,18 @@ async def freeze_user_account(user_id: str, reason: str, admin_user: dict = Depe
                     "frozen_by": admin_user["id"],
                     "freeze_reason": reason
                 }
-            }
+            },
+            projection={"_id": 0, "account_status": 1},
+            return_document=ReturnDocument.BEFORE
         )
         
-        if result.matched_count == 0:
+        if previous is None:
             raise HTTPException(status_code=404, detail="User not found")
         
+        await metric_rollups.record_status_change("account_status", previous.get("account_status"), "frozen")
+        
+        principal_cache.invalidate(user_id)
+        
         # Log admin action
         await log_compliance_action({
             "admin_user_id": admin_user["id"],
@@ -368,7 +359,7 @@ async def freeze_user_account(user_id: str, reason: str, admin_user: dict = Depe
 async def unfreeze_user_account(user_id: str, admin_user: dict = Depends(get_admin_user)):
     """Unfreeze user account"""
     try:
-        result = await db.users.update_one(
+        previous = await db.users.find_one_and_update(
             {"id": user_id},
             {
                 "$set": {
@@ -381,12 +372,18 @@ async def unfreeze_user_account(user_id: str, admin_user: dict = Depends(get_adm
                     "frozen_by": "",
                     "freeze_reason": ""
                 }
-            }
+            },
+            projection={"_id": 0, "account_status": 1},
+            return_document=ReturnDocument.BEFORE
         )
         
-        if result.matched_count == 0:
+        if previous is None:
             raise HTTPException(status_code=404, detail="User not found")
         
+        await metric_rollups.record_status_change("account_status", previous.get("account_status"), "active")
+        
+        principal_cache.invalidate(user_id)
+        
         # Log admin action
         await log_compliance_action({
             "admin_user_id": admin_user["id"],
@@ -403,6 +400,22 @@ async def unfreeze_user_account(user_id: str, admin_user: dict = Depends(get_adm
         logger.error(f"Unfreeze account error: {e}")
         raise HTTPException(status_code=500, detail="Failed to unfreeze account")
 
+@admin_router.get("/users/{user_id}/ledger")
+async def get_user_ledger(user_id: str, limit: int = 50, admin_user: dict = Depends(get_admin_user)):
+    """Get a user's ledger balance, reconciliation status and recent entries"""
+    try:
+        reconciliation = await ledger.reconcile(user_id)
+        entries = await ledger.get_history(user_id, limit)
+        
+        return {
+            "reconciliation": reconciliation,
+            "entries": serialize_mongo_doc(entries)
+        }
+        
+    except Exception as e:
+        logger.error(f"Get user ledger error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch ledger")
+
 @admin_router.get("/transactions")
 async def get_transactions(
     page: int = 1,
@@ -487,9 +500,9 @@ async def get_alerts(
     limit: int = 50,
     admin_user: dict = Depends(get_admin_user)
 ):
-    """Get system alerts"""
+    """Get system alerts, most recently active first"""
     try:
-        alerts = await db.alerts.find({"status": status}).sort("created_at", -1).limit(limit).to_list(limit)
+        alerts = await db.alerts.find({"status": status}).sort("last_seen_at", -1).limit(limit).to_list(limit)
         return {"alerts": serialize_mongo_doc(alerts)}
         
     except Exception as e:
@@ -523,6 +536,167 @@ async def resolve_alert(alert_id: str, resolution: str, admin_user: dict = Depen
         logger.error(f"Resolve alert error: {e}")
         raise HTTPException(status_code=500, detail="Failed to resolve alert")
 
+@admin_router.get("/performance")
+async def get_performance_stats(admin_user: dict = Depends(get_admin_user)):
+    """Get in-process performance statistics"""
+    stats = {
+        "principal_cache": principal_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "transfer_engine": transfer_engine.stats(),
+        "idempotency": idempotency_store.stats(),
+        "moov_api": moov_api.stats(),
+        "indexes": index_manager.stats(),
+        "velocity_counters": velocity_counters.stats(),
+        "risk_features": risk_features.stats(),
+        "sanctions_screening": sanctions_screener.stats(),
+        "rescreening": rescreening_job.stats(),
+        "audit_log": audit_log.stats(),
+        "metric_rollups": metric_rollups.stats(),
+        "scheduler": scheduler.stats(),
+        "fraud_monitor": fraud_monitor.stats(),
+        "alerts": alert_store.stats(),
+        "logging": log_pipeline.stats(),
+        "slow_queries": query_monitor.stats()
+    }
+    if plaid_runner is not None:
+        stats["plaid"] = plaid_runner.stats()
+    return stats
+
+@admin_router.get("/slow-queries")
+async def get_slow_queries(limit: int = 50, admin_user: dict = Depends(get_admin_user)):
+    """Slow query shapes by total time, with explain plans where captured"""
+    return serialize_mongo_doc(query_monitor.report(min(limit, 500)))
+
+@admin_router.post("/slow-queries/reset")
+async def reset_slow_queries(admin_user: dict = Depends(get_admin_user)):
+    """Clear collected slow queries, e.g. after adding an index"""
+    query_monitor.reset()
+    return {"message": "Slow query log cleared"}
+
+@admin_router.get("/indexes")
+async def get_index_report(admin_user: dict = Depends(get_admin_user)):
+    """Report missing, undeclared and unused collection indexes"""
+    try:
+        return serialize_mongo_doc(await index_manager.report())
+    except Exception as e:
+        logger.error(f"Index report error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to build index report")
+
+@admin_router.post("/indexes/reconcile")
+async def reconcile_indexes(admin_user: dict = Depends(get_admin_user)):
+    """Create any declared indexes that are missing"""
+    try:
+        summary = await index_manager.reconcile()
+
+        await log_compliance_action({
+            "admin_user_id": admin_user["id"],
+            "action": "indexes_reconciled",
+            "created": summary["created"],
+            "conflicts": summary["conflicts"],
+            "failed": summary["failed"],
+            "timestamp": datetime.utcnow()
+        })
+
+        return serialize_mongo_doc(summary)
+    except Exception as e:
+        logger.error(f"Index reconcile error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to reconcile indexes")
+
+@admin_router.post("/sanctions/reload")
+async def reload_sanctions_lists(admin_user: dict = Depends(get_admin_user)):
+    """Reload sanctions and PEP list files and swap in the new index"""
+    try:
+        result = await sanctions_screener.reload()
+        rescreening_job.start()
+
+        await log_compliance_action({
+            "admin_user_id": admin_user["id"],
+            "action": "sanctions_lists_reloaded",
+            "version": result["version"],
+            "previous_version": result["previous_version"],
+            "entries": result["entries"],
+            "timestamp": datetime.utcnow()
+        })
+
+        return result
+    except Exception as e:
+        logger.error(f"Sanctions reload error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to reload screening lists")
+
+@admin_router.get("/sanctions/rescreens")
+async def get_rescreening_jobs(limit: int = 20, admin_user: dict = Depends(get_admin_user)):
+    """Recent watchlist rescreening runs, newest first"""
+    try:
+        jobs = await db.rescreening_jobs.find().sort("started_at", -1).limit(min(limit, 100)).to_list(None)
+        return {"jobs": [serialize_mongo_doc(job) for job in jobs], "current": rescreening_job.stats()}
+    except Exception as e:
+        logger.error(f"Get rescreening jobs error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get rescreening jobs")
+
+@admin_router.get("/metrics/series")
+async def get_metric_series(
+    granularity: str = "hour",
+    hours: int = 24,
+    admin_user: dict = Depends(get_admin_user)
+):
+    """Per-minute or per-hour transaction, volume, fee and signup counts"""
+    if granularity not in ("minute", "hour"):
+        raise HTTPException(status_code=400, detail="granularity must be minute or hour")
+    try:
+        since = datetime.utcnow() - timedelta(hours=min(hours, 24 * 31))
+        return {"granularity": granularity, "buckets": await metric_rollups.series(granularity, since)}
+    except Exception as e:
+        logger.error(f"Get metric series error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get metric series")
+
+@admin_router.post("/metrics/rebuild")
+async def rebuild_metric_rollups(days: int = 30, admin_user: dict = Depends(get_admin_user)):
+    """Recompute the dashboard rollups from users and transactions"""
+    try:
+        result = await metric_rollups.rebuild(days)
+
+        await log_compliance_action({
+            "admin_user_id": admin_user["id"],
+            "action": "metric_rollups_rebuilt",
+            "days": days,
+            "buckets": result["buckets"],
+            "timestamp": datetime.utcnow()
+        })
+
+        return result
+    except Exception as e:
+        logger.error(f"Metric rollup rebuild error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to rebuild metric rollups")
+
+@admin_router.get("/scheduler")
+async def get_scheduled_jobs(admin_user: dict = Depends(get_admin_user)):
+    """Last and next run of every scheduled job"""
+    try:
+        return {"jobs": serialize_mongo_doc(await scheduler.status()), "local": scheduler.stats()}
+    except Exception as e:
+        logger.error(f"Get scheduled jobs error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get scheduled jobs")
+
+@admin_router.post("/scheduler/{job_name}/run")
+async def run_scheduled_job(job_name: str, admin_user: dict = Depends(get_admin_user)):
+    """Make a scheduled job due now; whichever worker claims it runs it"""
+    if job_name not in scheduler.jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    try:
+        await scheduler.run_now(job_name)
+
+        await log_compliance_action({
+            "admin_user_id": admin_user["id"],
+            "action": "scheduled_job_triggered",
+            "job": job_name,
+            "timestamp": datetime.utcnow()
+        })
+
+        return {"message": f"{job_name} will run on the next scheduler poll"}
+    except Exception as e:
+        logger.error(f"Run scheduled job error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to trigger job")
+
 @admin_router.get("/compliance-logs")
 async def get_compliance_logs(
     page: int = 1,
@@ -553,33 +727,43 @@ async def get_compliance_logs(
         logger.error(f"Get compliance logs error: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch compliance logs")
 
-# Background task for periodic AI scans
-async def periodic_ai_scan():
-    """Background task that runs AI scans every hour"""
-    while True:
-        try:
-            await asyncio.sleep(3600)  # Wait 1 hour
-            
-            # Perform system health scan
-            scan_result = await ai_officer.scan_system_health()
-            
-            # Auto-repair any issues found
-            if scan_result.get("issues_found"):
-                repairs = await ai_officer.auto_repair_issues(scan_result["issues_found"])
-                logger.info(f"AI performed {len(repairs)} auto-repairs")
-            
-            # Perform fraud detection scan
-            fraud_result = await ai_officer.fraud_detection_scan()
-            
-            if fraud_result.get("alerts_created"):
-                logger.warning(f"Fraud scan created {len(fraud_result['alerts_created'])} alerts")
-                
-        except Exception as e:
-            logger.error(f"Periodic AI scan error: {e}")
+# Scheduled scans; the scheduler's lease keeps them to one worker
+async def scheduled_health_scan():
+    """Scan system health and auto-repair what it finds"""
+    scan_result = await ai_officer.scan_system_health()
+    
+    # Auto-repair any issues found
+    if scan_result.get("issues_found"):
+        repairs = await ai_officer.auto_repair_issues(scan_result["issues_found"])
+        logger.info(f"AI performed {len(repairs)} auto-repairs")
+
+async def scheduled_fraud_scan():
+    """Run the fraud detection scan"""
+    fraud_result = await ai_officer.fraud_detection_scan()
+    
+    if fraud_result.get("alerts_created"):
+        logger.warning(f"Fraud scan created {len(fraud_result['alerts_created'])} alerts")
 
 # Startup event to begin AI monitoring
 @admin_router.on_event("startup")
 async def start_ai_monitoring():
     """Start background AI monitoring"""
-    asyncio.create_task(periodic_ai_scan())
-    logger.info("AI monitoring system started")
+    scheduler.add_job(
+        "system_health_scan",
+        scheduled_health_scan,
+        int(os.getenv('AI_SCAN_INTERVAL_SECONDS', str(ai_officer.scan_interval))),
+        initial_delay=ai_officer.scan_interval
+    )
+    if not fraud_monitor.enabled:
+        # The streaming fraud monitor covers the same rule within seconds
+        scheduler.add_job(
+            "fraud_detection_scan",
+            scheduled_fraud_scan,
+            int(os.getenv('FRAUD_SCAN_INTERVAL_SECONDS', str(ai_officer.scan_interval))),
+            initial_delay=ai_officer.scan_interval
+        )
+    try:
+        await scheduler.start()
+        logger.info("AI monitoring system started")
+    except Exception as e:
+        logger.error(f"Error starting AI monitoring: {e}")
@@ -0,0 +1,97 @@
+"""
+DalePay Alerts
+Raises compliance and fraud alerts, folding repeats into one open alert
+"""
+
+import os
+import uuid
+import logging
+from datetime import datetime
+from typing import Dict, Any
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+SEVERITY_RANKS = {"low": 1, "medium": 2, "high": 3, "critical": 4}
+SEVERITIES = {rank: severity for severity, rank in SEVERITY_RANKS.items()}
+
+class AlertStore:
+    """Writes alerts keyed by (user_id, type, time bucket).
+
+    The first hit in a bucket creates an open alert; later hits for the same
+    user and type only bump its occurrence count, last_seen_at and latest
+    data, and raise its severity if the new hit is more severe. A unique
+    partial index on dedup_key over open alerts makes concurrent upserts
+    from several workers converge on one document. Once an analyst resolves
+    the alert, the next hit opens a new one.
+    """
+
+    def __init__(self, db, bucket_seconds: int = 3600):
+        self.collection = db.alerts
+        self.bucket_seconds = bucket_seconds
+        self.counters = {"raised": 0, "opened": 0, "folded": 0}
+
+    def _bucket(self, at: datetime) -> datetime:
+        return datetime.utcfromtimestamp(
+            int((at - datetime(1970, 1, 1)).total_seconds()) // self.bucket_seconds * self.bucket_seconds
+        )
+
+    async def raise_alert(self, alert_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Open an alert or fold this hit into the open one; returns the alert"""
+        now = datetime.utcnow()
+        bucket = self._bucket(now)
+        severity = alert_data.get("severity", "medium")
+        dedup_key = f"{alert_data.get('user_id')}:{alert_data['type']}:{bucket.isoformat()}"
+        fields = {key: value for key, value in alert_data.items() if key not in ("severity", "created_at", "status")}
+
+        update = {
+            "$setOnInsert": {
+                "id": str(uuid.uuid4()),
+                "dedup_key": dedup_key,
+                "bucket": bucket,
+                "created_at": now,
+                "status": "open",
+                "reviewed_by": None,
+                "resolved_at": None,
+                "severity": severity
+            },
+            "$set": {**fields, "last_seen_at": now},
+            "$inc": {"occurrences": 1},
+            "$max": {"severity_rank": SEVERITY_RANKS.get(severity, 2)}
+        }
+        try:
+            alert = await self._upsert(dedup_key, update)
+        except DuplicateKeyError:
+            # Another worker opened it first; this hit folds into theirs
+            alert = await self._upsert(dedup_key, update)
+
+        if SEVERITIES.get(alert["severity_rank"]) != alert["severity"]:
+            alert["severity"] = SEVERITIES[alert["severity_rank"]]
+            await self.collection.update_one({"id": alert["id"]}, {"$set": {"severity": alert["severity"]}})
+
+        self.counters["raised"] += 1
+        if alert["occurrences"] == 1:
+            self.counters["opened"] += 1
+            logger.warning(f"Alert opened: {alert['type']} for user {alert.get('user_id')}")
+        else:
+            self.counters["folded"] += 1
+        return alert
+
+    async def _upsert(self, dedup_key: str, update: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.collection.find_one_and_update(
+            {"dedup_key": dedup_key, "status": "open"},
+            update,
+            projection={"_id": 0, "id": 1, "type": 1, "user_id": 1, "severity": 1, "severity_rank": 1, "occurrences": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Alert statistics for the admin performance view"""
+        return {"bucket_seconds": self.bucket_seconds, **self.counters}
+
+def get_alert_store(db):
+    """Get alert store instance"""
+    return AlertStore(db, bucket_seconds=int(os.getenv('ALERT_DEDUP_WINDOW_SECONDS', '3600')))
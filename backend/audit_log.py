@@ -0,0 +1,259 @@
+"""
+DalePay Audit Log
+Buffers compliance log records and writes them to MongoDB in batches
+"""
+
+import os
+import time
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+import bson
+from bson import ObjectId, json_util
+from bson.errors import InvalidDocument
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from perf_stats import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPILL_PATH = Path(__file__).parent / "audit_spill.jsonl"
+
+def _append_lines(path: Path, records: List[Dict[str, Any]]):
+    with open(path, "a", encoding="utf-8") as spill:
+        for record in records:
+            spill.write(json_util.dumps(record) + "\n")
+        spill.flush()
+        os.fsync(spill.fileno())
+
+def _read_lines(path: Path) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as spill:
+        return [json_util.loads(line) for line in spill if line.strip()]
+
+def _unlink(path: Path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        # Another worker replayed the same orphaned file
+        pass
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _encodable(record: Dict[str, Any]) -> bool:
+    try:
+        bson.encode(record)
+        return True
+    except (InvalidDocument, TypeError, OverflowError):
+        return False
+
+def _only_duplicates(error: BulkWriteError) -> bool:
+    return all(item.get("code") == 11000 for item in error.details.get("writeErrors", []))
+
+class AuditLogWriter:
+    """Takes compliance log records off the request path.
+
+    write() only appends to an in-memory buffer; a background task flushes
+    it with insert_many once batch_size records are waiting or every
+    flush_interval seconds. Each record gets its _id when it is written, so
+    retrying a batch that partly landed only hits duplicate keys. If MongoDB
+    is unavailable, batches are appended to a local spill file (fsynced) and
+    replayed once inserts succeed again or at the next startup. A batch that
+    cannot be spilled either goes back to the front of the buffer for the
+    next flush. shutdown() drains whatever is still buffered.
+
+    Every worker appends to the same spill file. To replay, a worker first
+    renames it to a file of its own (<spill>.<pid>.replaying), so lines other
+    workers append meanwhile land in a fresh spill file instead of being
+    deleted with the replayed one. A replay that fails partway keeps its
+    file and runs again; records carry their _id, so the batches that
+    already landed only hit duplicate keys. At startup a worker also
+    replays files left by workers that died mid-replay.
+    """
+
+    def __init__(self, collection, spill_path: Path, batch_size: int = 500,
+                 flush_interval: float = 0.5, retry_interval: float = 5.0):
+        self.collection = collection
+        self.spill_path = Path(spill_path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self._buffer: List[Dict[str, Any]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._retry_at = 0.0
+        self._stopping = False
+        self.flush_time = LatencyStats()
+        self.counters = {"written": 0, "flushed": 0, "batches": 0, "spilled": 0, "replayed": 0,
+                         "dropped": 0, "failed_flushes": 0, "failed_spills": 0}
+
+    def write(self, record: Dict[str, Any]):
+        """Queue a record; never blocks on MongoDB"""
+        record.setdefault("_id", ObjectId())
+        self._buffer.append(record)
+        self.counters["written"] += 1
+        self._ensure_started()
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def start(self):
+        """Start the flusher and replay records spilled by an earlier process"""
+        self._ensure_started()
+        async with self._flush_lock:
+            await self._replay_orphans()
+            await self._replay_spill()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Audit log flush error: {e}")
+
+    async def flush(self):
+        """Write out everything buffered so far"""
+        async with self._flush_lock:
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                if time.monotonic() < self._retry_at:
+                    await self._spill(batch)
+                elif await self._insert(batch):
+                    if self._spill_pending():
+                        await self._replay_spill()
+                else:
+                    self._retry_at = time.monotonic() + self.retry_interval
+                    await self._spill(batch)
+
+    async def _insert(self, batch: List[Dict[str, Any]]) -> bool:
+        try:
+            with self.flush_time.time():
+                await self.collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            if not _only_duplicates(e):
+                self.counters["failed_flushes"] += 1
+                logger.error(f"Audit log batch partly failed: {e.details.get('writeErrors', [])[:1]}")
+                return False
+        except InvalidDocument:
+            # One bad record must not hold back the rest of the batch
+            valid = [record for record in batch if _encodable(record)]
+            self.counters["dropped"] += len(batch) - len(valid)
+            logger.error(f"Dropped {len(batch) - len(valid)} audit log records that cannot be stored")
+            return await self._insert(valid) if valid else True
+        except PyMongoError as e:
+            self.counters["failed_flushes"] += 1
+            logger.error(f"Audit log insert failed, spilling to {self.spill_path}: {e}")
+            return False
+        self.counters["batches"] += 1
+        self.counters["flushed"] += len(batch)
+        return True
+
+    async def _spill(self, batch: List[Dict[str, Any]]):
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, _append_lines, self.spill_path, batch)
+        except BaseException:
+            # Neither MongoDB nor the disk took the batch; lines that did get
+            # appended carry their _id, so writing them again is harmless
+            self._buffer[:0] = batch
+            self.counters["failed_spills"] += 1
+            raise
+        self.counters["spilled"] += len(batch)
+
+    def _claimed_path(self, pid: Optional[int] = None) -> Path:
+        return self.spill_path.with_name(f"{self.spill_path.name}.{pid or os.getpid()}.replaying")
+
+    def _spill_pending(self) -> bool:
+        return self.spill_path.exists() or self._claimed_path().exists()
+
+    async def _replay_spill(self):
+        claimed = self._claimed_path()
+        if not claimed.exists():
+            try:
+                # Atomic, so appends from other workers go to a new spill file
+                os.replace(self.spill_path, claimed)
+            except FileNotFoundError:
+                return
+        await self._replay_file(claimed)
+
+    async def _replay_orphans(self):
+        """Replay files claimed by workers that died before finishing"""
+        prefix = f"{self.spill_path.name}."
+        for path in self.spill_path.parent.glob(f"{self.spill_path.name}.*.replaying"):
+            pid = path.name[len(prefix):-len(".replaying")]
+            if pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+                await self._replay_file(path)
+
+    async def _replay_file(self, path: Path) -> bool:
+        loop = asyncio.get_running_loop()
+        try:
+            records = await loop.run_in_executor(None, _read_lines, path)
+        except FileNotFoundError:
+            return True
+        for start in range(0, len(records), self.batch_size):
+            if not await self._insert(records[start:start + self.batch_size]):
+                # Keep the file; the next successful flush retries it
+                self._retry_at = time.monotonic() + self.retry_interval
+                return False
+        await loop.run_in_executor(None, _unlink, path)
+        self.counters["replayed"] += len(records)
+        logger.info(f"Replayed {len(records)} spilled audit log records from {path.name}")
+        return True
+
+    async def shutdown(self):
+        """Stop the flusher and drain the buffer"""
+        if self._task is None:
+            return
+        # Let the flusher finish its current batch instead of cancelling mid-insert
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        try:
+            await self.flush()
+        except Exception as e:
+            self.counters["dropped"] += len(self._buffer)
+            logger.error(f"Dropped {len(self._buffer)} audit log records at shutdown, could not store or spill them: {e}")
+            self._buffer.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Writer statistics for the admin performance view"""
+        return {
+            "buffered": len(self._buffer),
+            "spill_pending": self._spill_pending(),
+            "flush_latency": self.flush_time.snapshot(),
+            **self.counters
+        }
+
+# Writers are shared per database so every caller batches into one buffer
+_writers: Dict[str, AuditLogWriter] = {}
+
+def get_audit_log_writer(db):
+    """Get the audit log writer for db"""
+    writer = _writers.get(db.name)
+    if writer is None:
+        writer = _writers[db.name] = AuditLogWriter(
+            db.compliance_logs,
+            os.getenv('AUDIT_LOG_SPILL_PATH', str(DEFAULT_SPILL_PATH)),
+            batch_size=int(os.getenv('AUDIT_LOG_BATCH_SIZE', '500')),
+            flush_interval=float(os.getenv('AUDIT_LOG_FLUSH_INTERVAL_SECONDS', '0.5'))
+        )
+    return writer
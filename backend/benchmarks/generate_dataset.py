@@ -0,0 +1,519 @@
+"""
+DalePay Synthetic Dataset Generator
+Fills a MongoDB database with users, transfers, wallets, bank accounts, POS
+payments, compliance logs and alerts at scale, in the shapes the API writes
+
+Usage:
+    python benchmarks/generate_dataset.py --users 1000000 --transactions 10000000 --drop
+    python benchmarks/generate_dataset.py --users 50000 --db dalepay_scale --seed 11 --workers 8
+
+Activity follows a power law: each user gets a Zipf weight (--alpha) over
+a seeded shuffle, and senders, recipients, POS customers and alerted users
+are drawn by that weight, so a few accounts carry most of the traffic like
+in production. Transfers are generated in one sequential pass in
+timestamp order that tracks balances, so no wallet goes negative at any
+point in its history and every users.wallet_balance_cents equals its
+opening balance plus its ledger entries. Document building and
+insert_many run in a process pool, one pymongo client per worker.
+
+The same --seed (and --end) gives the same documents, ids included; only
+the Fernet ciphertexts differ, since Fernet tokens carry a random IV.
+Writes go to --db (default dalepay_scale), never to DB_NAME unless asked.
+Create indexes after loading, e.g. by starting the API once, and rebuild
+the dashboard rollups with POST /admin/metrics/rebuild.
+"""
+
+import os
+import sys
+import time
+import uuid
+import json
+import random
+import hashlib
+import argparse
+import multiprocessing
+from math import log
+from pathlib import Path
+from bisect import bisect_right
+from itertools import accumulate
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Any, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv
+from cryptography.fernet import Fernet
+from passlib.context import CryptContext
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+
+from ledger import transfer_entries, opening_entries, percent_of_cents
+from alerts import SEVERITY_RANKS
+
+load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+
+# Matches the load test, so generated users can sign in there
+PASSWORD = "BenchPass123!"
+OPENING_BALANCE_CENTS = 10000
+COLLECTIONS = ("users", "transactions", "ledger_entries", "wallets", "bank_accounts",
+               "pos_transactions", "compliance_logs", "alerts")
+
+FIRST_NAMES = ["Luis", "Maria", "Jose", "Carmen", "Carlos", "Ana", "Jorge", "Rosa", "Miguel", "Elena",
+               "Pedro", "Sofia", "Juan", "Isabel", "Angel", "Lucia", "Rafael", "Marta", "David", "Gloria"]
+LAST_NAMES = ["Rivera", "Rodriguez", "Santiago", "Colon", "Torres", "Ortiz", "Cruz", "Diaz", "Morales",
+              "Reyes", "Ramos", "Vazquez", "Hernandez", "Gonzalez", "Perez", "Lopez", "Martinez", "Negron"]
+CITIES = ["San Juan", "Bayamon", "Carolina", "Ponce", "Caguas", "Guaynabo", "Mayaguez", "Arecibo"]
+BANKS = ["Banco Popular", "FirstBank", "Oriental Bank", "Citibank", "Chase", "Bank of America"]
+DESCRIPTIONS = ["DalePay Transfer", "Rent", "Dinner", "Groceries", "Thanks!", "Utilities", "Gas money", "Birthday gift"]
+POS_ITEMS = [("Cafe con leche", 2.5), ("Mallorca", 3.25), ("Empanadilla", 2.0), ("Mofongo", 14.0),
+             ("Alcapurria", 2.75), ("Groceries", 35.0), ("Fuel", 40.0), ("Haircut", 18.0)]
+ALERT_TYPES = [("fraud_alert", "high"), ("aml_high_risk", "high"), ("kyc_review", "medium"),
+               ("sanctions_rescreen_match", "critical")]
+
+def stable_uuid(seed: int, kind: str, number: int) -> str:
+    """Version 4 shaped UUID derived from the seed, so reruns produce the same ids"""
+    digest = bytearray(hashlib.blake2b(f"{seed}:{kind}:{number}".encode(), digest_size=16).digest())
+    digest[6] = digest[6] & 0x0F | 0x40
+    digest[8] = digest[8] & 0x3F | 0x80
+    return str(uuid.UUID(bytes=bytes(digest)))
+
+def user_email(index: int) -> str:
+    return f"user{index}@scale.dalepay.test"
+
+def signup_offset(index: int, users: int, span: float) -> float:
+    """Seconds after the start of the period; signups grow over time"""
+    return span * ((index + 1) / users) ** 0.5
+
+# Worker state, set up once per pool process
+_config: Dict[str, Any] = {}
+_db = None
+_ciphertexts: Dict[str, List[str]] = {}
+
+def _init_worker(config: Dict[str, Any]):
+    global _db
+    _config.update(config)
+    _db = MongoClient(config["mongo_url"])[config["db_name"]]
+    fernet = Fernet(config["encryption_key"])
+    rng = random.Random(config["seed"])
+    _ciphertexts["ssn"] = [fernet.encrypt(f"{rng.randrange(10 ** 4):04d}".encode()).decode() for _ in range(64)]
+    _ciphertexts["address"] = [fernet.encrypt(json.dumps({
+        "line1": f"{rng.randint(1, 999)} Calle {rng.choice(LAST_NAMES)}",
+        "line2": None,
+        "city": rng.choice(CITIES),
+        "state": "PR",
+        "zip": f"00{rng.randint(600, 988)}",
+        "country": "US"
+    }).encode()).decode() for _ in range(64)]
+    _ciphertexts["routing"] = [fernet.encrypt(f"0215{rng.randrange(10 ** 5):05d}".encode()).decode() for _ in range(64)]
+    _ciphertexts["account"] = [fernet.encrypt(f"{rng.randrange(10 ** 10):010d}".encode()).decode() for _ in range(64)]
+
+def _at(timestamp: float) -> datetime:
+    return datetime.utcfromtimestamp(round(timestamp, 3))
+
+def _stable_ids(entries: List[Dict[str, Any]], kind: str, number: int) -> List[Dict[str, Any]]:
+    for position, entry in enumerate(entries):
+        entry["id"] = stable_uuid(_config["seed"], kind, number * 4 + position)
+    return entries
+
+def _insert(batches: Dict[str, List[Dict[str, Any]]]) -> Dict[str, int]:
+    """insert_many each collection's documents; returns how many were inserted"""
+    inserted = {}
+    for collection, documents in batches.items():
+        if not documents:
+            continue
+        try:
+            inserted[collection] = len(_db[collection].insert_many(documents, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            # Rerun without --drop; the existing documents are kept
+            inserted[collection] = e.details["nInserted"]
+    return inserted
+
+def _insert_transfers(rows: List[Tuple]) -> Dict[str, int]:
+    """Transactions as send_money writes them, with their ledger entries and compliance logs"""
+    seed = _config["seed"]
+    transactions, entries, logs = [], [], []
+    for number, sender, recipient, amount_cents, fee_cents, instant, timestamp, description in rows:
+        created_at = _at(timestamp)
+        transaction_id = stable_uuid(seed, "transaction", number)
+        sender_id = stable_uuid(seed, "user", sender)
+        amount = amount_cents / 100
+        transactions.append({
+            "id": transaction_id,
+            "from_user_id": sender_id,
+            "to_user_id": stable_uuid(seed, "user", recipient),
+            "amount": amount,
+            "fee": fee_cents / 100,
+            "amount_cents": amount_cents,
+            "fee_cents": fee_cents,
+            "description": DESCRIPTIONS[description],
+            "transfer_type": "instant" if instant else "standard",
+            "status": "completed",
+            "created_at": created_at,
+            "completed_at": created_at
+        })
+        entries.extend(_stable_ids(transfer_entries(
+            transaction_id, sender_id, stable_uuid(seed, "user", recipient), amount_cents, fee_cents, created_at
+        ), "ledger", number))
+        logs.append({
+            "user_id": sender_id,
+            "action": "money_transfer",
+            "amount": amount,
+            "recipient": user_email(recipient),
+            "timestamp": created_at,
+            "id": stable_uuid(seed, "transfer_log", number)
+        })
+    return _insert({"transactions": transactions, "ledger_entries": entries, "compliance_logs": logs})
+
+def _insert_users(start: int, balances: List[int]) -> Dict[str, int]:
+    """Users as register_user writes them, plus opening entries, wallets and bank accounts"""
+    seed, users, span, start_ts = _config["seed"], _config["users"], _config["span"], _config["start_ts"]
+    batches = {"users": [], "ledger_entries": [], "compliance_logs": [], "wallets": [], "bank_accounts": []}
+    for index, balance_cents in enumerate(balances, start):
+        rng = random.Random(seed * 1000003 + index)
+        user_id = stable_uuid(seed, "user", index)
+        created_ts = start_ts + signup_offset(index, users, span)
+        created_at = _at(created_ts)
+        full_name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        batches["users"].append({
+            "id": user_id,
+            "email": user_email(index),
+            "password_hash": _config["password_hash"],
+            "full_name": full_name,
+            "phone": f"+1787{rng.randrange(10 ** 7):07d}",
+            "moov_account_id": f"demo_moov_{user_id[:8]}",
+            "wallet_balance": balance_cents / 100,
+            "wallet_balance_cents": balance_cents,
+            "account_status": rng.choices(("active", "frozen", "suspended"), (0.98, 0.015, 0.005))[0],
+            "kyc_status": rng.choices(("approved", "pending", "rejected"), (0.95, 0.04, 0.01))[0],
+            "kyc_level": "basic",
+            "aml_status": "clear",
+            "created_at": created_at,
+            "last_login": _at(created_ts + rng.random() * (_config["end_ts"] - created_ts)) if rng.random() < 0.8 else None,
+            "subscription_plan": rng.choices(("basic", "premium", "business"), (0.85, 0.12, 0.03))[0],
+            "daily_limit": 2500.0,
+            "monthly_limit": 10000.0,
+            "encrypted_ssn": rng.choice(_ciphertexts["ssn"]),
+            "encrypted_address": rng.choice(_ciphertexts["address"]),
+            "date_of_birth": f"{rng.randint(1950, 2005)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "terms_accepted_at": created_at,
+            "privacy_accepted_at": created_at
+        })
+        batches["ledger_entries"].extend(_stable_ids(
+            opening_entries(user_id, OPENING_BALANCE_CENTS, created_at), "opening", index
+        ))
+        batches["compliance_logs"].append({
+            "user_id": user_id,
+            "action": "user_registration",
+            "ip_address": "system",
+            "timestamp": created_at,
+            "id": stable_uuid(seed, "registration_log", index)
+        })
+        if rng.random() < _config["wallet_fraction"]:
+            batches["wallets"].append({
+                "wallet_id": stable_uuid(seed, "wallet", index),
+                "user_id": user_id,
+                "moov_account_id": stable_uuid(seed, "moov_account", index),
+                "balance": 0.0,
+                "currency": "USD",
+                "status": "active",
+                "linked_accounts": [],
+                "created_at": created_at,
+                "updated_at": created_at
+            })
+        if rng.random() < _config["bank_fraction"]:
+            for account in range(rng.choice((1, 1, 1, 2))):
+                routing, account_number = f"0215{rng.randrange(10 ** 5):05d}", f"{rng.randrange(10 ** 10):010d}"
+                batches["bank_accounts"].append({
+                    "id": stable_uuid(seed, "bank_account", index * 2 + account),
+                    "user_id": user_id,
+                    "moov_bank_id": f"demo_bank_{stable_uuid(seed, 'moov_bank', index * 2 + account)[:8]}",
+                    "account_type": rng.choice(("checking", "checking", "savings")),
+                    "bank_name": rng.choice(BANKS),
+                    "account_holder_name": full_name,
+                    "routing_number_last_4": routing[-4:],
+                    "account_number_last_4": account_number[-4:],
+                    "encrypted_routing": rng.choice(_ciphertexts["routing"]),
+                    "encrypted_account": rng.choice(_ciphertexts["account"]),
+                    "status": "active",
+                    "verified": True,
+                    "created_at": created_at
+                })
+    return _insert(batches)
+
+def _insert_pos_payments(rows: List[Tuple]) -> Dict[str, int]:
+    """POS payments as process_merchant_payment writes them, with their compliance logs"""
+    seed = _config["seed"]
+    payments, logs = [], []
+    for number, customer, merchant, timestamp in rows:
+        rng = random.Random(seed * 1000033 + number)
+        created_at = _at(timestamp)
+        items = [
+            {"name": name, "quantity": quantity, "price": price}
+            for (name, price), quantity in ((rng.choice(POS_ITEMS), rng.randint(1, 3)) for _ in range(rng.randint(1, 3)))
+        ]
+        amount = round(sum(item["price"] * item["quantity"] for item in items), 2)
+        tip_amount = round(amount * rng.choice((0.0, 0.0, 0.1, 0.15, 0.2)), 2)
+        total_amount = amount + tip_amount
+        merchant_fee = (amount * _config["merchant_fee_percent"]) + _config["merchant_fee_fixed"]
+        transaction_id = stable_uuid(seed, "pos", number)
+        customer_id, merchant_id = stable_uuid(seed, "user", customer), stable_uuid(seed, "user", merchant)
+        payments.append({
+            "transaction_id": transaction_id,
+            "moov_transfer_id": stable_uuid(seed, "moov_transfer", number),
+            "customer_id": customer_id,
+            "merchant_id": merchant_id,
+            "amount": amount,
+            "tip_amount": tip_amount,
+            "total_amount": total_amount,
+            "merchant_fee": merchant_fee,
+            "merchant_receives": total_amount - merchant_fee,
+            "description": f"POS purchase: {items[0]['name']}",
+            "items": items,
+            "payment_method": "dalepay_wallet",
+            "status": "completed",
+            "created_at": created_at
+        })
+        logs.append({
+            "customer_id": customer_id,
+            "merchant_id": merchant_id,
+            "action": "pos_payment",
+            "amount": total_amount,
+            "fee_collected": merchant_fee,
+            "transaction_id": transaction_id,
+            "timestamp": created_at,
+            "logged_at": created_at,
+            "system": "dalepay_puerto_rico"
+        })
+    return _insert({"pos_transactions": payments, "compliance_logs": logs})
+
+def _insert_documents(collection: str, documents: List[Dict[str, Any]]) -> Dict[str, int]:
+    return _insert({collection: documents})
+
+class Loader:
+    """Submits insert tasks with a bounded number in flight and tallies inserted documents"""
+
+    def __init__(self, pool: ProcessPoolExecutor, max_in_flight: int):
+        self.pool = pool
+        self.max_in_flight = max_in_flight
+        self.pending = set()
+        self.inserted: Dict[str, int] = {}
+        self.started = time.perf_counter()
+
+    def submit(self, func, *args):
+        while len(self.pending) >= self.max_in_flight:
+            self._collect(wait(self.pending, return_when=FIRST_COMPLETED).done)
+        self.pending.add(self.pool.submit(func, *args))
+
+    def drain(self):
+        self._collect(wait(self.pending).done)
+
+    def _collect(self, done):
+        for future in done:
+            self.pending.discard(future)
+            for collection, count in future.result().items():
+                self.inserted[collection] = self.inserted.get(collection, 0) + count
+
+    def progress(self, label: str):
+        total = sum(self.inserted.values())
+        elapsed = time.perf_counter() - self.started
+        print(f"{label}: {total} documents, {total / elapsed:,.0f} docs/s")
+
+class WeightedUsers:
+    """Zipf weights over a seeded shuffle of user indexes"""
+
+    def __init__(self, users: int, alpha: float, rng: random.Random):
+        ranks = list(range(users))
+        rng.shuffle(ranks)
+        self.cum_weights = list(accumulate(1 / (rank + 1) ** alpha for rank in ranks))
+        self.total = self.cum_weights[-1]
+        self.rng = rng
+
+    def draw(self, limit: int = None) -> int:
+        """A user index, only among the first limit users when given"""
+        total = self.total if limit is None else self.cum_weights[limit - 1]
+        return bisect_right(self.cum_weights, self.rng.random() * total)
+
+def signed_up_by(offset: float, users: int, span: float) -> int:
+    """How many users signed up within offset seconds of the start (inverse of signup_offset)"""
+    return min(users, int(users * (offset / span) ** 2 + 1e-9))
+
+def generate_transfers(args, rng: random.Random, weighted: WeightedUsers, loader: Loader,
+                       start_ts: float, span: float) -> List[int]:
+    """Draw transfers in timestamp order, never overdrawing a sender; returns each user's balance change.
+
+    Timestamps increase with the transfer number, denser as more users have
+    signed up, and both sides are drawn among the users signed up by then,
+    so balances are checked in the order the transfers happened.
+    """
+    deltas = [0] * args.users
+    mu = log(args.median_transfer * 100)
+    # The first transfer needs two users who have signed up
+    first_offset = signup_offset(1, args.users, span)
+    rows, number, skipped = [], 0, 0
+    timestamp = None
+    while number < args.transactions:
+        if timestamp is None:
+            # Cube root spacing: transfer volume grows with the signed-up user count
+            offset = first_offset + (span - first_offset) * ((number + rng.random()) / args.transactions) ** (1 / 3)
+            timestamp = start_ts + offset
+            eligible = max(2, signed_up_by(offset, args.users, span))
+        sender, recipient = weighted.draw(eligible), weighted.draw(eligible)
+        if sender == recipient:
+            continue
+        available = OPENING_BALANCE_CENTS + deltas[sender]
+        instant = rng.random() < 0.6
+        amount_cents = min(int(rng.lognormvariate(mu, 1.0)), 1000000)
+        fee_cents = percent_of_cents(amount_cents, "0.015") if instant else 0
+        if amount_cents + fee_cents > available:
+            # Like a user who is short on funds, send part of what is left
+            amount_cents = available // 2
+            fee_cents = percent_of_cents(amount_cents, "0.015") if instant else 0
+        if amount_cents < 100:
+            skipped += 1
+            continue
+        deltas[sender] -= amount_cents + fee_cents
+        deltas[recipient] += amount_cents
+
+        rows.append((number, sender, recipient, amount_cents, fee_cents, instant, timestamp,
+                     rng.randrange(len(DESCRIPTIONS))))
+        number += 1
+        timestamp = None
+        if len(rows) == args.chunk_size:
+            loader.submit(_insert_transfers, rows)
+            rows = []
+            if number % (args.chunk_size * 100) == 0:
+                loader.progress(f"{number} transfers")
+    if rows:
+        loader.submit(_insert_transfers, rows)
+    if skipped:
+        print(f"Redrew {skipped} transfers from senders with less than $1 left")
+    return deltas
+
+def generate_pos_payments(args, rng: random.Random, weighted: WeightedUsers, loader: Loader,
+                          start_ts: float, span: float):
+    merchants = rng.sample(range(args.users), max(1, args.users // 100))
+    merchant_cum = list(accumulate(1 / (rank + 1) ** args.alpha for rank in range(len(merchants))))
+    rows = []
+    for number in range(args.pos_transactions):
+        customer = weighted.draw()
+        merchant = merchants[bisect_right(merchant_cum, rng.random() * merchant_cum[-1])]
+        earliest = start_ts + max(signup_offset(customer, args.users, span), signup_offset(merchant, args.users, span))
+        rows.append((number, customer, merchant, earliest + rng.random() * (start_ts + span - earliest)))
+        if len(rows) == args.chunk_size:
+            loader.submit(_insert_pos_payments, rows)
+            rows = []
+    if rows:
+        loader.submit(_insert_pos_payments, rows)
+
+def generate_alerts(args, rng: random.Random, weighted: WeightedUsers, loader: Loader, end_ts: float):
+    """Alerts in the AlertStore shape; at most one open alert per user, type and dedup window"""
+    bucket_seconds = int(os.getenv('ALERT_DEDUP_WINDOW_SECONDS', '3600'))
+    alerts, seen = [], set()
+    for number in range(args.alerts):
+        user = weighted.draw()
+        alert_type, severity = rng.choice(ALERT_TYPES)
+        created_ts = end_ts - rng.random() * min(args.days, 90) * 86400
+        bucket = _at(created_ts // bucket_seconds * bucket_seconds)
+        dedup_key = f"{stable_uuid(args.seed, 'user', user)}:{alert_type}:{bucket.isoformat()}"
+        if dedup_key in seen:
+            continue
+        seen.add(dedup_key)
+        occurrences = min(int(rng.paretovariate(1.5)), 50)
+        last_seen_ts = created_ts + rng.random() * bucket_seconds if occurrences > 1 else created_ts
+        status = "open" if created_ts > end_ts - 7 * 86400 or rng.random() < 0.1 else "resolved"
+        alerts.append({
+            "id": stable_uuid(args.seed, "alert", number),
+            "dedup_key": dedup_key,
+            "bucket": bucket,
+            "created_at": _at(created_ts),
+            "status": status,
+            "reviewed_by": None if status == "open" else "admin",
+            "resolved_at": None if status == "open" else _at(last_seen_ts + rng.random() * 3 * 86400),
+            "severity": severity,
+            "type": alert_type,
+            "user_id": stable_uuid(args.seed, "user", user),
+            "description": f"Synthetic {alert_type.replace('_', ' ')}",
+            "last_seen_at": _at(last_seen_ts),
+            "occurrences": occurrences,
+            "severity_rank": SEVERITY_RANKS[severity]
+        })
+        if len(alerts) == args.chunk_size:
+            loader.submit(_insert_documents, "alerts", alerts)
+            alerts = []
+    if alerts:
+        loader.submit(_insert_documents, "alerts", alerts)
+
+def main():
+    parser = argparse.ArgumentParser(description="DalePay synthetic dataset generator")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--transactions", type=int, help="Default: 10 per user")
+    parser.add_argument("--pos-transactions", type=int, help="Default: 1 per user")
+    parser.add_argument("--alerts", type=int, help="Default: 1 per 100 users")
+    parser.add_argument("--wallet-fraction", type=float, default=0.3, help="Share of users with a Moov wallet")
+    parser.add_argument("--bank-fraction", type=float, default=0.4, help="Share of users with linked bank accounts")
+    parser.add_argument("--alpha", type=float, default=1.1, help="Zipf exponent of user activity")
+    parser.add_argument("--median-transfer", type=float, default=25.0, help="Median transfer in dollars")
+    parser.add_argument("--days", type=int, default=365, help="Period the data covers")
+    parser.add_argument("--end", help="End of the period (ISO date, default today)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Documents per insert_many")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="dalepay_scale")
+    parser.add_argument("--drop", action="store_true", help="Drop the generated collections first")
+    args = parser.parse_args()
+    if args.users < 2:
+        parser.error("--users must be at least 2")
+    args.transactions = args.users * 10 if args.transactions is None else args.transactions
+    args.pos_transactions = args.users if args.pos_transactions is None else args.pos_transactions
+    args.alerts = args.users // 100 if args.alerts is None else args.alerts
+
+    end = datetime.fromisoformat(args.end) if args.end else datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    end_ts = (end - datetime(1970, 1, 1)).total_seconds()
+    span = args.days * 86400.0
+    start_ts = end_ts - span
+
+    if args.drop:
+        database = MongoClient(args.mongo_url)[args.db]
+        for collection in COLLECTIONS:
+            database.drop_collection(collection)
+        print(f"Dropped {', '.join(COLLECTIONS)} in {args.db}")
+
+    config = {
+        "mongo_url": args.mongo_url,
+        "db_name": args.db,
+        "seed": args.seed,
+        "users": args.users,
+        "span": span,
+        "start_ts": start_ts,
+        "end_ts": end_ts,
+        "wallet_fraction": args.wallet_fraction,
+        "bank_fraction": args.bank_fraction,
+        "encryption_key": os.environ.get("ENCRYPTION_KEY") or Fernet.generate_key(),
+        "password_hash": CryptContext(schemes=["bcrypt"], deprecated="auto").hash(PASSWORD),
+        "merchant_fee_percent": float(os.getenv('MERCHANT_POS_FEE_PERCENT', '0.015')),
+        "merchant_fee_fixed": float(os.getenv('MERCHANT_POS_FEE_FIXED', '0.25'))
+    }
+    rng = random.Random(args.seed)
+    weighted = WeightedUsers(args.users, args.alpha, rng)
+
+    # Spawned workers do not inherit the parent's Mongo client or its threads
+    with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(config,)) as pool:
+        loader = Loader(pool, args.workers * 2)
+        deltas = generate_transfers(args, rng, weighted, loader, start_ts, span)
+        for start in range(0, args.users, args.chunk_size):
+            balances = [OPENING_BALANCE_CENTS + delta for delta in deltas[start:start + args.chunk_size]]
+            loader.submit(_insert_users, start, balances)
+        generate_pos_payments(args, rng, weighted, loader, start_ts, span)
+        generate_alerts(args, rng, weighted, loader, end_ts)
+        loader.drain()
+
+    loader.progress(f"Loaded {args.db}")
+    for collection in COLLECTIONS:
+        print(f"{collection:>16}: {loader.inserted.get(collection, 0)}")
+    print(f"Every generated user can sign in with {user_email(0)} .. {user_email(args.users - 1)} / {PASSWORD}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+DalePay API Load Test
+Drives a weighted mix of user flows and reports throughput and latency percentiles per endpoint
+
+Usage:
+    python benchmarks/load_test.py --in-memory --duration 30 --concurrency 50
+    python benchmarks/load_test.py --base-url http://localhost:8001 --rate 200 --output run.json
+    python benchmarks/load_test.py --in-memory --output new.json --compare baseline.json
+
+Without --base-url the app runs in this process on the same event loop as
+the load generator, against MONGO_URL/DB_NAME or, with --in-memory, an
+in-memory Mongo stand-in. That is fine for comparing runs; for capacity
+numbers run the server separately (uvicorn with its real worker count)
+and point --base-url at it.
+
+With --rate, arrivals are open-loop (Poisson at that many requests per
+second) and latency is measured from the scheduled arrival, so a stalled
+server shows up as queueing time instead of fewer samples. Without it,
+--concurrency workers loop back to back.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+DEFAULT_MIX = "profile=30,history=25,send=20,login=10,dashboard=10,register=5"
+PASSWORD = "BenchPass123!"
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        name, weight = item.split("=", 1)
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+def percentile(ordered: list, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def registration(email: str, rng: random.Random) -> Dict[str, Any]:
+    return {
+        "email": email,
+        "password": PASSWORD,
+        "full_name": "Bench User",
+        "phone": f"+1787{rng.randrange(10 ** 7):07d}",
+        "date_of_birth": "1990-01-01",
+        "ssn_last_4": f"{rng.randrange(10 ** 4):04d}",
+        "address_line_1": "123 Bench St",
+        "city": "San Juan",
+        "state": "PR",
+        "zip_code": "00901",
+        "country": "US",
+        "terms_accepted": True,
+        "privacy_accepted": True
+    }
+
+class Recorder:
+    """Latency samples and status codes per scenario, ignoring the warmup period"""
+
+    def __init__(self, warmup_until: float):
+        self.warmup_until = warmup_until
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def record(self, scenario: str, status: str, seconds: float):
+        now = time.perf_counter()
+        if now < self.warmup_until:
+            return
+        if self.started is None:
+            self.started = self.warmup_until
+        self.finished = now
+        self.latencies.setdefault(scenario, []).append(seconds)
+        codes = self.statuses.setdefault(scenario, {})
+        codes[status] = codes.get(status, 0) + 1
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = (self.finished - self.started) if self.started and self.finished else 0.0
+        endpoints = {}
+        for scenario, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            codes = self.statuses[scenario]
+            errors = sum(count for status, count in codes.items() if not status.startswith("2"))
+            endpoints[scenario] = {
+                "requests": len(ordered),
+                "errors": errors,
+                "status_codes": codes,
+                "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+                "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+                "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2)
+            }
+        requests = sum(endpoint["requests"] for endpoint in endpoints.values())
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "totals": {
+                "requests": requests,
+                "errors": sum(endpoint["errors"] for endpoint in endpoints.values()),
+                "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0
+            },
+            "endpoints": endpoints
+        }
+
+class LoadTest:
+    """Shared state for one run: the HTTP client, a pool of signed-in users and the admin token"""
+
+    def __init__(self, client: httpx.AsyncClient, rng: random.Random, run_id: str):
+        self.client = client
+        self.rng = rng
+        self.run_id = run_id
+        self.users: List[Dict[str, str]] = []
+        self.admin_token: Optional[str] = None
+        self._registered = 0
+
+    def next_email(self) -> str:
+        self._registered += 1
+        return f"bench-{self.run_id}-{self._registered}@example.com"
+
+    async def register(self, email: str) -> httpx.Response:
+        response = await self.client.post("/api/auth/register", json=registration(email, self.rng))
+        if response.status_code == 200:
+            self.users.append({"email": email, "token": response.json()["access_token"]})
+        return response
+
+    async def setup(self, user_count: int, admin_email: str, admin_password: str):
+        """Register the user pool and sign in the admin; not measured"""
+        semaphore = asyncio.Semaphore(20)
+
+        async def register_one():
+            async with semaphore:
+                await self.register(self.next_email())
+
+        await asyncio.gather(*(register_one() for _ in range(user_count)))
+        if len(self.users) < 2:
+            raise SystemExit("Could not register the benchmark user pool; is the API reachable?")
+
+        response = await self.client.post("/api/auth/login", json={"email": admin_email, "password": admin_password})
+        if response.status_code != 200:
+            admin = registration(admin_email, self.rng)
+            admin["password"] = admin_password
+            response = await self.client.post("/api/auth/register", json=admin)
+        if response.status_code == 200:
+            self.admin_token = response.json()["access_token"]
+
+    def headers(self, token: str) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {token}"}
+
+    async def scenario_register(self) -> httpx.Response:
+        return await self.register(self.next_email())
+
+    async def scenario_login(self) -> httpx.Response:
+        user = self.rng.choice(self.users)
+        return await self.client.post("/api/auth/login", json={"email": user["email"], "password": PASSWORD})
+
+    async def scenario_profile(self) -> httpx.Response:
+        return await self.client.get("/api/user/profile", headers=self.headers(self.rng.choice(self.users)["token"]))
+
+    async def scenario_send(self) -> httpx.Response:
+        sender, recipient = self.rng.sample(self.users, 2)
+        return await self.client.post(
+            "/api/transfer/send",
+            headers={**self.headers(sender["token"]), "Idempotency-Key": str(uuid.uuid4())},
+            json={
+                "recipient_email": recipient["email"],
+                "amount": f"{self.rng.randint(1, 100) / 100:.2f}",
+                "description": "load test",
+                "transfer_type": "standard"
+            }
+        )
+
+    async def scenario_history(self) -> httpx.Response:
+        return await self.client.get("/api/transactions", headers=self.headers(self.rng.choice(self.users)["token"]))
+
+    async def scenario_dashboard(self) -> httpx.Response:
+        return await self.client.get("/admin/dashboard", headers=self.headers(self.admin_token))
+
+SCENARIOS = {
+    "register": LoadTest.scenario_register,
+    "login": LoadTest.scenario_login,
+    "profile": LoadTest.scenario_profile,
+    "send": LoadTest.scenario_send,
+    "history": LoadTest.scenario_history,
+    "dashboard": LoadTest.scenario_dashboard
+}
+
+async def execute(test: LoadTest, recorder: Recorder, scenario: str, scheduled: float):
+    try:
+        response = await SCENARIOS[scenario](test)
+        status = str(response.status_code)
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    recorder.record(scenario, status, time.perf_counter() - scheduled)
+
+async def closed_loop(test: LoadTest, recorder: Recorder, names: List[str], weights: List[float],
+                      concurrency: int, deadline: float, think_seconds: float):
+    async def worker():
+        while time.perf_counter() < deadline:
+            await execute(test, recorder, test.rng.choices(names, weights)[0], time.perf_counter())
+            if think_seconds:
+                await asyncio.sleep(test.rng.expovariate(1 / think_seconds))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+async def open_loop(test: LoadTest, recorder: Recorder, names: List[str], weights: List[float],
+                    rate: float, max_in_flight: int, deadline: float) -> int:
+    """Poisson arrivals; returns how many arrivals were shed at the in-flight cap"""
+    in_flight = set()
+    shed = 0
+    scheduled = time.perf_counter()
+    while scheduled < deadline:
+        scheduled += test.rng.expovariate(rate)
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(in_flight) >= max_in_flight:
+            shed += 1
+            continue
+        task = asyncio.create_task(execute(test, recorder, test.rng.choices(names, weights)[0], scheduled))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    return shed
+
+def in_process_client(in_memory: bool) -> httpx.AsyncClient:
+    if in_memory:
+        # Swap the driver before server.py creates its client so every module gets the stand-in
+        import motor.motor_asyncio
+        from mongomock_motor import AsyncMongoMockClient
+        motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+        os.environ.setdefault("MONGO_URL", "mongodb://in-memory")
+        os.environ.setdefault("DB_NAME", "dalepay_bench")
+        os.environ.setdefault("FRAUD_MONITOR_ENABLED", "false")
+    import server
+    if in_memory:
+        # The stand-in has no sessions; use the engine's non-transactional path
+        server.transfer_engine.transactions_supported = False
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://dalepay.bench", timeout=60)
+
+async def run(args) -> Dict[str, Any]:
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    app = None
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=60,
+                                   limits=httpx.Limits(max_connections=args.concurrency))
+    else:
+        client = in_process_client(args.in_memory)
+        import server
+        app = server.app
+        await app.router.startup()
+
+    try:
+        test = LoadTest(client, rng, uuid.uuid4().hex[:8])
+        await test.setup(args.users, args.admin_email, args.admin_password)
+        if test.admin_token is None and "dashboard" in mix:
+            print("Admin sign-in failed, dropping the dashboard scenario")
+            del mix["dashboard"]
+
+        names, weights = list(mix), list(mix.values())
+        started = time.perf_counter()
+        recorder = Recorder(started + args.warmup)
+        deadline = started + args.warmup + args.duration
+        shed = 0
+        if args.rate:
+            shed = await open_loop(test, recorder, names, weights, args.rate, args.concurrency, deadline)
+        else:
+            await closed_loop(test, recorder, names, weights, args.concurrency, deadline, args.think)
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+
+    result = recorder.report()
+    result["shed_arrivals"] = shed
+    result["config"] = {
+        "target": args.base_url or ("in-process, in-memory" if args.in_memory else "in-process"),
+        "mode": "open" if args.rate else "closed",
+        "rate": args.rate,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "users": args.users,
+        "mix": mix,
+        "seed": args.seed
+    }
+    result["finished_at"] = datetime.utcnow().isoformat()
+    return result
+
+def print_report(result: Dict[str, Any]):
+    totals = result["totals"]
+    print(f"{totals['requests']} requests in {result['elapsed_seconds']}s: "
+          f"{totals['throughput_rps']} req/s, {totals['errors']} errors, {result['shed_arrivals']} shed")
+    for name, endpoint in result["endpoints"].items():
+        print(
+            f"{name:>10}: n={endpoint['requests']:6d}  rps={endpoint['throughput_rps']:8.1f}  "
+            f"err={endpoint['errors']:5d}  p50={endpoint['p50_ms']:8.1f}ms  "
+            f"p95={endpoint['p95_ms']:8.1f}ms  p99={endpoint['p99_ms']:8.1f}ms"
+        )
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Print per-endpoint changes against a baseline run; returns the regressions"""
+    regressions = []
+    for name, endpoint in result["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if before is None:
+            continue
+        changes = []
+        for metric, higher_is_worse in (("p50_ms", True), ("p95_ms", True), ("p99_ms", True), ("throughput_rps", False)):
+            old, new = before[metric], endpoint[metric]
+            change = (new - old) / old if old else 0.0
+            changes.append(f"{metric} {old} -> {new} ({change:+.0%})")
+            if (change > tolerance if higher_is_worse else change < -tolerance):
+                regressions.append(f"{name} {metric}")
+        print(f"{name:>10}: " + ", ".join(changes))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="DalePay API load test")
+    parser.add_argument("--base-url", help="Target a running server instead of the in-process app")
+    parser.add_argument("--in-memory", action="store_true", help="In-process app on an in-memory Mongo stand-in")
+    parser.add_argument("--duration", type=float, default=30.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Seconds run before measuring")
+    parser.add_argument("--concurrency", type=int, default=20, help="Closed-loop workers, or the in-flight cap with --rate")
+    parser.add_argument("--rate", type=float, help="Open-loop arrivals per second")
+    parser.add_argument("--think", type=float, default=0.0, help="Mean think time between a worker's requests")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Scenario weights, e.g. profile=30,send=20")
+    parser.add_argument("--users", type=int, default=50, help="Users registered before the run")
+    parser.add_argument("--admin-email", default=os.environ.get("ADMIN_EMAIL", "admin@dalepay.com"))
+    parser.add_argument("--admin-password", default=os.environ.get("BENCH_ADMIN_PASSWORD", PASSWORD))
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the JSON result here")
+    parser.add_argument("--compare", help="Baseline JSON result to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression with --compare")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+    if args.compare:
+        regressions = compare(result, json.loads(Path(args.compare).read_text()), args.tolerance)
+        if regressions:
+            print(f"Regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
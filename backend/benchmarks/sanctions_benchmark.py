@@ -0,0 +1,135 @@
+"""
+DalePay Sanctions Screening Benchmark
+Builds a synthetic list and measures index build time and per-name screening latency,
+failing when recall on single-typo names drops below --min-recall or the hit rate
+on names that are on no list rises above --max-clear-hit-rate
+
+Usage: python benchmarks/sanctions_benchmark.py [--entries 100000] [--queries 5000] [--min-recall 0.85]
+                                                [--max-clear-hit-rate 0.10]
+"""
+
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sanctions_screening import ScreeningIndex, entry_fingerprint
+
+CONSONANTS = "bcdfghjklmnprstvyz"
+VOWELS = "aeiou"
+PATTERNS = ["CVCV", "CVCVC", "CVCCVC", "CVCVCV", "VCVCV", "CVVCVC", "CVCVCVC", "CCVCVC"]
+
+def synthetic_token(rng: random.Random) -> str:
+    return "".join(
+        rng.choice(CONSONANTS if slot == "C" else VOWELS) for slot in rng.choice(PATTERNS)
+    ).capitalize()
+
+class NameGenerator:
+    """Given names drawn from a small Zipf-weighted pool, family names mostly unique,
+    roughly the shape of real watchlists where a few given names are very common"""
+
+    def __init__(self, rng: random.Random, given_pool: int = 2000):
+        self.rng = rng
+        self.given_names = [synthetic_token(rng) for _ in range(given_pool)]
+        self.weights = [1 / (rank + 1) for rank in range(given_pool)]
+
+    def __call__(self) -> str:
+        given = self.rng.choices(self.given_names, self.weights, k=self.rng.choice((1, 1, 2)))
+        family = [synthetic_token(self.rng) for _ in range(self.rng.choice((1, 1, 2)))]
+        return " ".join(given + family)
+
+def misspell(name: str, rng: random.Random) -> str:
+    chars = list(name)
+    position = rng.randrange(1, len(chars))
+    chars[position] = rng.choice("aeioulmnrst")
+    return "".join(chars)
+
+def build_entries(count: int, rng: random.Random, synthetic_name) -> list:
+    entries = []
+    for number in range(count):
+        entry = {
+            "entry_id": f"bench:{number}",
+            "list": "bench",
+            "list_type": "sanctions" if number % 5 else "pep",
+            "name": synthetic_name(),
+            "aliases": [synthetic_name() for _ in range(rng.choice((0, 0, 1, 2)))]
+        }
+        entry["fingerprint"] = entry_fingerprint(entry)
+        entries.append(entry)
+    return entries
+
+def percentile(ordered: list, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Sanctions screening benchmark")
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--token-threshold", type=float, default=0.7)
+    parser.add_argument("--min-recall", type=float, default=0.85,
+                        help="fail unless at least this share of misspelled listed names match")
+    parser.add_argument("--max-clear-hit-rate", type=float, default=0.10,
+                        help="fail if more than this share of names on no list match")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    synthetic_name = NameGenerator(rng)
+    entries = build_entries(args.entries, rng, synthetic_name)
+
+    started = time.perf_counter()
+    index = ScreeningIndex(entries, "bench")
+    build_seconds = time.perf_counter() - started
+
+    # Exact hits, misspelled hits and customers who are on no list
+    queries = []
+    for _ in range(args.queries):
+        kind = rng.random()
+        if kind < 0.2:
+            queries.append(("exact", rng.choice(entries)["name"]))
+        elif kind < 0.4:
+            queries.append(("misspelled", misspell(rng.choice(entries)["name"], rng)))
+        else:
+            queries.append(("clear", synthetic_name()))
+
+    timings = {"exact": [], "misspelled": [], "clear": []}
+    hits = {"exact": 0, "misspelled": 0, "clear": 0}
+    for kind, name in queries:
+        started = time.perf_counter()
+        matches = index.search(name, args.threshold, args.token_threshold)
+        timings[kind].append(time.perf_counter() - started)
+        hits[kind] += bool(matches)
+
+    print(f"entries: {len(index)}  build: {build_seconds:.2f}s")
+    for kind, samples in timings.items():
+        ordered = sorted(samples)
+        if not ordered:
+            continue
+        print(
+            f"{kind:>10}: n={len(ordered):5d}  hit_rate={hits[kind] / len(ordered):.2%}  "
+            f"p50={percentile(ordered, 0.50) * 1e6:8.1f}us  "
+            f"p95={percentile(ordered, 0.95) * 1e6:8.1f}us  "
+            f"p99={percentile(ordered, 0.99) * 1e6:8.1f}us"
+        )
+
+    failures = []
+    if timings["misspelled"]:
+        recall = hits["misspelled"] / len(timings["misspelled"])
+        if recall < args.min_recall:
+            failures.append(f"misspelled recall {recall:.2%} is below --min-recall {args.min_recall:.2%}")
+    if timings["clear"]:
+        # Clear names are random, so some really are listed; this bounds the fuzzy noise on top
+        clear_hit_rate = hits["clear"] / len(timings["clear"])
+        if clear_hit_rate > args.max_clear_hit_rate:
+            failures.append(
+                f"clear-name hit rate {clear_hit_rate:.2%} is above --max-clear-hit-rate {args.max_clear_hit_rate:.2%}"
+            )
+    if failures:
+        sys.exit("\n".join(failures))
+
+if __name__ == "__main__":
+    main()
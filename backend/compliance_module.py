@@ -13,14 +13,27 @@ import uuid
 import json
 import re
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+from principal_cache import principal_cache
+from velocity import get_velocity_counters
+from risk_features import get_risk_feature_loader
+from sanctions_screening import sanctions_screener
+from audit_log import get_audit_log_writer
+from metric_rollups import get_metric_rollups
+from alerts import get_alert_store
 
 logger = logging.getLogger(__name__)
 
 class ComplianceManager:
     """Manages all compliance operations for DalePay"""
     
-    def __init__(self, db: AsyncIOMotorDatabase):
+    def __init__(self, db: AsyncIOMotorDatabase, risk_features=None, audit_log=None, rollups=None, alerts=None):
         self.db = db
+        self.risk_features = risk_features or get_risk_feature_loader(db, get_velocity_counters(db))
+        self.audit_log = audit_log or get_audit_log_writer(db)
+        self.rollups = rollups or get_metric_rollups(db)
+        self.alerts = alerts or get_alert_store(db)
         self.kyc_levels = {
             "basic": {
                 "daily_limit": Decimal("1000.00"),
@@ -92,7 +105,7 @@ class ComplianceManager:
                 verification_result["expires_at"] = datetime.utcnow() + timedelta(days=365)
                 
                 # Update user record
-                await self.db.users.update_one(
+                previous = await self.db.users.find_one_and_update(
                     {"id": user_id},
                     {
                         "$set": {
@@ -102,8 +115,13 @@ class ComplianceManager:
                             "daily_limit": float(self.kyc_levels[verification_result["level"]]["daily_limit"]),
                             "monthly_limit": float(self.kyc_levels[verification_result["level"]]["monthly_limit"])
                         }
-                    }
+                    },
+                    projection={"_id": 0, "kyc_status": 1},
+                    return_document=ReturnDocument.BEFORE
                 )
+                if previous is not None:
+                    await self.rollups.record_status_change("kyc_status", previous.get("kyc_status"), "approved")
+                principal_cache.invalidate(user_id)
             
             # Store verification record
             await self.db.kyc_verifications.insert_one(verification_result)
@@ -160,8 +178,9 @@ class ComplianceManager:
         else:
             return {"valid": False, "reason": "Unsupported document type"}
     
-    async def aml_screening(self, user_data: Dict, transaction_data: Optional[Dict] = None) -> Dict:
-        """Comprehensive AML screening"""
+    async def aml_screening(self, user_data: Dict, transaction_data: Optional[Dict] = None,
+                            features: Optional[Dict] = None) -> Dict:
+        """Comprehensive AML screening; features can be shared with fraud analysis"""
         try:
             screening_result = {
                 "screening_id": str(uuid.uuid4()),
@@ -180,10 +199,14 @@ class ComplianceManager:
             # Check user against sanctions lists (simulated)
             sanctions_result = await self._check_sanctions_list(user_data)
             screening_result["sanctions_check"] = sanctions_result["status"]
-            if sanctions_result["status"] != "clear":
+            if sanctions_result["status"] == "match":
                 screening_result["flags"].append("sanctions_match")
                 screening_result["risk_level"] = "high"
                 screening_result["status"] = "blocked"
+            elif sanctions_result["status"] == "possible_match":
+                screening_result["flags"].append("possible_sanctions_match")
+                screening_result["risk_level"] = "medium"
+                screening_result["recommendations"].append("manual_review")
             
             # PEP (Politically Exposed Person) check
             pep_result = await self._check_pep_list(user_data)
@@ -195,7 +218,9 @@ class ComplianceManager:
             
             # Transaction-specific checks
             if transaction_data:
-                transaction_flags = await self._check_transaction_patterns(user_data["id"], transaction_data)
+                if features is None:
+                    features = await self.risk_features.load(user_data["id"], transaction_data.get("amount", 0))
+                transaction_flags = await self._check_transaction_patterns(user_data["id"], transaction_data, features)
                 screening_result["flags"].extend(transaction_flags)
                 
                 # High-value transaction check
@@ -204,7 +229,7 @@ class ComplianceManager:
                     screening_result["recommendations"].append("manual_review")
                 
                 # Velocity checks
-                velocity_flags = await self._check_velocity_patterns(user_data["id"], transaction_data)
+                velocity_flags = await self._check_velocity_patterns(user_data["id"], transaction_data, features)
                 screening_result["flags"].extend(velocity_flags)
             
             # Set final risk level
@@ -234,31 +259,37 @@ class ComplianceManager:
     
     async def _check_sanctions_list(self, user_data: Dict) -> Dict:
         """Check user against sanctions lists"""
-        # In production, this would check against OFAC SDN, EU sanctions, etc.
-        # For simulation, we'll check against a mock list
-        
-        name = user_data.get("full_name", "").lower()
-        
-        # Mock sanctions check (in production, use real API)
-        sanctions_names = ["john doe", "jane smith"]  # Mock sanctioned names
-        
-        if any(sanctioned in name for sanctioned in sanctions_names):
-            return {"status": "match", "list": "OFAC_SDN", "confidence": 0.95}
+        matches = sanctions_screener.screen(user_data.get("full_name", ""), list_type="sanctions")
+        if matches:
+            best = matches[0]
+            return {
+                # Fuzzy hits below the block threshold are reviewed, not refused
+                "status": "match" if sanctions_screener.blocking(matches) else "possible_match",
+                "list": best["list"],
+                "entry_id": best["entry_id"],
+                "confidence": best["score"],
+                "matches": matches
+            }
         
         return {"status": "clear"}
     
     async def _check_pep_list(self, user_data: Dict) -> Dict:
         """Check if user is a Politically Exposed Person"""
-        # In production, this would check against PEP databases
-        name = user_data.get("full_name", "").lower()
+        name = user_data.get("full_name", "")
         
-        # Mock PEP check
-        if "governor" in name or "mayor" in name or "senator" in name:
+        matches = sanctions_screener.screen(name, list_type="pep")
+        if matches:
+            return {"status": "match", "entry_id": matches[0]["entry_id"], "confidence": matches[0]["score"]}
+        
+        # Titles in the name field also indicate a PEP
+        lowered = name.lower()
+        if "governor" in lowered or "mayor" in lowered or "senator" in lowered:
             return {"status": "match", "confidence": 0.80}
         
         return {"status": "clear"}
     
-    async def _check_transaction_patterns(self, user_id: str, transaction_data: Dict) -> List[str]:
+    async def _check_transaction_patterns(self, user_id: str, transaction_data: Dict,
+                                          features: Dict) -> List[str]:
         """Check for suspicious transaction patterns"""
         flags = []
         
@@ -268,78 +299,34 @@ class ComplianceManager:
             flags.append("round_amount")
         
         # Check for frequent same-amount transactions
-        same_amount_count = await self.db.transactions.count_documents({
-            "from_user_id": user_id,
-            "amount": amount,
-            "created_at": {"$gte": datetime.utcnow() - timedelta(days=7)},
-            "status": "completed"
-        })
-        
-        if same_amount_count >= 3:
+        if features["completed_same_amount_7d"] >= 3:
             flags.append("repeated_amounts")
         
         return flags
     
-    async def _check_velocity_patterns(self, user_id: str, transaction_data: Dict) -> List[str]:
+    async def _check_velocity_patterns(self, user_id: str, transaction_data: Dict,
+                                       features: Dict) -> List[str]:
         """Check transaction velocity patterns"""
         flags = []
         
         # Check transactions in last hour
-        hour_ago = datetime.utcnow() - timedelta(hours=1)
-        recent_count = await self.db.transactions.count_documents({
-            "from_user_id": user_id,
-            "created_at": {"$gte": hour_ago},
-            "status": "completed"
-        })
-        
-        if recent_count > 5:
+        if features["completed_count_1h"] > 5:
             flags.append("high_velocity")
         
         # Check total amount in last 24 hours
-        day_ago = datetime.utcnow() - timedelta(days=1)
-        daily_pipeline = [
-            {
-                "$match": {
-                    "from_user_id": user_id,
-                    "created_at": {"$gte": day_ago},
-                    "status": "completed"
-                }
-            },
-            {
-                "$group": {
-                    "_id": None,
-                    "total": {"$sum": "$amount"}
-                }
-            }
-        ]
-        
-        daily_total = await self.db.transactions.aggregate(daily_pipeline).to_list(1)
-        if daily_total and daily_total[0]["total"] > 10000:
+        if features["completed_amount_24h"] > 10000:
             flags.append("high_daily_volume")
         
         return flags
     
     async def _create_alert(self, alert_data: Dict):
-        """Create compliance alert"""
-        alert = {
-            "id": str(uuid.uuid4()),
-            "created_at": datetime.utcnow(),
-            "status": "open",
-            "reviewed_by": None,
-            "resolved_at": None,
-            **alert_data
-        }
-        
-        await self.db.alerts.insert_one(alert)
-        logger.warning(f"Compliance alert created: {alert['type']} for user {alert.get('user_id')}")
+        """Create compliance alert, or count a repeat against the open one"""
+        return await self.alerts.raise_alert(alert_data)
     
     async def _log_compliance_action(self, action_data: Dict):
         """Log compliance action for audit trail"""
-        try:
-            action_data["id"] = str(uuid.uuid4())
-            await self.db.compliance_logs.insert_one(action_data)
-        except Exception as e:
-            logger.error(f"Error logging compliance action: {e}")
+        action_data["id"] = str(uuid.uuid4())
+        self.audit_log.write(action_data)
     
     async def generate_sar_report(self, user_id: str, transaction_ids: List[str]) -> Dict:
         """Generate Suspicious Activity Report (SAR)"""
@@ -413,8 +400,10 @@ class ComplianceManager:
 class FraudDetectionEngine:
     """Advanced fraud detection for DalePay"""
     
-    def __init__(self, db: AsyncIOMotorDatabase):
+    def __init__(self, db: AsyncIOMotorDatabase, risk_features=None, alerts=None):
         self.db = db
+        self.risk_features = risk_features or get_risk_feature_loader(db, get_velocity_counters(db))
+        self.alerts = alerts or get_alert_store(db)
         self.risk_scoring_weights = {
             "velocity": 0.3,
             "amount_patterns": 0.25,
@@ -423,20 +412,23 @@ class FraudDetectionEngine:
             "time_patterns": 0.1
         }
     
-    async def analyze_transaction(self, user_id: str, transaction_data: Dict) -> Dict:
-        """Real-time fraud analysis for transactions"""
+    async def analyze_transaction(self, user_id: str, transaction_data: Dict,
+                                  features: Optional[Dict] = None) -> Dict:
+        """Real-time fraud analysis; features can be shared with AML screening"""
         try:
             fraud_score = 0.0
             risk_factors = []
+            if features is None:
+                features = await self.risk_features.load(user_id, transaction_data.get("amount", 0))
             
             # Velocity analysis
-            velocity_score = await self._analyze_velocity(user_id, transaction_data)
+            velocity_score = await self._analyze_velocity(user_id, transaction_data, features)
             fraud_score += velocity_score * self.risk_scoring_weights["velocity"]
             if velocity_score > 0.7:
                 risk_factors.append("high_velocity")
             
             # Amount pattern analysis
-            amount_score = await self._analyze_amount_patterns(user_id, transaction_data)
+            amount_score = await self._analyze_amount_patterns(user_id, transaction_data, features)
             fraud_score += amount_score * self.risk_scoring_weights["amount_patterns"]
             if amount_score > 0.6:
                 risk_factors.append("suspicious_amounts")
@@ -485,15 +477,10 @@ class FraudDetectionEngine:
             logger.error(f"Fraud analysis error: {e}")
             return {"risk_level": "high", "recommendation": "manual_review", "error": str(e)}
     
-    async def _analyze_velocity(self, user_id: str, transaction_data: Dict) -> float:
+    async def _analyze_velocity(self, user_id: str, transaction_data: Dict, features: Dict) -> float:
         """Analyze transaction velocity patterns"""
-        hour_ago = datetime.utcnow() - timedelta(hours=1)
-        
-        # Count transactions in last hour
-        recent_count = await self.db.transactions.count_documents({
-            "from_user_id": user_id,
-            "created_at": {"$gte": hour_ago}
-        })
+        # Transactions in last hour
+        recent_count = features["count_1h"]
         
         # Normal velocity threshold
         if recent_count > 10:
@@ -505,7 +492,7 @@ class FraudDetectionEngine:
         else:
             return 0.1
     
-    async def _analyze_amount_patterns(self, user_id: str, transaction_data: Dict) -> float:
+    async def _analyze_amount_patterns(self, user_id: str, transaction_data: Dict, features: Dict) -> float:
         """Analyze suspicious amount patterns"""
         amount = transaction_data.get("amount", 0)
         risk_score = 0.0
@@ -519,14 +506,7 @@ class FraudDetectionEngine:
             risk_score += 0.8  # High risk for structuring
         
         # Check for repeated exact amounts
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        same_amount_count = await self.db.transactions.count_documents({
-            "from_user_id": user_id,
-            "amount": amount,
-            "created_at": {"$gte": week_ago}
-        })
-        
-        if same_amount_count >= 3:
+        if features["same_amount_7d"] >= 3:
             risk_score += 0.5
         
         return min(risk_score, 1.0)
@@ -546,17 +526,11 @@ class FraudDetectionEngine:
         return 0.1
     
     async def _create_fraud_alert(self, fraud_analysis: Dict):
-        """Create fraud alert"""
-        alert = {
-            "id": str(uuid.uuid4()),
+        """Create fraud alert, or count a repeat against the open one"""
+        await self.alerts.raise_alert({
             "type": "fraud_alert",
             "user_id": fraud_analysis["user_id"],
             "description": f"Fraud score: {fraud_analysis['fraud_score']:.2f} - {', '.join(fraud_analysis['risk_factors'])}",
             "severity": "high" if fraud_analysis["risk_level"] == "high" else "medium",
-            "status": "open",
-            "created_at": datetime.utcnow(),
             "data": fraud_analysis
-        }
-        
-        await self.db.alerts.insert_one(alert)
-        logger.warning(f"Fraud alert created for user {fraud_analysis['user_id']}")
+        })
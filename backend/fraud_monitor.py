@@ -0,0 +1,349 @@
+"""
+DalePay Fraud Monitor
+Watches new transactions and flags transfer bursts within seconds
+"""
+
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from bisect import insort
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure, PyMongoError
+
+from alerts import get_alert_store
+
+logger = logging.getLogger(__name__)
+
+STATE_ID = "transactions"
+
+# Server error codes meaning change streams cannot be used here
+CHANGE_STREAMS_NOT_SUPPORTED = {40573, 40324}
+CHANGE_STREAM_HISTORY_LOST = 286
+
+def _amount_cents(transaction: Dict[str, Any]) -> int:
+    cents = transaction.get("amount_cents")
+    if cents is None:
+        cents = round((transaction.get("amount") or 0) * 100)
+    return cents
+
+class FraudMonitor:
+    """Streams completed transactions into per-sender sliding windows.
+
+    The monitor tails inserts on transactions with a change stream, or on a
+    standalone mongod by polling in _id order. _id is assigned at insert,
+    so rows written with an earlier created_at (batch payouts) are still
+    seen; a change stream opened without a resume token first catches up
+    from the last _id processed. Every sender keeps a window of their recent transfers in memory; more than
+    max_transfers or more than max_amount_cents within window_seconds raises
+    a fraud alert, at most once per window per sender. The stream position
+    (resume token, or last _id for polling) is checkpointed in
+    fraud_monitor_state, so a restart resumes where the last run stopped
+    and windows are refilled from the last window_seconds of transactions.
+    A lease on the same document keeps the monitor to one worker.
+    """
+
+    def __init__(self, db, window_seconds: int = 600, max_transfers: int = 5,
+                 max_amount_cents: int = 500000, lease_seconds: int = 30,
+                 poll_seconds: float = 2.0, checkpoint_seconds: float = 5.0, enabled: bool = True,
+                 alerts=None):
+        self.db = db
+        self.alerts = alerts or get_alert_store(db)
+        self.enabled = enabled
+        self.window = timedelta(seconds=window_seconds)
+        self.max_transfers = max_transfers
+        self.max_amount_cents = max_amount_cents
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.checkpoint_seconds = checkpoint_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.mode: Optional[str] = None
+        self.leader = False
+        self._windows: Dict[str, deque] = {}
+        self._alerted_at: Dict[str, datetime] = {}
+        self._position: Dict[str, Any] = {}
+        self._dirty = False
+        self._last_checkpoint = 0.0
+        self._last_renewal = 0.0
+        self._last_event_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {"events": 0, "alerts": 0, "checkpoints": 0, "history_lost": 0, "errors": 0}
+
+    def start(self):
+        """Start competing for the lease and tailing transactions"""
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                if await self._acquire_lease():
+                    await self._tail()
+                else:
+                    await asyncio.sleep(self.lease_seconds / 3)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.counters["errors"] += 1
+                logger.error(f"Fraud monitor error: {e}")
+                await asyncio.sleep(self.poll_seconds)
+            finally:
+                self.leader = False
+
+    async def _acquire_lease(self) -> bool:
+        now = datetime.utcnow()
+        state = await self.db.fraud_monitor_state.find_one_and_update(
+            {"_id": STATE_ID, "$or": [{"lease_owner": self.owner}, {"lease_until": {"$lt": now}}, {"lease_until": None}]},
+            {"$set": {"lease_owner": self.owner, "lease_until": now + timedelta(seconds=self.lease_seconds)}},
+            return_document=ReturnDocument.AFTER
+        )
+        if state is None:
+            # First start ever, or another worker holds the lease
+            try:
+                await self.db.fraud_monitor_state.insert_one({
+                    "_id": STATE_ID,
+                    "lease_owner": self.owner,
+                    "lease_until": now + timedelta(seconds=self.lease_seconds),
+                    "resume_token": None,
+                    "last_created_at": None,
+                    "last_object_id": None
+                })
+                state = {}
+            except PyMongoError:
+                return False
+        self._position = {
+            "resume_token": state.get("resume_token"),
+            "last_created_at": state.get("last_created_at"),
+            "last_object_id": state.get("last_object_id")
+        }
+        self._last_renewal = time.monotonic()
+        self.leader = True
+        return True
+
+    async def _keep_lease(self) -> bool:
+        """Renew the lease and checkpoint when due; False once the lease is lost"""
+        now = time.monotonic()
+        if self._dirty and now - self._last_checkpoint >= self.checkpoint_seconds:
+            await self._checkpoint()
+        if now - self._last_renewal < self.lease_seconds / 3:
+            return True
+        result = await self.db.fraud_monitor_state.update_one(
+            {"_id": STATE_ID, "lease_owner": self.owner},
+            {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}}
+        )
+        self._last_renewal = now
+        if result.matched_count == 0:
+            logger.warning("Fraud monitor lost its lease, standing by")
+            return False
+        return True
+
+    async def _checkpoint(self):
+        await self.db.fraud_monitor_state.update_one(
+            {"_id": STATE_ID, "lease_owner": self.owner},
+            {"$set": {**self._position, "checkpointed_at": datetime.utcnow()}}
+        )
+        self._dirty = False
+        self._last_checkpoint = time.monotonic()
+        self.counters["checkpoints"] += 1
+
+    async def _warm_windows(self):
+        """Refill sender windows from transactions the last run already saw"""
+        self._windows.clear()
+        until = self._position.get("last_created_at")
+        if until is None:
+            return
+        cursor = self.db.transactions.find(
+            {"status": "completed", "created_at": {"$gte": until - self.window, "$lte": until}},
+            {"_id": 0, "from_user_id": 1, "created_at": 1, "amount_cents": 1, "amount": 1}
+        ).sort("created_at", 1)
+        async for transaction in cursor:
+            self._add(transaction)
+
+    async def _tail(self):
+        await self._warm_windows()
+        if self.mode != "polling":
+            try:
+                await self._tail_change_stream()
+                return
+            except OperationFailure as e:
+                if e.code not in CHANGE_STREAMS_NOT_SUPPORTED:
+                    raise
+                logger.warning("Change streams not supported, fraud monitor is polling transactions")
+        self.mode = "polling"
+        await self._tail_polling()
+
+    async def _tail_change_stream(self):
+        pipeline = [{"$match": {"operationType": "insert", "fullDocument.status": "completed"}}]
+        token = self._position.get("resume_token")
+        # The stream is opened on the first read, which is where an unusable resume token fails
+        try:
+            stream = self.db.transactions.watch(pipeline, resume_after=token, max_await_time_ms=1000)
+            change = await stream.try_next()
+        except OperationFailure as e:
+            if e.code != CHANGE_STREAM_HISTORY_LOST or token is None:
+                raise
+            self.counters["history_lost"] += 1
+            logger.error("Fraud monitor resume point is no longer in the oplog, catching up from transactions")
+            token = None
+            stream = self.db.transactions.watch(pipeline, max_await_time_ms=1000)
+            change = await stream.try_next()
+        self.mode = "change_stream"
+
+        # A stream started from now misses whatever was inserted since the last
+        # position; read that from the collection, then skip it in the stream
+        caught_up = await self._catch_up() if token is None else set()
+
+        async with stream:
+            while True:
+                if change is not None and change["fullDocument"]["_id"] not in caught_up:
+                    await self._process(change["fullDocument"])
+                self._position["resume_token"] = stream.resume_token
+                self._dirty = True
+                if not await self._keep_lease():
+                    return
+                change = await stream.try_next()
+
+    def _start_object_id(self) -> Optional[ObjectId]:
+        """_id to read on from; states checkpointed before _id keys fall back to their timestamp"""
+        if self._position.get("last_object_id") is not None:
+            return self._position["last_object_id"]
+        if self._position.get("last_created_at") is not None:
+            return ObjectId.from_datetime(self._position["last_created_at"])
+        return None
+
+    async def _poll_once(self, until: Optional[ObjectId] = None, limit: int = 1000) -> list:
+        """Process the next completed transactions after the last _id, oldest first"""
+        after = self._start_object_id()
+        if after is None:
+            after = self._position["last_object_id"] = ObjectId.from_datetime(datetime.utcnow())
+        id_range = {"$gt": after}
+        if until is not None:
+            id_range["$lt"] = until
+        batch = await self.db.transactions.find(
+            {"status": "completed", "_id": id_range},
+            {"_id": 1, "id": 1, "from_user_id": 1, "created_at": 1, "amount_cents": 1, "amount": 1}
+        ).sort("_id", 1).limit(limit).to_list(None)
+        for transaction in batch:
+            await self._process(transaction)
+        return batch
+
+    async def _catch_up(self) -> set:
+        """Process everything inserted since the last position; returns the _ids seen"""
+        if self._start_object_id() is None:
+            return set()
+        seen = set()
+        while True:
+            batch = await self._poll_once()
+            seen.update(transaction["_id"] for transaction in batch)
+            if len(batch) < 1000:
+                return seen
+
+    async def _tail_polling(self):
+        while await self._keep_lease():
+            # Stay a little behind now: _id comes from the inserting client's
+            # clock, so a row from another worker can land slightly out of order
+            settled = ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=self.poll_seconds))
+            batch = await self._poll_once(settled)
+            if len(batch) < 1000:
+                await asyncio.sleep(self.poll_seconds)
+
+    def _add(self, transaction: Dict[str, Any]) -> deque:
+        window = self._windows.setdefault(transaction["from_user_id"], deque())
+        entry = (transaction["created_at"], _amount_cents(transaction))
+        if window and entry[0] < window[-1][0]:
+            # Batch payouts can arrive with a created_at behind the newest transfer
+            insort(window, entry)
+        else:
+            window.append(entry)
+        while window[0][0] < window[-1][0] - self.window:
+            window.popleft()
+        return window
+
+    async def _process(self, transaction: Dict[str, Any]):
+        self.counters["events"] += 1
+        self._last_event_at = transaction["created_at"]
+        last_created_at = self._position.get("last_created_at")
+        if last_created_at is None or transaction["created_at"] > last_created_at:
+            self._position["last_created_at"] = transaction["created_at"]
+        self._position["last_object_id"] = transaction["_id"]
+        self._dirty = True
+
+        if self.counters["events"] % 1000 == 0:
+            self._prune(transaction["created_at"])
+
+        user_id = transaction["from_user_id"]
+        window = self._add(transaction)
+        count = len(window)
+        total_cents = sum(amount for _, amount in window)
+        if count <= self.max_transfers and total_cents <= self.max_amount_cents:
+            return
+        alerted_at = self._alerted_at.get(user_id)
+        if alerted_at is not None and transaction["created_at"] - alerted_at < self.window:
+            return
+        self._alerted_at[user_id] = transaction["created_at"]
+        await self._raise_alert(user_id, count, total_cents)
+
+    def _prune(self, now: datetime):
+        # Forget senders with nothing left in their window
+        for user_id in [user_id for user_id, window in self._windows.items() if window[-1][0] < now - self.window]:
+            del self._windows[user_id]
+        for user_id in [user_id for user_id, at in self._alerted_at.items() if at < now - self.window]:
+            del self._alerted_at[user_id]
+
+    async def _raise_alert(self, user_id: str, count: int, total_cents: int):
+        total = total_cents / 100
+        window_minutes = int(self.window.total_seconds() // 60)
+        await self.alerts.raise_alert({
+            "type": "fraud_alert",
+            "user_id": user_id,
+            "description": f"Suspicious activity: {count} transfers totaling ${total} in {window_minutes} minutes",
+            "severity": "high",
+            "data": {"source": "fraud_monitor", "transfer_count": count, "total_amount": total}
+        })
+        self.counters["alerts"] += 1
+        logger.warning(f"Fraud monitor alert for user {user_id}: {count} transfers, ${total}")
+
+    async def shutdown(self):
+        """Checkpoint, stop tailing and release the lease"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        if self._position:
+            await self.db.fraud_monitor_state.update_one(
+                {"_id": STATE_ID, "lease_owner": self.owner},
+                {"$set": {**self._position, "lease_owner": None, "lease_until": None}}
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """Monitor statistics for the admin performance view"""
+        return {
+            "enabled": self.enabled,
+            "leader": self.leader,
+            "mode": self.mode,
+            "tracked_users": len(self._windows),
+            "lag_seconds": round((datetime.utcnow() - self._last_event_at).total_seconds(), 3)
+                           if self._last_event_at else None,
+            **self.counters
+        }
+
+def get_fraud_monitor(db, alerts=None):
+    """Get fraud monitor instance"""
+    return FraudMonitor(
+        db,
+        window_seconds=int(os.getenv('FRAUD_WINDOW_SECONDS', '600')),
+        max_transfers=int(os.getenv('FRAUD_MAX_TRANSFERS', '5')),
+        max_amount_cents=int(float(os.getenv('FRAUD_MAX_AMOUNT', '5000')) * 100),
+        enabled=os.getenv('FRAUD_MONITOR_ENABLED', 'true').lower() == 'true',
+        alerts=alerts
+    )
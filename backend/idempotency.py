@@ -0,0 +1,242 @@
+"""
+DalePay Idempotency Store
+Replays completed responses for retried money-moving requests
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import uuid
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+
+class IdempotencyStore:
+    """Idempotency-Key handling backed by a TTL-indexed collection.
+
+    A key is scoped to the user and endpoint. The first request inserts an
+    in_progress record and runs the handler; its response is stored and
+    replayed for every retry until the record expires. Duplicates arriving
+    while the first request is still running wait for its result: in-process
+    duplicates await the same task, duplicates on other workers poll the
+    record. A handler that fails deletes its record so the client can retry.
+
+    The handler runs shielded, so a client disconnecting mid-request cannot
+    cancel it between the money moving and the response being stored. The
+    in_progress record carries a lease (locked_until) that the owner renews
+    while the handler runs; if the owning worker dies, a retry takes the
+    record over once the lease lapses instead of getting 409 until the TTL.
+    Renewal runs every lease_seconds / 3, retrying sooner after an error, so
+    a slow handler keeps its record; an owner whose record was taken over
+    anyway logs the lost lease and the lost completion as errors.
+    """
+
+    def __init__(self, db, ttl_seconds: int = 86400, hot_entries: int = 10000,
+                 wait_timeout: float = 30.0, lease_seconds: float = 30.0):
+        self.collection = db.idempotency_keys
+        self.ttl_seconds = ttl_seconds
+        self.hot_entries = hot_entries
+        self.wait_timeout = wait_timeout
+        self.lease_seconds = lease_seconds
+        self._completed: "OrderedDict[str, tuple]" = OrderedDict()
+        self._in_flight: Dict[str, tuple] = {}
+        self.counters = {
+            "executions": 0,
+            "hot_hits": 0,
+            "stored_hits": 0,
+            "in_flight_waits": 0,
+            "fingerprint_mismatches": 0,
+            "takeovers": 0,
+            "leases_lost": 0,
+            "completions_lost": 0
+        }
+
+    def _fingerprint(self, payload: Any) -> str:
+        encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def _remember(self, scope: str, fingerprint: str, response: Any):
+        self._completed[scope] = (time.monotonic() + self.ttl_seconds, fingerprint, response)
+        self._completed.move_to_end(scope)
+        while len(self._completed) > self.hot_entries:
+            self._completed.popitem(last=False)
+
+    def _recall(self, scope: str) -> Optional[tuple]:
+        entry = self._completed.get(scope)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._completed[scope]
+            return None
+        return entry
+
+    def _check_fingerprint(self, expected: str, actual: str):
+        if expected != actual:
+            self.counters["fingerprint_mismatches"] += 1
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used with a different request"
+            )
+
+    async def run(self, key: Optional[str], user_id: str, endpoint: str, payload: Any,
+                  handler: Callable[[], Awaitable[Any]]) -> Any:
+        """Run handler once per key, replaying its response for retries"""
+        if not key:
+            return await handler()
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail="Idempotency-Key too long")
+
+        scope = f"{user_id}:{endpoint}:{key}"
+        fingerprint = self._fingerprint(payload)
+
+        cached = self._recall(scope)
+        if cached is not None:
+            self._check_fingerprint(cached[1], fingerprint)
+            self.counters["hot_hits"] += 1
+            return cached[2]
+
+        pending = self._in_flight.get(scope)
+        if pending is not None:
+            self.counters["in_flight_waits"] += 1
+            fingerprint_of_pending, task = pending
+            self._check_fingerprint(fingerprint_of_pending, fingerprint)
+            return await asyncio.shield(task)
+
+        # Cancelling the request must not cancel the handler once money may have moved
+        task = asyncio.ensure_future(self._execute(scope, fingerprint, handler))
+        self._in_flight[scope] = (fingerprint, task)
+        task.add_done_callback(lambda done: self._finished(scope, done))
+        return await asyncio.shield(task)
+
+    def _finished(self, scope: str, task: asyncio.Future):
+        self._in_flight.pop(scope, None)
+        # Mark the exception retrieved when the caller was cancelled and nobody awaited it
+        if not task.cancelled():
+            task.exception()
+
+    async def _acquire(self, scope: str, fingerprint: str, owner: str) -> Optional[Dict[str, Any]]:
+        """Own the record for scope, or return its completed record"""
+        deadline = time.monotonic() + self.wait_timeout
+        delay = 0.05
+        while True:
+            now = datetime.utcnow()
+            try:
+                await self.collection.insert_one({
+                    "_id": scope,
+                    "fingerprint": fingerprint,
+                    "status": "in_progress",
+                    "owner": owner,
+                    "locked_until": now + timedelta(seconds=self.lease_seconds),
+                    "created_at": now
+                })
+                return None
+            except DuplicateKeyError:
+                record = await self.collection.find_one({"_id": scope})
+
+            if record is not None:
+                self._check_fingerprint(record["fingerprint"], fingerprint)
+                if record["status"] == "completed":
+                    return record
+
+                # The owner stopped renewing its lease, so it died mid-request
+                locked_until = record.get("locked_until") or record["created_at"] + timedelta(seconds=self.lease_seconds)
+                if locked_until < now:
+                    taken = await self.collection.find_one_and_update(
+                        {"_id": scope, "status": "in_progress", "locked_until": record.get("locked_until")},
+                        {"$set": {"owner": owner, "locked_until": now + timedelta(seconds=self.lease_seconds)}}
+                    )
+                    if taken is not None:
+                        self.counters["takeovers"] += 1
+                        logger.warning(f"Took over idempotency record with a lapsed lease: {scope}")
+                        return None
+                    continue
+
+            # Another worker is running this request; wait for its outcome
+            if time.monotonic() >= deadline:
+                raise HTTPException(
+                    status_code=409,
+                    detail="A request with this Idempotency-Key is still being processed"
+                )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    async def _renew(self, scope: str, owner: str):
+        interval = self.lease_seconds / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                result = await self.collection.update_one(
+                    {"_id": scope, "owner": owner, "status": "in_progress"},
+                    {"$set": {"locked_until": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}}
+                )
+            except Exception as e:
+                # Still inside the lease; try again before it lapses
+                logger.error(f"Error renewing idempotency lease for {scope}: {e}")
+                interval = self.lease_seconds / 10
+                continue
+            if result.matched_count == 0:
+                self.counters["leases_lost"] += 1
+                logger.error(f"Idempotency lease lost while the handler was running, a retry may run it again: {scope}")
+                return
+            interval = self.lease_seconds / 3
+
+    async def _execute(self, scope: str, fingerprint: str, handler: Callable[[], Awaitable[Any]]) -> Any:
+        owner = uuid.uuid4().hex
+        record = await self._acquire(scope, fingerprint, owner)
+        if record is not None:
+            self.counters["stored_hits"] += 1
+            self._remember(scope, fingerprint, record["response"])
+            return record["response"]
+
+        self.counters["executions"] += 1
+        renewal = asyncio.ensure_future(self._renew(scope, owner))
+        try:
+            response = jsonable_encoder(await handler())
+        except asyncio.CancelledError:
+            # Only shutdown cancels a shielded handler; the lapsed lease lets a retry take over
+            raise
+        except BaseException:
+            await self.collection.delete_one({"_id": scope, "owner": owner, "status": "in_progress"})
+            raise
+        finally:
+            renewal.cancel()
+
+        result = await self.collection.update_one(
+            {"_id": scope, "owner": owner},
+            {"$set": {"status": "completed", "response": response, "completed_at": datetime.utcnow()},
+             "$unset": {"locked_until": ""}}
+        )
+        if result.matched_count == 0:
+            # Another worker took the record over, so the handler may have run twice
+            self.counters["completions_lost"] += 1
+            logger.error(f"Idempotency record taken over before completion, response not stored: {scope}")
+        self._remember(scope, fingerprint, response)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        """Idempotency statistics for the admin performance view"""
+        return {
+            "hot_entries": len(self._completed),
+            "in_flight": len(self._in_flight),
+            **self.counters
+        }
+
+def get_idempotency_store(db):
+    """Get idempotency store instance"""
+    return IdempotencyStore(
+        db,
+        ttl_seconds=int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400')),
+        hot_entries=int(os.getenv('IDEMPOTENCY_HOT_ENTRIES', '10000')),
+        lease_seconds=float(os.getenv('IDEMPOTENCY_LEASE_SECONDS', '30'))
+    )
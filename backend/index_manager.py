@@ -0,0 +1,244 @@
+"""
+DalePay Index Manager
+Declares the indexes every query path depends on and provisions them at startup
+"""
+
+import os
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Options that change what an index does; anything else (background, v) is ignored when comparing
+SIGNIFICANT_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+def _index(keys, name: str, **options) -> IndexModel:
+    return IndexModel(keys, name=name, background=True, **options)
+
+# Indexes behind the API routes, ComplianceManager, FraudDetectionEngine and AIQualityOfficer
+DECLARED_INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        # get_current_user, ledger and transfer lookups
+        _index([("id", ASCENDING)], "id_unique", unique=True),
+        # login, registration and send-by-email
+        _index([("email", ASCENDING)], "email_unique", unique=True),
+        # send-by-phone
+        _index([("phone", ASCENDING)], "phone", sparse=True),
+        # admin user filters and the pending KYC scan
+        _index([("account_status", ASCENDING)], "account_status"),
+        _index([("kyc_status", ASCENDING), ("created_at", ASCENDING)], "kyc_status_created_at"),
+        # clearing matches on watchlist entries that changed or were removed
+        _index([("screening.matches.entry_id", ASCENDING)], "screening_match_entry", sparse=True)
+    ],
+    "transactions": [
+        # moov_wallet rows have transaction_id and no id
+        _index([("id", ASCENDING)], "id_unique", unique=True, sparse=True),
+        # history pages, velocity and amount checks for the sending side
+        _index([("from_user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+               "from_user_created_at__id"),
+        _index([("to_user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+               "to_user_created_at__id"),
+        # failed-transaction scan and admin status filter
+        _index([("status", ASCENDING), ("created_at", DESCENDING)], "status_created_at"),
+        # dashboard daily totals and the fraud scan window
+        _index([("created_at", DESCENDING)], "created_at")
+    ],
+    "ledger_entries": [
+        _index([("account_id", ASCENDING), ("posted_at", DESCENDING)], "account_posted_at"),
+        _index([("transaction_id", ASCENDING)], "transaction_id")
+    ],
+    "ledger_snapshots": [
+        _index([("account_id", ASCENDING), ("as_of", DESCENDING)], "account_as_of")
+    ],
+    "idempotency_keys": [
+        _index([("created_at", ASCENDING)], "created_at_ttl",
+               expireAfterSeconds=int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400')))
+    ],
+    "velocity_counters": [
+        # one range read per risk check
+        _index([("user_id", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)],
+               "user_granularity_bucket"),
+        _index([("expires_at", ASCENDING)], "expires_at_ttl", expireAfterSeconds=0)
+    ],
+    "wallets": [
+        _index([("user_id", ASCENDING)], "user_id"),
+        _index([("wallet_id", ASCENDING)], "wallet_id_unique", unique=True, sparse=True)
+    ],
+    "bank_accounts": [
+        _index([("user_id", ASCENDING)], "user_id")
+    ],
+    "real_bank_accounts": [
+        _index([("user_id", ASCENDING), ("is_active", ASCENDING)], "user_active"),
+        _index([("user_id", ASCENDING), ("account_id", ASCENDING)], "user_account")
+    ],
+    "real_transfers": [
+        _index([("user_id", ASCENDING), ("created_at", DESCENDING)], "user_created_at")
+    ],
+    "alerts": [
+        _index([("status", ASCENDING), ("created_at", DESCENDING)], "status_created_at"),
+        # analyst queue, most recently active first
+        _index([("status", ASCENDING), ("last_seen_at", DESCENDING)], "status_last_seen_at"),
+        # one open alert per user, type and time bucket
+        _index([("dedup_key", ASCENDING)], "open_dedup_key_unique", unique=True,
+               partialFilterExpression={"status": "open", "dedup_key": {"$exists": True}})
+    ],
+    "compliance_logs": [
+        _index([("timestamp", DESCENDING)], "timestamp"),
+        _index([("action", ASCENDING), ("timestamp", DESCENDING)], "action_timestamp")
+    ],
+    "metric_rollups": [
+        # dashboard and series reads
+        _index([("granularity", ASCENDING), ("bucket", ASCENDING)], "granularity_bucket"),
+        _index([("expires_at", ASCENDING)], "expires_at_ttl", expireAfterSeconds=0)
+    ],
+    "rescreening_jobs": [
+        _index([("started_at", DESCENDING)], "started_at")
+    ],
+    "ai_scans": [
+        _index([("timestamp", DESCENDING)], "timestamp")
+    ]
+}
+
+def _key_of(spec: Dict[str, Any]) -> List[tuple]:
+    return [(field, int(direction) if isinstance(direction, (int, float)) else direction)
+            for field, direction in spec["key"].items()]
+
+def _options_of(spec: Dict[str, Any]) -> Dict[str, Any]:
+    return {option: spec[option] for option in SIGNIFICANT_OPTIONS if option in spec}
+
+class IndexManager:
+    """Reconciles the declared indexes with what exists in MongoDB.
+
+    Reconciling only creates indexes that are missing, so it is safe to run on
+    every startup. Existing indexes whose options differ are reported rather
+    than dropped, except TTL windows which are changed in place with collMod.
+    """
+
+    def __init__(self, db, declared: Dict[str, List[IndexModel]] = None):
+        self.db = db
+        self.declared = declared if declared is not None else DECLARED_INDEXES
+        self.last_reconcile: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Reconcile in the background so index builds never hold up startup"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.reconcile())
+
+    async def reconcile(self) -> Dict[str, Any]:
+        """Create missing indexes and report conflicting ones"""
+        started = datetime.utcnow()
+        summary = {"created": [], "existing": [], "updated": [], "conflicts": [], "failed": []}
+
+        for collection_name, models in self.declared.items():
+            collection = self.db[collection_name]
+            try:
+                existing = {spec["name"]: spec async for spec in collection.list_indexes()}
+            except PyMongoError as e:
+                logger.error(f"Could not list indexes on {collection_name}: {e}")
+                summary["failed"].extend(f"{collection_name}.{m.document['name']}" for m in models)
+                continue
+            by_key = {tuple(_key_of(spec)): spec for spec in existing.values()}
+
+            for model in models:
+                wanted = model.document
+                label = f"{collection_name}.{wanted['name']}"
+                current = existing.get(wanted["name"]) or by_key.get(tuple(_key_of(wanted)))
+
+                if current is None:
+                    try:
+                        await collection.create_indexes([model])
+                        summary["created"].append(label)
+                        logger.info(f"Created index {label}")
+                    except PyMongoError as e:
+                        summary["failed"].append(label)
+                        logger.error(f"Failed to create index {label}: {e}")
+                    continue
+
+                if _key_of(current) == _key_of(wanted) and _options_of(current) == _options_of(wanted):
+                    summary["existing"].append(label)
+                    continue
+
+                if (_key_of(current) == _key_of(wanted) and "expireAfterSeconds" in wanted
+                        and "expireAfterSeconds" in current):
+                    try:
+                        await self.db.command({
+                            "collMod": collection_name,
+                            "index": {"name": current["name"], "expireAfterSeconds": wanted["expireAfterSeconds"]}
+                        })
+                        summary["updated"].append(label)
+                        continue
+                    except PyMongoError as e:
+                        logger.error(f"Failed to update TTL on {label}: {e}")
+
+                summary["conflicts"].append(label)
+                logger.warning(f"Index {label} exists as {current['name']} with different options")
+
+        summary["duration_ms"] = round((datetime.utcnow() - started).total_seconds() * 1000, 3)
+        summary["completed_at"] = datetime.utcnow()
+        self.last_reconcile = summary
+        logger.info(
+            f"Index reconcile: {len(summary['created'])} created, {len(summary['existing'])} existing, "
+            f"{len(summary['conflicts'])} conflicts, {len(summary['failed'])} failed"
+        )
+        return summary
+
+    async def report(self) -> Dict[str, Any]:
+        """Declared indexes that are missing, undeclared ones, and indexes no query has used"""
+        collections = []
+        for collection_name, models in self.declared.items():
+            collection = self.db[collection_name]
+            declared = {model.document["name"] for model in models}
+            try:
+                usage = await collection.aggregate([{"$indexStats": {}}]).to_list(None)
+            except PyMongoError as e:
+                collections.append({"collection": collection_name, "error": str(e)})
+                continue
+
+            present = {stat["name"]: stat for stat in usage}
+            # Reconcile adopts an existing index with the declared key under another name
+            by_key = {tuple(_key_of(stat)): name for name, stat in present.items()}
+            adopted = {}
+            for model in models:
+                name = model.document["name"]
+                if name not in present and tuple(_key_of(model.document)) in by_key:
+                    adopted[name] = by_key[tuple(_key_of(model.document))]
+            collections.append({
+                "collection": collection_name,
+                "missing": sorted(name for name in declared if name not in present and name not in adopted),
+                "undeclared": sorted(
+                    name for name in present
+                    if name not in declared and name not in adopted.values() and name != "_id_"
+                ),
+                "adopted": adopted,
+                # Counters reset when mongod restarts, so "unused" means since then
+                "unused": sorted(
+                    name for name, stat in present.items()
+                    if name != "_id_" and stat.get("accesses", {}).get("ops", 0) == 0
+                ),
+                "usage": {
+                    name: {
+                        "ops": stat.get("accesses", {}).get("ops", 0),
+                        "since": stat.get("accesses", {}).get("since")
+                    }
+                    for name, stat in present.items()
+                }
+            })
+
+        return {"collections": collections, "last_reconcile": self.last_reconcile}
+
+    def stats(self) -> Dict[str, Any]:
+        """Last reconcile outcome for the admin performance view"""
+        if self.last_reconcile is None:
+            return {"reconciled": False}
+        return {
+            "reconciled": True,
+            "completed_at": self.last_reconcile["completed_at"],
+            "duration_ms": self.last_reconcile["duration_ms"],
+            **{key: len(self.last_reconcile[key]) for key in ("created", "existing", "updated", "conflicts", "failed")}
+        }
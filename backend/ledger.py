@@ -0,0 +1,186 @@
+"""
+DalePay Ledger
+Append-only double-entry ledger in integer cents with balance snapshots
+"""
+
+import uuid
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# House accounts on the other side of non-transfer postings
+FEE_REVENUE_ACCOUNT = "dalepay:fee_revenue"
+OPENING_BALANCE_ACCOUNT = "dalepay:opening_balances"
+BALANCE_ADJUSTMENT_ACCOUNT = "dalepay:balance_adjustments"
+BATCH_HOLD_ACCOUNT = "dalepay:batch_holds"
+
+def to_cents(amount) -> int:
+    """Convert a dollar amount (Decimal, str or float) to integer cents"""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+def from_cents(cents: int) -> float:
+    """Convert integer cents to a float dollar amount for API responses"""
+    return float(Decimal(cents) / 100)
+
+def percent_of_cents(cents: int, rate: str) -> int:
+    """Apply a rate such as "0.015" to an amount in cents, rounding half up"""
+    return int((Decimal(cents) * Decimal(rate)).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+def balance_update(delta_cents: int) -> List[Dict]:
+    """Update pipeline that moves wallet_balance_cents and its float mirror together"""
+    return [
+        {"$set": {"wallet_balance_cents": {"$add": [{"$ifNull": ["$wallet_balance_cents", 0]}, delta_cents]}}},
+        {"$set": {"wallet_balance": {"$divide": ["$wallet_balance_cents", 100]}}}
+    ]
+
+def ledger_entry(transaction_id: str, account_id: str, amount_cents: int, kind: str,
+                 posted_at: datetime) -> Dict[str, Any]:
+    """Build a single ledger entry; positive amounts credit the account"""
+    return {
+        "id": str(uuid.uuid4()),
+        "transaction_id": transaction_id,
+        "account_id": account_id,
+        "amount_cents": amount_cents,
+        "kind": kind,
+        "posted_at": posted_at
+    }
+
+def transfer_entries(transaction_id: str, from_account: str, to_account: str,
+                     amount_cents: int, fee_cents: int, posted_at: datetime) -> List[Dict[str, Any]]:
+    """Balanced entries for a wallet transfer and its fee"""
+    entries = [
+        ledger_entry(transaction_id, from_account, -amount_cents, "transfer", posted_at),
+        ledger_entry(transaction_id, to_account, amount_cents, "transfer", posted_at)
+    ]
+    if fee_cents:
+        entries.append(ledger_entry(transaction_id, from_account, -fee_cents, "fee", posted_at))
+        entries.append(ledger_entry(transaction_id, FEE_REVENUE_ACCOUNT, fee_cents, "fee", posted_at))
+    return entries
+
+def opening_entries(account_id: str, amount_cents: int, posted_at: datetime) -> List[Dict[str, Any]]:
+    """Balanced entries funding a new or migrated account"""
+    transaction_id = f"opening:{account_id}"
+    return [
+        ledger_entry(transaction_id, account_id, amount_cents, "opening_balance", posted_at),
+        ledger_entry(transaction_id, OPENING_BALANCE_ACCOUNT, -amount_cents, "opening_balance", posted_at)
+    ]
+
+def hold_entries(hold_id: str, account_id: str, amount_cents: int, posted_at: datetime) -> List[Dict[str, Any]]:
+    """Balanced entries moving reserved funds from a wallet into the holds account"""
+    return [
+        ledger_entry(hold_id, account_id, -amount_cents, "hold", posted_at),
+        ledger_entry(hold_id, BATCH_HOLD_ACCOUNT, amount_cents, "hold", posted_at)
+    ]
+
+def release_entries(hold_id: str, account_id: str, amount_cents: int, posted_at: datetime) -> List[Dict[str, Any]]:
+    """Balanced entries returning held funds to the wallet they were reserved from"""
+    return [
+        ledger_entry(hold_id, account_id, amount_cents, "release", posted_at),
+        ledger_entry(hold_id, BATCH_HOLD_ACCOUNT, -amount_cents, "release", posted_at)
+    ]
+
+class Ledger:
+    """Reads and writes the ledger_entries and ledger_snapshots collections.
+
+    users.wallet_balance_cents is the spendable balance guarded by conditional
+    debits; every change to it is mirrored by entries written in the same
+    operation (see TransferEngine). A ledger balance is the latest snapshot plus the entries posted
+    after it. Snapshots only cover entries older than the settle window so an
+    entry that is still in flight is never skipped.
+    """
+
+    def __init__(self, db, settle_seconds: int = 300, snapshot_threshold: int = 500):
+        self.db = db
+        self.settle_seconds = settle_seconds
+        self.snapshot_threshold = snapshot_threshold
+
+    async def post(self, entries: List[Dict[str, Any]], session=None):
+        """Append balanced entries"""
+        if sum(entry["amount_cents"] for entry in entries) != 0:
+            raise ValueError("Ledger entries must balance to zero")
+        await self.db.ledger_entries.insert_many(entries, ordered=False, session=session)
+
+    async def _sum_entries(self, account_id: str, after: Optional[datetime],
+                           until: Optional[datetime] = None) -> Dict[str, int]:
+        posted_at = {}
+        if after is not None:
+            posted_at["$gt"] = after
+        if until is not None:
+            posted_at["$lte"] = until
+
+        match = {"account_id": account_id}
+        if posted_at:
+            match["posted_at"] = posted_at
+
+        result = await self.db.ledger_entries.aggregate([
+            {"$match": match},
+            {"$group": {"_id": None, "total": {"$sum": "$amount_cents"}, "count": {"$sum": 1}}}
+        ]).to_list(1)
+        if not result:
+            return {"total": 0, "count": 0}
+        return {"total": result[0]["total"], "count": result[0]["count"]}
+
+    async def get_balance_cents(self, account_id: str) -> int:
+        """Balance from the latest snapshot plus the entries after it"""
+        snapshot = await self.db.ledger_snapshots.find_one(
+            {"account_id": account_id},
+            sort=[("as_of", -1)]
+        )
+        after = snapshot["as_of"] if snapshot else None
+        tail = await self._sum_entries(account_id, after)
+
+        if tail["count"] >= self.snapshot_threshold:
+            await self.snapshot(account_id)
+
+        return (snapshot["balance_cents"] if snapshot else 0) + tail["total"]
+
+    async def snapshot(self, account_id: str) -> Optional[Dict[str, Any]]:
+        """Write a balance snapshot covering entries older than the settle window"""
+        previous = await self.db.ledger_snapshots.find_one(
+            {"account_id": account_id},
+            sort=[("as_of", -1)]
+        )
+        as_of = datetime.utcnow() - timedelta(seconds=self.settle_seconds)
+        if previous and previous["as_of"] >= as_of:
+            return None
+
+        after = previous["as_of"] if previous else None
+        covered = await self._sum_entries(account_id, after, as_of)
+        if covered["count"] == 0:
+            return None
+
+        snapshot = {
+            "id": str(uuid.uuid4()),
+            "account_id": account_id,
+            "balance_cents": (previous["balance_cents"] if previous else 0) + covered["total"],
+            "as_of": as_of,
+            "entry_count": covered["count"],
+            "created_at": datetime.utcnow()
+        }
+        await self.db.ledger_snapshots.insert_one(snapshot)
+        return snapshot
+
+    async def get_history(self, account_id: str, limit: int = 50,
+                          before: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Most recent entries for an account"""
+        query = {"account_id": account_id}
+        if before is not None:
+            query["posted_at"] = {"$lt": before}
+        return await self.db.ledger_entries.find(query, {"_id": 0}).sort(
+            "posted_at", -1
+        ).limit(limit).to_list(limit)
+
+    async def reconcile(self, user_id: str) -> Dict[str, Any]:
+        """Compare a wallet's spendable balance with its ledger balance"""
+        user = await self.db.users.find_one({"id": user_id}, {"_id": 0, "wallet_balance_cents": 1})
+        wallet_cents = user.get("wallet_balance_cents") if user else None
+        ledger_cents = await self.get_balance_cents(user_id)
+        return {
+            "user_id": user_id,
+            "wallet_balance_cents": wallet_cents,
+            "ledger_balance_cents": ledger_cents,
+            "in_balance": wallet_cents == ledger_cents
+        }
@@ -0,0 +1,191 @@
+"""
+DalePay Logging Pipeline
+Moves log formatting and disk writes off the event loop thread
+"""
+
+import os
+import copy
+import json
+import queue
+import random
+import logging
+import logging.handlers
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional
+
+# Set per request by the request id middleware; read when a record is emitted
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the request id and any extra= fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "process": record.process
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request id in the emitting task"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of INFO and DEBUG records; warnings and errors always pass.
+
+    Rates are per logger name prefix, longest match first, e.g.
+    {"httpx": 0.1, "server": 1.0}; other loggers use default_rate.
+    """
+
+    def __init__(self, default_rate: float = 1.0, rates: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.default_rate = default_rate
+        self.rates = sorted((rates or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.sampled_out = 0
+
+    def _rate(self, name: str) -> float:
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return rate
+        return self.default_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller; counts records dropped while the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Resolve the message but keep exc_info for the listener's formatters.
+
+        The stock prepare formats the record on the caller's thread and clears
+        exc_info so it can be pickled; this queue never leaves the process.
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LoggingPipeline:
+    """Root logging through a bounded queue drained by one writer thread.
+
+    Callers only pay for filtering, resolving the message and an in-memory
+    put. The listener thread formats records, tracebacks included, and
+    writes JSON lines to a size-rotated file plus text to stderr, so a slow
+    disk delays the log, not the request.
+
+    Rotation is not coordinated between processes: with several workers
+    sharing one LOG_FILE, one worker's rollover can leave others writing to
+    the renamed file. Run one worker per file, or set LOG_FILE_PER_PROCESS
+    to give each process its own file named with its pid.
+    """
+
+    def __init__(self, queue_handler: DroppingQueueHandler, listener: logging.handlers.QueueListener,
+                 sampler: SamplingFilter, log_file: Optional[str]):
+        self.queue_handler = queue_handler
+        self.listener = listener
+        self.sampler = sampler
+        self.log_file = log_file
+
+    def shutdown(self):
+        """Write out queued records and stop the writer thread"""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        """Pipeline statistics for the admin performance view"""
+        return {
+            "log_file": self.log_file,
+            "queued": self.queue_handler.queue.qsize(),
+            "dropped": self.queue_handler.dropped,
+            "sampled_out": self.sampler.sampled_out
+        }
+
+def _parse_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, rate = item.split("=", 1)
+            rates[name.strip()] = float(rate)
+    return rates
+
+def setup_logging() -> LoggingPipeline:
+    """Route the root logger through the queue pipeline configured from the environment"""
+    handlers = []
+    log_file = os.getenv('LOG_FILE', '/var/log/dalepay/app.log')
+    if log_file and os.getenv('LOG_FILE_PER_PROCESS', 'false').lower() == 'true':
+        root_name, extension = os.path.splitext(log_file)
+        log_file = f"{root_name}.{os.getpid()}{extension}"
+    file_error = None
+    if log_file:
+        try:
+            # The default path sits under /var/log, which a fresh container does not have
+            os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file,
+                maxBytes=int(os.getenv('LOG_MAX_BYTES', str(50 * 1024 * 1024))),
+                backupCount=int(os.getenv('LOG_BACKUP_COUNT', '10'))
+            )
+            file_handler.setFormatter(JsonFormatter())
+            handlers.append(file_handler)
+        except OSError as e:
+            file_error = f"Log file {log_file} not writable, logging to stderr only: {e}"
+            log_file = None
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers.append(stream_handler)
+
+    sampler = SamplingFilter(
+        float(os.getenv('LOG_INFO_SAMPLE_RATE', '1.0')),
+        _parse_rates(os.getenv('LOG_SAMPLE_RATES', ''))
+    )
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000'))))
+    queue_handler.addFilter(sampler)
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    if file_error:
+        logging.getLogger(__name__).error(file_error)
+    return LoggingPipeline(queue_handler, listener, sampler, log_file)
@@ -0,0 +1,278 @@
+"""
+DalePay Metric Rollups
+Per-minute and per-hour business counters for the admin dashboard
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional
+
+from pymongo import UpdateOne, ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+# Bucket width and how long buckets are kept
+GRANULARITIES = {
+    "minute": (timedelta(minutes=1), timedelta(days=2)),
+    "hour": (timedelta(hours=1), timedelta(days=400))
+}
+
+TOTALS_ID = "totals"
+EPOCH = datetime(1970, 1, 1)
+
+# User fields whose current values are counted in the totals document
+STATE_FIELDS = ("account_status", "kyc_status")
+
+def bucket_start(at: datetime, granularity: str) -> datetime:
+    """Start of the bucket containing at"""
+    if granularity == "minute":
+        return at.replace(second=0, microsecond=0)
+    return at.replace(minute=0, second=0, microsecond=0)
+
+def _cents(transaction: Dict[str, Any], field: str) -> int:
+    # Moov wallet transactions only carry dollar amounts
+    cents = transaction.get(f"{field}_cents")
+    if cents is None:
+        cents = round((transaction.get(field) or 0) * 100)
+    return cents
+
+def _bucket_expression(field: str, granularity: str) -> Dict[str, Any]:
+    # Date arithmetic instead of $dateTrunc so rebuilds also run on MongoDB 4.x
+    width_ms = int(GRANULARITIES[granularity][0].total_seconds() * 1000)
+    return {"$subtract": [field, {"$mod": [{"$subtract": [field, EPOCH]}, width_ms]}]}
+
+def _cents_expression(field: str) -> Dict[str, Any]:
+    return {"$ifNull": [f"${field}_cents", {"$round": [{"$multiply": [{"$ifNull": [f"${field}", 0]}, 100]}, 0]}]}
+
+class MetricRollups:
+    """Dashboard counters kept in the metric_rollups collection.
+
+    Every recorded transaction increments one minute and one hour bucket with
+    its count, and completed ones add their volume and fee; signups are
+    counted the same way. A single totals document holds the user count and
+    the number of users in each account and KYC status, adjusted whenever a
+    status changes. The dashboard reads the totals plus at most 24 hourly
+    buckets, whatever the transaction volume. rebuild() recomputes everything
+    from users and transactions, e.g. after the counters drifted or when the
+    collection is first created.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.metric_rollups
+        self.counters = {"recorded_transactions": 0, "recorded_signups": 0, "status_changes": 0,
+                         "record_errors": 0, "rebuilds": 0}
+        self.last_rebuild: Optional[Dict[str, Any]] = None
+
+    def _bucket_update(self, granularity: str, bucket: datetime, increments: Dict[str, int]) -> UpdateOne:
+        return UpdateOne(
+            {"_id": f"{granularity}:{bucket.isoformat()}"},
+            {
+                "$inc": increments,
+                "$setOnInsert": {
+                    "granularity": granularity,
+                    "bucket": bucket,
+                    "expires_at": bucket + GRANULARITIES[granularity][1]
+                }
+            },
+            upsert=True
+        )
+
+    async def _write(self, updates: List[UpdateOne]) -> bool:
+        try:
+            await self.collection.bulk_write(updates, ordered=False)
+            return True
+        except Exception as e:
+            # Rollups are derived data; a missed increment must not fail the write it describes
+            self.counters["record_errors"] += 1
+            logger.error(f"Error recording metric rollups: {e}")
+            return False
+
+    async def record_transactions(self, transactions: List[Dict[str, Any]]):
+        """Count new transactions into their minute and hour buckets"""
+        if not transactions:
+            return
+        grouped: Dict[datetime, Dict[str, int]] = {}
+        for transaction in transactions:
+            minute = bucket_start(transaction["created_at"], "minute")
+            group = grouped.setdefault(minute, {
+                "transactions": 0, "completed_transactions": 0, "volume_cents": 0, "fee_cents": 0
+            })
+            group["transactions"] += 1
+            if transaction.get("status") == "completed":
+                group["completed_transactions"] += 1
+                group["volume_cents"] += _cents(transaction, "amount")
+                group["fee_cents"] += _cents(transaction, "fee")
+
+        updates = []
+        for minute, increments in grouped.items():
+            updates.append(self._bucket_update("minute", minute, increments))
+            updates.append(self._bucket_update("hour", bucket_start(minute, "hour"), increments))
+        if await self._write(updates):
+            self.counters["recorded_transactions"] += len(transactions)
+
+    async def record_transaction_status(self, transaction: Dict[str, Any], before: Optional[str], after: str):
+        """Move a recorded transaction in or out of the completed figures, e.g. processing -> completed on settle"""
+        if (before == "completed") == (after == "completed"):
+            return
+        sign = 1 if after == "completed" else -1
+        increments = {
+            "completed_transactions": sign,
+            "volume_cents": sign * _cents(transaction, "amount"),
+            "fee_cents": sign * _cents(transaction, "fee")
+        }
+        # The transaction stays in the buckets of its created_at
+        minute = bucket_start(transaction["created_at"], "minute")
+        updates = [
+            self._bucket_update("minute", minute, increments),
+            self._bucket_update("hour", bucket_start(minute, "hour"), increments)
+        ]
+        if await self._write(updates):
+            self.counters["status_changes"] += 1
+
+    async def record_signup(self, user: Dict[str, Any]):
+        """Count a new user into the signup buckets and the status totals"""
+        created_at = user["created_at"]
+        totals = {"users": 1}
+        for field in STATE_FIELDS:
+            if user.get(field):
+                totals[f"{field}.{user[field]}"] = 1
+        updates = [
+            self._bucket_update(granularity, bucket_start(created_at, granularity), {"signups": 1})
+            for granularity in GRANULARITIES
+        ]
+        updates.append(UpdateOne({"_id": TOTALS_ID}, {"$inc": totals}, upsert=True))
+        if await self._write(updates):
+            self.counters["recorded_signups"] += 1
+
+    async def record_status_change(self, field: str, before: Optional[str], after: Optional[str]):
+        """Move one user between status counts, e.g. account_status active -> frozen"""
+        if before == after:
+            return
+        increments = {}
+        if before:
+            increments[f"{field}.{before}"] = -1
+        if after:
+            increments[f"{field}.{after}"] = 1
+        if await self._write([UpdateOne({"_id": TOTALS_ID}, {"$inc": increments}, upsert=True)]):
+            self.counters["status_changes"] += 1
+
+    async def summary(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Status totals and today's transaction figures"""
+        now = now or datetime.utcnow()
+        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        totals = await self.collection.find_one({"_id": TOTALS_ID}) or {}
+        hours = await self.collection.find(
+            {"granularity": "hour", "bucket": {"$gte": today_start}},
+            {"_id": 0, "transactions": 1, "completed_transactions": 1, "volume_cents": 1, "fee_cents": 1, "signups": 1}
+        ).to_list(None)
+
+        today = {"transactions": 0, "completed_transactions": 0, "volume_cents": 0, "fee_cents": 0, "signups": 0}
+        for hour in hours:
+            for field in today:
+                today[field] += hour.get(field, 0)
+        return {
+            "users": totals.get("users", 0),
+            "account_status": totals.get("account_status", {}),
+            "kyc_status": totals.get("kyc_status", {}),
+            "today": today,
+            "rebuilt_at": totals.get("rebuilt_at")
+        }
+
+    async def series(self, granularity: str, since: datetime) -> List[Dict[str, Any]]:
+        """Buckets of one granularity from since onwards, oldest first"""
+        return await self.collection.find(
+            {"granularity": granularity, "bucket": {"$gte": bucket_start(since, granularity)}},
+            {"_id": 0, "expires_at": 0}
+        ).sort("bucket", 1).to_list(None)
+
+    async def ensure_built(self):
+        """Build the rollups from raw data if they have never been built"""
+        if await self.collection.find_one({"_id": TOTALS_ID}, {"_id": 1}) is None:
+            await self.rebuild()
+
+    async def rebuild(self, days: int = 30) -> Dict[str, Any]:
+        """Recompute the totals and the last days of buckets from users and transactions.
+
+        Buckets are replaced wholesale, so writes landing while a rebuild runs
+        may be counted twice or not at all; run it when traffic is low.
+        """
+        started = datetime.utcnow()
+        since = bucket_start(started - timedelta(days=days), "hour")
+
+        state_facets = {
+            field: [{"$group": {"_id": f"${field}", "count": {"$sum": 1}}}] for field in STATE_FIELDS
+        }
+        state_facets["users"] = [{"$count": "count"}]
+        states = (await self.db.users.aggregate([{"$facet": state_facets}]).to_list(1))[0]
+        totals = {
+            "_id": TOTALS_ID,
+            "users": states["users"][0]["count"] if states["users"] else 0,
+            "rebuilt_at": started
+        }
+        for field in STATE_FIELDS:
+            totals[field] = {group["_id"]: group["count"] for group in states[field] if group["_id"]}
+
+        completed = {"$eq": ["$status", "completed"]}
+        updates = []
+        buckets = 0
+        for granularity, (_, retention) in GRANULARITIES.items():
+            window_start = max(since, bucket_start(started - retention, granularity))
+            rebuilt: Dict[datetime, Dict[str, int]] = {}
+            transaction_groups = await self.db.transactions.aggregate([
+                {"$match": {"created_at": {"$gte": window_start}}},
+                {"$group": {
+                    "_id": _bucket_expression("$created_at", granularity),
+                    "transactions": {"$sum": 1},
+                    "completed_transactions": {"$sum": {"$cond": [completed, 1, 0]}},
+                    "volume_cents": {"$sum": {"$cond": [completed, _cents_expression("amount"), 0]}},
+                    "fee_cents": {"$sum": {"$cond": [completed, _cents_expression("fee"), 0]}}
+                }}
+            ]).to_list(None)
+            signup_groups = await self.db.users.aggregate([
+                {"$match": {"created_at": {"$gte": window_start}}},
+                {"$group": {"_id": _bucket_expression("$created_at", granularity), "signups": {"$sum": 1}}}
+            ]).to_list(None)
+            for group in transaction_groups + signup_groups:
+                bucket = rebuilt.setdefault(group.pop("_id"), {})
+                bucket.update({field: int(value) for field, value in group.items()})
+
+            for bucket, values in rebuilt.items():
+                updates.append(ReplaceOne(
+                    {"_id": f"{granularity}:{bucket.isoformat()}"},
+                    {
+                        "granularity": granularity,
+                        "bucket": bucket,
+                        "expires_at": bucket + retention,
+                        "transactions": 0, "completed_transactions": 0, "volume_cents": 0, "fee_cents": 0, "signups": 0,
+                        **values
+                    },
+                    upsert=True
+                ))
+            buckets += len(rebuilt)
+            # Buckets with no activity left in the raw data
+            await self.collection.delete_many({
+                "granularity": granularity,
+                "bucket": {"$gte": window_start, "$nin": list(rebuilt)}
+            })
+
+        updates.append(ReplaceOne({"_id": TOTALS_ID}, totals, upsert=True))
+        await self.collection.bulk_write(updates, ordered=False)
+
+        self.counters["rebuilds"] += 1
+        self.last_rebuild = {
+            "since": since,
+            "buckets": buckets,
+            "users": totals["users"],
+            "duration_ms": round((datetime.utcnow() - started).total_seconds() * 1000, 3)
+        }
+        logger.info(f"Metric rollups rebuilt: {buckets} buckets since {since.isoformat()}")
+        return self.last_rebuild
+
+    def stats(self) -> Dict[str, Any]:
+        """Rollup statistics for the admin performance view"""
+        return {"last_rebuild": self.last_rebuild, **self.counters}
+
+def get_metric_rollups(db):
+    """Get metric rollups instance"""
+    return MetricRollups(db)
@@ -0,0 +1,215 @@
+"""
+DalePay Metrics
+In-process counters, gauges and histograms served in Prometheus text format
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Any, Optional, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        # Mongo command events arrive on driver threads, so updates take a lock
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    """Monotonic count per label set"""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f"{self.name}{_label_text(self.labels, key)} {value}" for key, value in values]
+
+class Gauge(_Metric):
+    """Current value per label set"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *label_values: str):
+        with self._lock:
+            self._values[label_values] = value
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def dec(self, *label_values: str, amount: float = 1.0):
+        self.inc(*label_values, amount=-amount)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f"{self.name}{_label_text(self.labels, key)} {value}" for key, value in values]
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count per label set"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = [(key, list(series[0]), series[1], series[2]) for key, series in self._series.items()]
+        lines = self.header()
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Holds every metric and renders the text exposition"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> Any:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    "dalepay_http_requests_total", "HTTP requests by route template and status", ("method", "route", "status"))
+http_request_duration = registry.histogram(
+    "dalepay_http_request_duration_seconds", "HTTP request latency by route template", ("method", "route"))
+http_in_flight = registry.gauge(
+    "dalepay_http_requests_in_flight", "HTTP requests currently being handled")
+mongo_command_duration = registry.histogram(
+    "dalepay_mongodb_command_duration_seconds", "MongoDB command latency", ("collection", "command"))
+mongo_command_failures = registry.counter(
+    "dalepay_mongodb_command_failures_total", "MongoDB commands that failed", ("collection", "command"))
+moov_request_duration = registry.histogram(
+    "dalepay_moov_request_duration_seconds", "Moov API call latency", ("endpoint",))
+moov_request_errors = registry.counter(
+    "dalepay_moov_request_errors_total", "Moov API calls that failed or returned 5xx", ("endpoint",))
+plaid_call_duration = registry.histogram(
+    "dalepay_plaid_call_duration_seconds", "Plaid SDK call latency", ("call",))
+plaid_call_errors = registry.counter(
+    "dalepay_plaid_call_errors_total", "Plaid SDK calls that failed or timed out", ("call",))
+event_loop_lag = registry.histogram(
+    "dalepay_event_loop_lag_seconds", "Delay of a scheduled wake-up on the event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+def command_collection(command_name: str, command: Dict[str, Any]) -> str:
+    """Collection a command targets, or "" for database and admin commands"""
+    if command_name == "getMore":
+        return str(command.get("collection", ""))
+    target = command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command the driver sends; register on the client with event_listeners"""
+
+    def __init__(self):
+        self._started: Dict[Tuple[Any, int], Tuple[str, str]] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        self._started[(event.connection_id, event.request_id)] = (
+            command_collection(event.command_name, event.command), event.command_name
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        labels = self._started.pop((event.connection_id, event.request_id), None)
+        if labels is not None:
+            mongo_command_duration.observe(event.duration_micros / 1e6, *labels)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        labels = self._started.pop((event.connection_id, event.request_id), None)
+        if labels is not None:
+            mongo_command_duration.observe(event.duration_micros / 1e6, *labels)
+            mongo_command_failures.inc(*labels)
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a sleep that should wake on time"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            event_loop_lag.observe(max(0.0, time.perf_counter() - expected))
+
+    def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
@@ -23,10 +23,22 @@ except ImportError as e:
 
 from fastapi import HTTPException
 from pydantic import BaseModel
+from pymongo import ReturnDocument
 from cryptography.fernet import Fernet
 
+from audit_log import get_audit_log_writer
+from metric_rollups import get_metric_rollups
+
 logger = logging.getLogger(__name__)
 
+# Final Moov transfer statuses and the transaction status each settles to
+SETTLED_TRANSFER_STATUSES = {
+    "completed": "completed",
+    "failed": "failed",
+    "reversed": "reversed",
+    "canceled": "failed"
+}
+
 class MoovConfig:
     """Moov Financial configuration for real banking"""
     
@@ -111,6 +123,8 @@ class DalePayWallet:
     def __init__(self, config: MoovConfig, db):
         self.config = config
         self.db = db
+        self.audit_log = get_audit_log_writer(db)
+        self.rollups = get_metric_rollups(db)
         
     def encrypt_data(self, data: str) -> str:
         """Encrypt sensitive data"""
@@ -358,6 +372,7 @@ class DalePayWallet:
             }
             
             await self.db.transactions.insert_one(transaction)
+            await self.rollups.record_transactions([transaction])
             
             # Log for compliance
             await self.log_compliance_action({
@@ -381,6 +396,43 @@ class DalePayWallet:
             logger.error(f"Error sending money: {e}")
             raise HTTPException(status_code=500, detail=f"Transfer failed: {str(e)}")
     
+    async def update_transfer_status(self, moov_transfer_id: str, status: str) -> bool:
+        """Record a wallet transfer's new status and move it between the rollup figures"""
+        previous = await self.db.transactions.find_one_and_update(
+            {"moov_transfer_id": moov_transfer_id, "status": {"$ne": status}},
+            {"$set": {"status": status, "settled_at": datetime.utcnow()}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+        if previous is None:
+            # Unknown transfer, or another worker already recorded this status
+            return False
+        await self.rollups.record_transaction_status(previous, previous.get("status"), status)
+        return True
+    
+    async def sync_transfer_statuses(self, limit: int = 500) -> Dict[str, int]:
+        """Ask Moov about processing wallet transfers and record the ones that settled"""
+        result = {"checked": 0, "settled": 0, "errors": 0}
+        if not self.config.moov_client:
+            return result
+        
+        processing = await self.db.transactions.find(
+            {"moov_transfer_id": {"$exists": True}, "status": "processing"},
+            {"_id": 0, "moov_transfer_id": 1}
+        ).sort("created_at", 1).limit(limit).to_list(None)
+        for transaction in processing:
+            result["checked"] += 1
+            try:
+                transfer = await self.config.moov_client.transfers.get(transaction["moov_transfer_id"])
+            except Exception as e:
+                result["errors"] += 1
+                logger.error(f"Error fetching Moov transfer {transaction['moov_transfer_id']}: {e}")
+                continue
+            status = SETTLED_TRANSFER_STATUSES.get(getattr(transfer, "status", None))
+            if status and await self.update_transfer_status(transaction["moov_transfer_id"], status):
+                result["settled"] += 1
+        return result
+    
     async def process_merchant_payment(self, payment: MerchantPayment) -> Dict[str, Any]:
         """Process POS payment and collect merchant fees"""
         if not self.config.moov_client:
@@ -543,15 +595,11 @@ class DalePayWallet:
     
     async def log_compliance_action(self, action_data: Dict[str, Any]):
         """Log action for FinCEN compliance"""
-        try:
-            compliance_log = {
-                **action_data,
-                "logged_at": datetime.utcnow(),
-                "system": "dalepay_puerto_rico"
-            }
-            await self.db.compliance_logs.insert_one(compliance_log)
-        except Exception as e:
-            logger.error(f"Error logging compliance action: {e}")
+        self.audit_log.write({
+            **action_data,
+            "logged_at": datetime.utcnow(),
+            "system": "dalepay_puerto_rico"
+        })
 
 # Initialize the wallet service
 moov_config = MoovConfig()
@@ -0,0 +1,120 @@
+"""
+DalePay Password Hashing
+Runs bcrypt hashing and verification in a bounded process pool
+"""
+
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from perf_stats import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+# Worker-side bcrypt context, created lazily in each pool process
+_worker_context = None
+
+def _get_worker_context() -> CryptContext:
+    global _worker_context
+    if _worker_context is None:
+        _worker_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _worker_context
+
+def _hash_in_worker(password: str):
+    started = time.perf_counter()
+    hashed = _get_worker_context().hash(password)
+    return hashed, time.perf_counter() - started
+
+def _verify_in_worker(plain_password: str, hashed_password: str):
+    started = time.perf_counter()
+    valid = _get_worker_context().verify(plain_password, hashed_password)
+    return valid, time.perf_counter() - started
+
+class PasswordHasher:
+    """Offloads bcrypt work from the event loop with a bounded queue"""
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 64):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self.in_flight = 0
+        self.rejected = 0
+        self.pool_wait = LatencyStats()
+        self.hash_time = LatencyStats()
+        self.verify_time = LatencyStats()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn keeps the workers free of the parent's event loop and Mongo threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info(f"Password hashing pool started with {self.max_workers} workers")
+        return self._executor
+
+    async def _run(self, func, stats: LatencyStats, *args):
+        if self.in_flight >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Authentication service busy, please retry",
+                headers={"Retry-After": "1"}
+            )
+
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            try:
+                result, work_seconds = await loop.run_in_executor(self._get_executor(), func, *args)
+            except BrokenProcessPool:
+                logger.error("Password hashing pool broken, restarting")
+                self._executor = None
+                result, work_seconds = await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.in_flight -= 1
+
+        stats.record(work_seconds)
+        self.pool_wait.record(max(0.0, time.perf_counter() - started - work_seconds))
+        return result
+
+    async def hash(self, password: str) -> str:
+        """Hash a password off the event loop"""
+        return await self._run(_hash_in_worker, self.hash_time, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify a password off the event loop"""
+        return await self._run(_verify_in_worker, self.verify_time, plain_password, hashed_password)
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool statistics for the admin performance view"""
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+            "pool_wait": self.pool_wait.snapshot(),
+            "hash_time": self.hash_time.snapshot(),
+            "verify_time": self.verify_time.snapshot()
+        }
+
+# Initialize the password hasher
+password_hasher = PasswordHasher(
+    max_workers=int(os.getenv('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1)))),
+    max_pending=int(os.getenv('PASSWORD_HASH_MAX_PENDING', '64'))
+)
@@ -0,0 +1,63 @@
+"""
+DalePay Performance Statistics
+Lightweight in-process latency recorders
+"""
+
+import time
+from collections import deque
+from typing import Dict, Any
+
+class LatencyStats:
+    """Running latency statistics with percentiles over recent samples"""
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float, error: bool = False):
+        """Record one observation"""
+        self.count += 1
+        self.total_seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+        if error:
+            self.errors += 1
+        self._samples.append(seconds)
+
+    def time(self):
+        """Context manager recording the elapsed time of its block"""
+        return _Timer(self)
+
+    def _percentile(self, ordered: list, fraction: float) -> float:
+        if not ordered:
+            return 0.0
+        index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Summary in milliseconds"""
+        ordered = sorted(self._samples)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_seconds / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self._percentile(ordered, 0.50) * 1000, 3),
+            "p95_ms": round(self._percentile(ordered, 0.95) * 1000, 3),
+            "p99_ms": round(self._percentile(ordered, 0.99) * 1000, 3),
+            "max_ms": round(self.max_seconds * 1000, 3)
+        }
+
+class _Timer:
+    def __init__(self, stats: LatencyStats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stats.record(time.perf_counter() - self.started, error=exc_type is not None)
+        return False
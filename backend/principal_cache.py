@@ -0,0 +1,92 @@
+"""
+DalePay Principal Cache
+In-process TTL/LRU cache of authenticated user documents
+"""
+
+import os
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+class PrincipalCache:
+    """Bounded TTL/LRU cache of user documents keyed by user id.
+
+    Entries are dropped explicitly whenever an account changes (freeze,
+    unfreeze, KYC updates, balance moves). Other workers only see such a
+    change once their own entry expires, so the TTL bounds cross-process
+    staleness; money movements do not rely on the cache, since the debit
+    itself refuses frozen accounts. Password hashes are never cached.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached user document, or None"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del self._entries[user_id]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return dict(user)
+
+    def put(self, user: Dict[str, Any]):
+        """Cache a user document fetched from the database"""
+        user_id = user.get("id")
+        if not user_id:
+            return
+
+        cached = {key: value for key, value in user.items() if key != "password_hash"}
+        self._entries[user_id] = (time.monotonic() + self.ttl_seconds, cached)
+        self._entries.move_to_end(user_id)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *user_ids: str):
+        """Drop cached documents after the account has changed"""
+        for user_id in user_ids:
+            if user_id and self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop every cached document"""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache statistics for the admin performance view"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+# Initialize the principal cache
+principal_cache = PrincipalCache(
+    max_entries=int(os.getenv('PRINCIPAL_CACHE_MAX_ENTRIES', '10000')),
+    ttl_seconds=float(os.getenv('PRINCIPAL_CACHE_TTL_SECONDS', '60'))
+)
@@ -0,0 +1,268 @@
+"""
+DalePay Query Monitor
+Slow-query log built on driver command monitoring
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+
+from pymongo import monitoring
+
+from metrics import command_collection
+
+logger = logging.getLogger(__name__)
+
+# Commands that carry a query worth timing; everything else is ignored
+MONITORED_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete", "insert", "getMore"}
+# Commands explain can plan without running them
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify"}
+# Session and routing fields the driver adds, which explain must not repeat
+_DRIVER_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "writeConcern", "readConcern"}
+
+def query_shape(value: Any) -> Any:
+    """Replace literal values with "?" so queries differing only by values share a shape"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = query_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+def command_shape(command_name: str, command: Dict[str, Any]) -> Dict[str, Any]:
+    """The filter, sort and pipeline parts of a command, normalized"""
+    if command_name == "find":
+        shape = {"filter": query_shape(command.get("filter", {}))}
+        if command.get("sort"):
+            shape["sort"] = dict(command["sort"])
+        return shape
+    if command_name == "aggregate":
+        stages = []
+        for stage in command.get("pipeline", []):
+            name = next(iter(stage), "?")
+            stages.append({name: dict(stage[name]) if name == "$sort" else query_shape(stage[name])})
+        return {"pipeline": stages}
+    if command_name in ("count", "distinct"):
+        return {"query": query_shape(command.get("query", {}))}
+    if command_name == "findAndModify":
+        shape = {"query": query_shape(command.get("query", {}))}
+        if command.get("sort"):
+            shape["sort"] = dict(command["sort"])
+        return shape
+    if command_name == "update":
+        return {"q": query_shape([update.get("q", {}) for update in command.get("updates", [])[:10]])}
+    if command_name == "delete":
+        return {"q": query_shape([delete.get("q", {}) for delete in command.get("deletes", [])[:10]])}
+    return {}
+
+def summarize_plan(explain: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Stages and indexes of the winning plan, wherever explain nested it"""
+    winning = _find_key(explain, "winningPlan")
+    if winning is None:
+        return None
+    winning = winning.get("queryPlan", winning)
+    stages, indexes = [], []
+    pending = [winning]
+    while pending:
+        stage = pending.pop()
+        stages.append(stage.get("stage"))
+        if stage.get("indexName"):
+            indexes.append(stage["indexName"])
+        if "inputStage" in stage:
+            pending.append(stage["inputStage"])
+        pending.extend(stage.get("inputStages", []))
+    return {"stages": stages, "indexes": indexes, "collection_scan": "COLLSCAN" in stages}
+
+def _find_key(value: Any, key: str) -> Optional[Dict[str, Any]]:
+    if isinstance(value, dict):
+        if key in value:
+            return value[key]
+        value = list(value.values())
+    if isinstance(value, list):
+        for item in value:
+            found = _find_key(item, key)
+            if found is not None:
+                return found
+    return None
+
+class QueryMonitor(monitoring.CommandListener):
+    """Times every query command and keeps the slow ones by shape.
+
+    Register on the client with event_listeners. Commands slower than
+    threshold_ms are grouped by database, collection, command and
+    normalized shape, so the admin view shows which query patterns cost
+    the most in total, plus a ring buffer of the latest slow executions.
+    Only shapes are kept, never the literal values in a query. With
+    explain on, the first slow execution of a read shape (and again after
+    explain_interval) is explained in the background so collection scans
+    point at the missing index.
+    """
+
+    def __init__(self, threshold_ms: float = 100.0, recent_size: int = 100, max_shapes: int = 500,
+                 explain: bool = True, explain_interval: float = 3600.0, max_pending_explains: int = 2):
+        self.threshold_ms = threshold_ms
+        self.max_shapes = max_shapes
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.max_pending_explains = max_pending_explains
+        self.client = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending_explains = 0
+        # Events arrive on driver threads
+        self._lock = threading.Lock()
+        self._started: Dict[Tuple[Any, int], Tuple[str, Dict[str, Any]]] = {}
+        self._shapes: Dict[str, Dict[str, Any]] = {}
+        self._recent: deque = deque(maxlen=recent_size)
+        self.counters = {"commands": 0, "slow": 0, "failed": 0, "shapes_dropped": 0, "explains": 0, "explain_errors": 0,
+                         "awaits_skipped": 0}
+
+    def start(self, client):
+        """Bind the client and event loop explains run on"""
+        self.client = client
+        self._loop = asyncio.get_running_loop()
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        if event.command_name not in MONITORED_COMMANDS:
+            return
+        # A getMore with maxTimeMS is an awaitData cursor (a change stream or
+        # tailable cursor) deliberately waiting for new data, not a slow query
+        if event.command_name == "getMore" and "maxTimeMS" in event.command:
+            self.counters["awaits_skipped"] += 1
+            return
+        self._started[(event.connection_id, event.request_id)] = (event.database_name, event.command)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finish(event, failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool):
+        started = self._started.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+        self.counters["commands"] += 1
+        if failed:
+            self.counters["failed"] += 1
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < self.threshold_ms:
+            return
+
+        database, command = started
+        command_name = event.command_name
+        collection = command_collection(command_name, command)
+        shape = json.dumps(command_shape(command_name, command), default=str)
+        key = f"{database}.{collection} {command_name} {shape}"
+        now = datetime.utcnow()
+        explain_due = False
+        with self._lock:
+            self.counters["slow"] += 1
+            entry = self._shapes.get(key)
+            if entry is None:
+                if len(self._shapes) >= self.max_shapes:
+                    self.counters["shapes_dropped"] += 1
+                    return
+                entry = self._shapes[key] = {
+                    "database": database,
+                    "collection": collection,
+                    "command": command_name,
+                    "shape": shape,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "first_seen_at": now,
+                    "plan": None,
+                    "explained_at": None
+                }
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["last_seen_at"] = now
+            self._recent.append({
+                "at": now,
+                "database": database,
+                "collection": collection,
+                "command": command_name,
+                "shape": shape,
+                "duration_ms": round(duration_ms, 3),
+                "failed": failed
+            })
+            if (self.explain and self._loop is not None and command_name in EXPLAINABLE_COMMANDS
+                    and self._pending_explains < self.max_pending_explains
+                    and (entry["explained_at"] is None
+                         or time.monotonic() - entry["explained_at"] >= self.explain_interval)):
+                entry["explained_at"] = time.monotonic()
+                self._pending_explains += 1
+                explain_due = True
+
+        if explain_due:
+            inner = {name: value for name, value in command.items()
+                     if not name.startswith("$") and name not in _DRIVER_FIELDS}
+            try:
+                self._loop.call_soon_threadsafe(self._schedule_explain, key, database, inner)
+            except RuntimeError:
+                # The loop is closed; nothing left to explain on
+                with self._lock:
+                    self._pending_explains -= 1
+
+    def _schedule_explain(self, key: str, database: str, inner: Dict[str, Any]):
+        asyncio.ensure_future(self._explain(key, database, inner))
+
+    async def _explain(self, key: str, database: str, inner: Dict[str, Any]):
+        try:
+            result = await self.client[database].command({"explain": inner, "verbosity": "queryPlanner"})
+            plan = summarize_plan(result)
+            with self._lock:
+                if key in self._shapes:
+                    self._shapes[key]["plan"] = plan
+            self.counters["explains"] += 1
+            if plan and plan["collection_scan"]:
+                logger.warning(f"Slow query uses a collection scan: {key}")
+        except Exception as e:
+            self.counters["explain_errors"] += 1
+            logger.error(f"Explain failed for slow query: {e}")
+        finally:
+            with self._lock:
+                self._pending_explains -= 1
+
+    def report(self, limit: int = 50) -> Dict[str, Any]:
+        """Slow shapes by total time, and the latest slow executions"""
+        with self._lock:
+            shapes = [
+                {**{name: value for name, value in entry.items() if name != "explained_at"},
+                 "avg_ms": round(entry["total_ms"] / entry["count"], 3),
+                 "total_ms": round(entry["total_ms"], 3),
+                 "max_ms": round(entry["max_ms"], 3)}
+                for entry in self._shapes.values()
+            ]
+            recent = list(self._recent)
+        shapes.sort(key=lambda entry: entry["total_ms"], reverse=True)
+        return {"threshold_ms": self.threshold_ms, "shapes": shapes[:limit], "recent": recent[::-1][:limit]}
+
+    def reset(self):
+        """Forget collected shapes, e.g. after adding an index"""
+        with self._lock:
+            self._shapes.clear()
+            self._recent.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Monitor statistics for the admin performance view"""
+        return {"threshold_ms": self.threshold_ms, "explain": self.explain, "shapes": len(self._shapes), **self.counters}
+
+def get_query_monitor() -> QueryMonitor:
+    """Get query monitor instance"""
+    return QueryMonitor(
+        threshold_ms=float(os.getenv('SLOW_QUERY_MS', '100')),
+        recent_size=int(os.getenv('SLOW_QUERY_RECENT_SIZE', '100')),
+        explain=os.getenv('SLOW_QUERY_EXPLAIN', 'true').lower() == 'true'
+    )
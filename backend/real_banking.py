@@ -10,6 +10,8 @@ from datetime import datetime, timedelta
 from decimal import Decimal
 import asyncio
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Try to import Plaid - handle gracefully if not available
 try:
@@ -39,9 +41,12 @@ except ImportError as e:
 # FastAPI
 from fastapi import HTTPException
 from pydantic import BaseModel
+from pymongo import UpdateOne
 
 # Local imports
 from cryptography.fernet import Fernet
+from perf_stats import LatencyStats
+import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -53,6 +58,9 @@ class RealBankingConfig:
         self.plaid_client_id = os.getenv('PLAID_CLIENT_ID')
         self.plaid_secret = os.getenv('PLAID_SECRET')
         self.plaid_env = os.getenv('PLAID_ENV', 'sandbox')
+        self.plaid_max_workers = int(os.getenv('PLAID_MAX_WORKERS', '8'))
+        self.plaid_timeout = float(os.getenv('PLAID_TIMEOUT_SECONDS', '15'))
+        self.plaid_refresh_concurrency = int(os.getenv('PLAID_REFRESH_CONCURRENCY', '4'))
         
         # Stripe Configuration
         self.stripe_secret_key = os.getenv('STRIPE_SECRET_KEY')
@@ -103,6 +111,66 @@ class RealBankingConfig:
             logger.error(f"Failed to initialize Plaid client: {e}")
             self.plaid_client = None
 
+class PlaidCallRunner:
+    """Runs blocking Plaid SDK calls on a dedicated bounded thread pool.
+
+    A slot is held until the worker thread actually finishes, so calls that
+    time out on the event loop side still count against the cap and cannot
+    pile up behind a slow Plaid environment.
+    """
+    
+    def __init__(self, max_workers: int, timeout: float):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="plaid")
+        self._slots = asyncio.Semaphore(max_workers)
+        self.latency: Dict[str, LatencyStats] = {}
+        self.timeouts = 0
+    
+    async def call(self, name: str, func, *args):
+        """Run func(*args) off the event loop with a timeout"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        started = time.perf_counter()
+        failed = True
+        try:
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise HTTPException(status_code=503, detail="Banking provider busy, please retry")
+            
+            future = self._executor.submit(func, *args)
+            future.add_done_callback(lambda _: self._release_slot(loop))
+            try:
+                result = await asyncio.wait_for(asyncio.wrap_future(future), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                logger.error(f"Plaid {name} timed out after {self.timeout}s")
+                raise HTTPException(status_code=504, detail="Banking provider timed out")
+            failed = False
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            self.latency.setdefault(name, LatencyStats()).record(elapsed, error=failed)
+            metrics.plaid_call_duration.observe(elapsed, name)
+            if failed:
+                metrics.plaid_call_errors.inc(name)
+    
+    def _release_slot(self, loop):
+        # Runs on the worker thread once the Plaid call has really finished
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(self._slots.release)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Plaid call statistics for the admin performance view"""
+        return {
+            "max_workers": self.max_workers,
+            "timeout_seconds": self.timeout,
+            "timeouts": self.timeouts,
+            "calls": {name: stats.snapshot() for name, stats in self.latency.items()}
+        }
+
 class BankAccount(BaseModel):
     account_id: str
     name: str
@@ -131,9 +199,10 @@ class TransferRequest(BaseModel):
 class RealBankingService:
     """Service for real banking operations"""
     
-    def __init__(self, config: RealBankingConfig, db):
+    def __init__(self, config: RealBankingConfig, db, plaid: PlaidCallRunner):
         self.config = config
         self.db = db
+        self.plaid = plaid
         
     def encrypt_token(self, token: str) -> str:
         """Encrypt sensitive tokens"""
@@ -160,9 +229,11 @@ class RealBankingService:
                 user=LinkTokenCreateRequestUser(client_user_id=user_id)
             )
             
-            response = self.config.plaid_client.link_token_create(request)
+            response = await self.plaid.call("link_token_create", self.config.plaid_client.link_token_create, request)
             return response['link_token']
             
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error creating link token: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to create link token: {str(e)}")
@@ -175,12 +246,15 @@ class RealBankingService:
         try:
             # Exchange public token for access token
             request = ItemPublicTokenExchangeRequest(public_token=public_token)
-            response = self.config.plaid_client.item_public_token_exchange(request)
+            response = await self.plaid.call(
+                "item_public_token_exchange", self.config.plaid_client.item_public_token_exchange, request
+            )
             access_token = response['access_token']
+            encrypted_token = self.encrypt_token(access_token)
             
             # Get account information
             accounts_request = AccountsGetRequest(access_token=access_token)
-            accounts_response = self.config.plaid_client.accounts_get(accounts_request)
+            accounts_response = await self.plaid.call("accounts_get", self.config.plaid_client.accounts_get, accounts_request)
             
             # Store encrypted access token and account info in database
             linked_accounts = []
@@ -188,7 +262,8 @@ class RealBankingService:
                 bank_account = {
                     "user_id": user_id,
                     "account_id": account['account_id'],
-                    "access_token": self.encrypt_token(access_token),
+                    "item_id": response['item_id'],
+                    "access_token": encrypted_token,
                     "account_name": account['name'],
                     "account_type": account['type'],
                     "account_subtype": account.get('subtype', ''),
@@ -219,6 +294,8 @@ class RealBankingService:
                 "accounts": linked_accounts
             }
             
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error exchanging public token: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to link bank account: {str(e)}")
@@ -234,62 +311,83 @@ class RealBankingService:
             if not accounts:
                 return []
             
-            updated_accounts = []
+            if self.config.plaid_client:
+                # Accounts linked through the same Plaid item share one access token,
+                # so a single accounts_get refreshes all of them
+                items: Dict[str, Dict[str, Any]] = {}
+                for account in accounts:
+                    try:
+                        access_token = self.decrypt_token(account['access_token'])
+                    except Exception as e:
+                        logger.error(f"Error decrypting token for account {account['account_id']}: {e}")
+                        continue
+                    item = items.setdefault(account.get('item_id') or access_token, {
+                        "access_token": access_token,
+                        "accounts": []
+                    })
+                    item["accounts"].append(account)
+                
+                semaphore = asyncio.Semaphore(self.config.plaid_refresh_concurrency)
+                refreshes = await asyncio.gather(*[
+                    self._refresh_item_balances(item["access_token"], item["accounts"], semaphore)
+                    for item in items.values()
+                ])
+                
+                updates = [update for item_updates in refreshes for update in item_updates]
+                if updates:
+                    await self.db.real_bank_accounts.bulk_write(updates, ordered=False)
             
+            # Remove sensitive data
             for account in accounts:
-                try:
-                    if not self.config.plaid_client:
-                        # If Plaid not available, return stored balance
-                        account.pop('access_token', None)
-                        account['_id'] = str(account['_id'])
-                        updated_accounts.append(account)
-                        continue
-                    
-                    # Decrypt access token and fetch current balance
-                    access_token = self.decrypt_token(account['access_token'])
-                    accounts_request = AccountsGetRequest(access_token=access_token)
-                    accounts_response = self.config.plaid_client.accounts_get(accounts_request)
-                    
-                    # Update balance for matching account
-                    for plaid_account in accounts_response['accounts']:
-                        if plaid_account['account_id'] == account['account_id']:
-                            current_balance = float(plaid_account['balances']['current'] or 0)
-                            available_balance = float(plaid_account['balances']['available'] or 0)
-                            
-                            # Update in database
-                            await self.db.real_bank_accounts.update_one(
-                                {"_id": account['_id']},
-                                {
-                                    "$set": {
-                                        "balance_current": current_balance,
-                                        "balance_available": available_balance,
-                                        "last_updated": datetime.utcnow()
-                                    }
-                                }
-                            )
-                            
-                            account['balance_current'] = current_balance
-                            account['balance_available'] = available_balance
-                            break
-                    
-                    # Remove sensitive data
-                    account.pop('access_token', None)
-                    account['_id'] = str(account['_id'])
-                    updated_accounts.append(account)
-                    
-                except Exception as e:
-                    logger.error(f"Error updating balance for account {account['account_id']}: {e}")
-                    # Return stored balance if update fails
-                    account.pop('access_token', None)
-                    account['_id'] = str(account['_id'])
-                    updated_accounts.append(account)
+                account.pop('access_token', None)
+                account['_id'] = str(account['_id'])
             
-            return updated_accounts
+            return accounts
             
         except Exception as e:
             logger.error(f"Error getting account balances: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to get account balances: {str(e)}")
     
+    async def _refresh_item_balances(self, access_token: str, accounts: List[Dict[str, Any]],
+                                     semaphore: asyncio.Semaphore) -> List[UpdateOne]:
+        """Fetch balances for one Plaid item and update its accounts in place"""
+        try:
+            async with semaphore:
+                accounts_request = AccountsGetRequest(access_token=access_token)
+                accounts_response = await self.plaid.call(
+                    "accounts_get", self.config.plaid_client.accounts_get, accounts_request
+                )
+        except Exception as e:
+            # Keep the stored balances if the refresh fails
+            logger.error(f"Error updating balances for {len(accounts)} accounts: {e}")
+            return []
+        
+        balances = {
+            plaid_account['account_id']: plaid_account['balances']
+            for plaid_account in accounts_response['accounts']
+        }
+        
+        updates = []
+        for account in accounts:
+            account_balances = balances.get(account['account_id'])
+            if account_balances is None:
+                continue
+            
+            account['balance_current'] = float(account_balances['current'] or 0)
+            account['balance_available'] = float(account_balances['available'] or 0)
+            updates.append(UpdateOne(
+                {"_id": account['_id']},
+                {
+                    "$set": {
+                        "balance_current": account['balance_current'],
+                        "balance_available": account['balance_available'],
+                        "last_updated": datetime.utcnow()
+                    }
+                }
+            ))
+        
+        return updates
+    
     async def get_total_balance(self, user_id: str) -> float:
         """Get total balance across all linked accounts"""
         try:
@@ -385,7 +483,8 @@ class RealBankingService:
 
 # Initialize the real banking service
 real_banking_config = RealBankingConfig()
+plaid_runner = PlaidCallRunner(real_banking_config.plaid_max_workers, real_banking_config.plaid_timeout)
 
 def get_real_banking_service(db):
     """Get real banking service instance"""
-    return RealBankingService(real_banking_config, db)
\ No newline at end of file
+    return RealBankingService(real_banking_config, db, plaid_runner)
\ No newline at end of file
@@ -0,0 +1,322 @@
+"""
+DalePay Rescreening
+Rescreens the whole user base against watchlist entries that changed
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional
+
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from sanctions_screening import ScreeningIndex
+
+logger = logging.getLogger(__name__)
+
+STATE_ID = "current"
+
+# Worker-side index of the changed entries, built once per pool process
+_worker_index = None
+
+def _init_worker(entries: List[Dict[str, Any]]):
+    global _worker_index
+    _worker_index = ScreeningIndex(entries)
+
+def _screen_chunk(users: List[tuple], threshold: float, token_threshold: float) -> List[tuple]:
+    matched = []
+    for user_id, name in users:
+        matches = _worker_index.search(name or "", threshold, token_threshold)
+        if matches:
+            matched.append((user_id, matches))
+    return matched
+
+def diff_entries(previous: Dict[str, str], index: ScreeningIndex) -> Dict[str, List]:
+    """Entries added, changed or removed since the fingerprints in previous"""
+    added, changed = [], []
+    for entry_id, entry in index.entries.items():
+        fingerprint = previous.get(entry_id)
+        if fingerprint is None:
+            added.append(entry)
+        elif fingerprint != entry["fingerprint"]:
+            changed.append(entry)
+    removed = [entry_id for entry_id in previous if entry_id not in index.entries]
+    return {"added": added, "changed": changed, "removed": removed}
+
+class RescreeningJob:
+    """Screens every user against the watchlist entries that changed.
+
+    The fingerprints of the last fully screened list version are kept one
+    document per entry in screening_fingerprints, so a reload only screens
+    users against added or changed entries, and a restart with unchanged
+    lists does nothing. Users are
+    streamed with a name-only projection in chunks to a process pool whose
+    workers hold an index of just those entries. Matches are written back
+    with one bulk_write per chunk and raise alerts through ComplianceManager.
+    A lease on the state document keeps concurrent workers from running the
+    same job twice. A run that finds the lease taken records its version as
+    pending_version; the holder reloads and rescreens it before releasing
+    the lease, and otherwise the next run to take the lease does.
+    """
+
+    def __init__(self, db, screener, compliance_manager, chunk_size: int = 5000,
+                 max_workers: int = 2, lease_seconds: int = 600):
+        self.db = db
+        self.screener = screener
+        self.compliance_manager = compliance_manager
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.lease_seconds = lease_seconds
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Run in the background, e.g. after the lists were reloaded"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_logged())
+
+    async def _run_logged(self):
+        try:
+            await self.run()
+        except Exception as e:
+            logger.error(f"Rescreening failed: {e}")
+
+    async def _acquire_lease(self, owner: str) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        try:
+            return await self.db.screening_state.find_one_and_update(
+                {"_id": STATE_ID, "$or": [{"lease_until": {"$lt": now}}, {"lease_until": None}]},
+                {"$set": {"lease_owner": owner, "lease_until": now + timedelta(seconds=self.lease_seconds)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Another worker holds the lease
+            return None
+
+    async def _renew_lease(self, owner: str):
+        await self.db.screening_state.update_one(
+            {"_id": STATE_ID, "lease_owner": owner},
+            {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}}
+        )
+
+    async def _load_fingerprints(self, state: Dict[str, Any]) -> Dict[str, str]:
+        # State from before fingerprints moved to their own collection still holds them inline
+        if "fingerprints" in state:
+            return state["fingerprints"]
+        return {
+            record["_id"]: record["fingerprint"]
+            async for record in self.db.screening_fingerprints.find({}, {"fingerprint": 1})
+        }
+
+    async def _save_fingerprints(self, diff: Dict[str, List], version: str):
+        updates = [
+            UpdateOne({"_id": entry["entry_id"]},
+                      {"$set": {"fingerprint": entry["fingerprint"], "version": version}}, upsert=True)
+            for entry in diff["added"] + diff["changed"]
+        ]
+        for start in range(0, len(updates), self.chunk_size):
+            await self.db.screening_fingerprints.bulk_write(updates[start:start + self.chunk_size], ordered=False)
+        if diff["removed"]:
+            await self.db.screening_fingerprints.delete_many({"_id": {"$in": diff["removed"]}})
+
+    async def run(self) -> Dict[str, Any]:
+        """Rescreen users against entries changed since the last completed run"""
+        index = self.screener.index
+        if index is None:
+            await self.screener.reload()
+            index = self.screener.index
+
+        owner = str(uuid.uuid4())
+        state = await self._acquire_lease(owner)
+        if state is None:
+            # The lease holder picks this version up when it finishes, or the next run does
+            await self.db.screening_state.update_one(
+                {"_id": STATE_ID}, {"$set": {"pending_version": index.version}}
+            )
+            return {"status": "skipped", "reason": "another rescreen is running", "pending_version": index.version}
+
+        try:
+            pending_version = state.get("pending_version")
+            if pending_version and pending_version != index.version:
+                # Lists another worker loaded while this one was not holding the lease
+                await self.screener.reload()
+                index = self.screener.index
+
+            while True:
+                summary = await self._rescreen(state, index, owner)
+                state = await self.db.screening_state.find_one({"_id": STATE_ID})
+                pending_version = state.get("pending_version")
+                if not pending_version or pending_version == index.version:
+                    return summary
+
+                # Another worker loaded newer lists while this run held the lease
+                await self.screener.reload()
+                if self.screener.index.version == index.version:
+                    logger.warning(f"Screening lists version {pending_version} is not on this worker's disk yet")
+                    return summary
+                index = self.screener.index
+        finally:
+            await self.db.screening_state.update_one(
+                {"_id": STATE_ID, "lease_owner": owner},
+                {"$set": {"lease_owner": None, "lease_until": None}}
+            )
+
+    async def _rescreen(self, state: Dict[str, Any], index: ScreeningIndex, owner: str) -> Dict[str, Any]:
+        if state.get("version") == index.version:
+            await self._clear_pending(index.version, owner)
+            return {"status": "skipped", "reason": "lists unchanged", "version": index.version}
+
+        diff = diff_entries(await self._load_fingerprints(state), index)
+        started = time.perf_counter()
+        summary = {
+            "job_id": owner,
+            "status": "completed",
+            "previous_version": state.get("version"),
+            "version": index.version,
+            "entries_added": len(diff["added"]),
+            "entries_changed": len(diff["changed"]),
+            "entries_removed": len(diff["removed"]),
+            "users_screened": 0,
+            "users_matched": 0,
+            "started_at": datetime.utcnow()
+        }
+
+        # Matches on entries that changed or disappeared no longer hold
+        stale = diff["removed"] + [entry["entry_id"] for entry in diff["changed"]]
+        if stale:
+            await self.db.users.update_many(
+                {"screening.matches.entry_id": {"$in": stale}},
+                {"$pull": {"screening.matches": {"entry_id": {"$in": stale}}}}
+            )
+
+        entries = diff["added"] + diff["changed"]
+        if entries:
+            await self._screen_users(entries, index.version, summary, owner)
+
+        # Users are screened first, so a crash here only repeats work on the next run
+        if "fingerprints" in state:
+            diff = {"added": list(index.entries.values()), "changed": [], "removed": []}
+        await self._save_fingerprints(diff, index.version)
+        summary["duration_seconds"] = round(time.perf_counter() - started, 3)
+        summary["completed_at"] = datetime.utcnow()
+        await self.db.screening_state.update_one(
+            {"_id": STATE_ID, "lease_owner": owner},
+            {"$set": {"version": index.version, "completed_at": summary["completed_at"]},
+             "$unset": {"fingerprints": ""}}
+        )
+        await self._clear_pending(index.version, owner)
+        await self.db.rescreening_jobs.insert_one(dict(summary))
+        self.last_run = summary
+        logger.info(
+            f"Rescreened {summary['users_screened']} users against {len(entries)} entries "
+            f"in {summary['duration_seconds']}s, {summary['users_matched']} matched"
+        )
+        return summary
+
+    async def _clear_pending(self, version: str, owner: str):
+        # Only clears the version just screened; a newer one recorded meanwhile stays pending
+        await self.db.screening_state.update_one(
+            {"_id": STATE_ID, "lease_owner": owner, "pending_version": version},
+            {"$unset": {"pending_version": ""}}
+        )
+
+    async def _screen_users(self, entries: List[Dict[str, Any]], version: str,
+                            summary: Dict[str, Any], owner: str):
+        loop = asyncio.get_running_loop()
+        executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(entries,)
+        )
+        pending = set()
+        try:
+            chunk = []
+            cursor = self.db.users.find({}, {"_id": 0, "id": 1, "full_name": 1}).batch_size(self.chunk_size)
+            async for user in cursor:
+                chunk.append((user["id"], user.get("full_name")))
+                if len(chunk) < self.chunk_size:
+                    continue
+                pending.add(self._submit(loop, executor, chunk))
+                chunk = []
+                # Keep at most two chunks per worker in flight
+                if len(pending) >= self.max_workers * 2:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for finished in done:
+                        await self._write_matches(finished.result(), version, summary)
+                    await self._renew_lease(owner)
+            if chunk:
+                pending.add(self._submit(loop, executor, chunk))
+            for finished in asyncio.as_completed(pending):
+                await self._write_matches(await finished, version, summary)
+            pending = set()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, loop, executor, chunk: List[tuple]) -> asyncio.Future:
+        async def screen() -> tuple:
+            matched = await loop.run_in_executor(
+                executor, _screen_chunk, chunk, self.screener.threshold, self.screener.token_threshold
+            )
+            return matched, len(chunk)
+        return asyncio.ensure_future(screen())
+
+    async def _write_matches(self, result: tuple, version: str, summary: Dict[str, Any]):
+        matched, screened = result
+        summary["users_screened"] += screened
+        if not matched:
+            return
+        summary["users_matched"] += len(matched)
+
+        now = datetime.utcnow()
+        updates = [
+            UpdateOne(
+                {"id": user_id},
+                {
+                    "$pull": {"screening.matches": {"entry_id": {"$in": [match["entry_id"] for match in matches]}}}
+                }
+            )
+            for user_id, matches in matched
+        ] + [
+            UpdateOne(
+                {"id": user_id},
+                {
+                    "$push": {"screening.matches": {"$each": matches}},
+                    "$set": {"screening.list_version": version, "screening.screened_at": now}
+                }
+            )
+            for user_id, matches in matched
+        ]
+        await self.db.users.bulk_write(updates, ordered=True)
+
+        for user_id, matches in matched:
+            await self.compliance_manager._create_alert({
+                "type": "sanctions_rescreen_match",
+                "user_id": user_id,
+                "description": f"Watchlist update matched {matches[0]['name']} ({matches[0]['list']})",
+                "severity": "high",
+                "data": {"list_version": version, "matches": matches}
+            })
+
+    def stats(self) -> Dict[str, Any]:
+        """Last rescreen outcome for the admin performance view"""
+        return {"running": self._task is not None and not self._task.done(), "last_run": self.last_run}
+
+def get_rescreening_job(db, screener, compliance_manager):
+    """Get rescreening job instance"""
+    return RescreeningJob(
+        db,
+        screener,
+        compliance_manager,
+        chunk_size=int(os.getenv('RESCREEN_CHUNK_SIZE', '5000')),
+        max_workers=int(os.getenv('RESCREEN_WORKERS', str(min(4, os.cpu_count() or 1))))
+    )
@@ -0,0 +1,97 @@
+"""
+DalePay Risk Features
+Loads every per-transaction velocity and amount feature in one round trip
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any
+
+from ledger import to_cents, from_cents
+from perf_stats import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+class RiskFeatureLoader:
+    """Builds the features FraudDetectionEngine and ComplianceManager score a
+    sender on. Limits are not enforced from these: the counters are best effort.
+
+    Features come from the velocity counters when they cover every window.
+    Until then, all of them come from a single $facet aggregation over the
+    sender's last seven days of transactions. Amounts are in dollars to
+    match the thresholds the checks already use.
+    """
+
+    def __init__(self, db, velocity):
+        self.db = db
+        self.velocity = velocity
+        self.latency = LatencyStats()
+        self.counters = {"from_counters": 0, "from_transactions": 0}
+
+    async def load(self, user_id: str, amount: float = 0) -> Dict[str, Any]:
+        """Features for a transfer of amount from user_id"""
+        with self.latency.time():
+            now = datetime.utcnow()
+            windows = await self.velocity.windows(user_id, to_cents(amount), now)
+            if all(value is not None for value in windows.values()):
+                self.counters["from_counters"] += 1
+                # Counters only see completed transfers, so both status views agree
+                return {
+                    "source": "counters",
+                    "count_1h": windows["count_1h"],
+                    "completed_count_1h": windows["count_1h"],
+                    "completed_amount_24h": from_cents(windows["amount_24h_cents"]),
+                    "amount_today": from_cents(windows["amount_today_cents"]),
+                    "same_amount_7d": windows["same_amount_7d"],
+                    "completed_same_amount_7d": windows["same_amount_7d"]
+                }
+
+            self.counters["from_transactions"] += 1
+            return await self._load_from_transactions(user_id, amount, now)
+
+    async def _load_from_transactions(self, user_id: str, amount: float, now: datetime) -> Dict[str, Any]:
+        completed = {"$cond": [{"$eq": ["$status", "completed"]}, 1, 0]}
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        pipeline = [
+            {"$match": {"from_user_id": user_id, "created_at": {"$gte": now - timedelta(days=7)}}},
+            {"$facet": {
+                "hour": [
+                    {"$match": {"created_at": {"$gte": now - timedelta(hours=1)}}},
+                    {"$group": {"_id": None, "count": {"$sum": 1}, "completed": {"$sum": completed}}}
+                ],
+                "day": [
+                    {"$match": {"created_at": {"$gte": now - timedelta(days=1)}, "status": "completed"}},
+                    {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+                ],
+                "today": [
+                    {"$match": {"created_at": {"$gte": today}, "status": {"$in": ["completed", "pending"]}}},
+                    {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+                ],
+                "same_amount": [
+                    {"$match": {"amount": amount}},
+                    {"$group": {"_id": None, "count": {"$sum": 1}, "completed": {"$sum": completed}}}
+                ]
+            }}
+        ]
+        result = (await self.db.transactions.aggregate(pipeline).to_list(1))[0]
+
+        def first(facet: str, field: str) -> Any:
+            return result[facet][0][field] if result[facet] else 0
+
+        return {
+            "source": "transactions",
+            "count_1h": first("hour", "count"),
+            "completed_count_1h": first("hour", "completed"),
+            "completed_amount_24h": first("day", "total"),
+            "amount_today": first("today", "total"),
+            "same_amount_7d": first("same_amount", "count"),
+            "completed_same_amount_7d": first("same_amount", "completed")
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Loader statistics for the admin performance view"""
+        return {"latency": self.latency.snapshot(), **self.counters}
+
+def get_risk_feature_loader(db, velocity):
+    """Get risk feature loader instance"""
+    return RiskFeatureLoader(db, velocity)
@@ -0,0 +1,357 @@
+"""
+DalePay Sanctions Screening
+Fuzzy name screening against sanctions and PEP list files
+"""
+
+import os
+import csv
+import asyncio
+import hashlib
+import logging
+import math
+import unicodedata
+from functools import lru_cache
+from itertools import combinations
+from pathlib import Path
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Iterable
+
+from perf_stats import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIST_DIR = Path(__file__).parent / "watchlists"
+# Shorter tokens are a different name after any single edit
+MIN_EDIT_TOKEN_LENGTH = 3
+
+# List files are CSVs with columns entry_id, list_type (sanctions or pep), name
+# and aliases, where aliases are separated by "|"; the file name names the list
+
+def normalize_name(name: str) -> str:
+    """Lowercase, strip accents and punctuation, collapse whitespace"""
+    decomposed = unicodedata.normalize("NFKD", name or "")
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    cleaned = "".join(char if char.isalnum() else " " for char in stripped.lower())
+    return " ".join(cleaned.split())
+
+def trigrams(token: str) -> set:
+    """Character trigrams of a token padded at both ends"""
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def deletions(token: str) -> set:
+    """The token itself and every string one character shorter"""
+    return {token} | {token[:i] + token[i + 1:] for i in range(len(token))}
+
+def within_one_edit(first: str, second: str) -> bool:
+    """True when one substitution, insertion, deletion or adjacent swap turns first into second"""
+    if abs(len(first) - len(second)) > 1:
+        return False
+    if len(first) == len(second):
+        differences = [i for i in range(len(first)) if first[i] != second[i]]
+        if len(differences) == 2:
+            i, j = differences
+            return j == i + 1 and first[i] == second[j] and first[j] == second[i]
+        return len(differences) <= 1
+    shorter, longer = sorted((first, second), key=len)
+    i = 0
+    while i < len(shorter) and shorter[i] == longer[i]:
+        i += 1
+    return shorter[i:] == longer[i + 1:]
+
+def entry_fingerprint(entry: Dict[str, Any]) -> str:
+    """Hash of the fields that affect matching, used to diff list versions"""
+    material = "\x1f".join([entry["list_type"], entry["name"], *sorted(entry["aliases"])])
+    return hashlib.sha256(material.encode()).hexdigest()
+
+class ScreeningIndex:
+    """Immutable token and trigram index over list entries.
+
+    Each name and alias is a variant made of normalized tokens. A query token
+    matches vocabulary tokens by Dice similarity of their trigram sets; only
+    tokens of a compatible length sharing enough of the query's rarest
+    trigrams can reach the threshold (prefix filtering), so a lookup only
+    intersects a few short postings sets. A variant is filed under its
+    rarest token, and since every listed token must be matched, a variant is
+    a candidate only when that anchor token is, and common given names never
+    fan out to thousands of variants. A variant scores the mean of its
+    tokens' best similarities; extra tokens in the customer's name (middle
+    names, suffixes) do not lower the score.
+
+    Trigrams punish a single typo heavily in short tokens ("jon" and "john"
+    share under half their trigrams), so tokens one edit apart also match,
+    scoring 1 - 1/length of the longer token. Those are found through a
+    deletion index: two tokens one edit apart always share a string made by
+    deleting at most one character from each. Only a token that is not itself
+    listed is taken for a typo; short listed names sit one edit from many
+    others, and a customer named "radi" is not a misspelled "rabi". An
+    unlisted token that is two listed tokens with the space between them
+    dropped or typed over matches both, as one edit.
+    """
+
+    def __init__(self, entries: Iterable[Dict[str, Any]], version: str = "",
+                 token_cache_size: int = 65536):
+        self.version = version
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._token_ids: Dict[str, int] = {}
+        self._tokens: List[str] = []
+        self._token_trigrams: List[frozenset] = []
+        self._variants: List[tuple] = []
+
+        for entry in entries:
+            self.entries[entry["entry_id"]] = entry
+            for variant in [entry["name"], *entry["aliases"]]:
+                token_ids = tuple(self._token_id(token) for token in normalize_name(variant).split())
+                if token_ids:
+                    self._variants.append((entry["entry_id"], token_ids))
+
+        frequency = [0] * len(self._token_trigrams)
+        for _, token_ids in self._variants:
+            for token_id in token_ids:
+                frequency[token_id] += 1
+        self._anchor_postings: Dict[int, List[int]] = defaultdict(list)
+        for variant_id, (_, token_ids) in enumerate(self._variants):
+            anchor = min(token_ids, key=lambda token_id: frequency[token_id])
+            self._anchor_postings[anchor].append(variant_id)
+        self._anchor_postings = dict(self._anchor_postings)
+
+        # Trigram postings split by token trigram count, so only compatible lengths are read
+        buckets: Dict[str, Dict[int, set]] = defaultdict(lambda: defaultdict(set))
+        for token_id, token_trigrams in enumerate(self._token_trigrams):
+            for trigram in token_trigrams:
+                buckets[trigram][len(token_trigrams)].add(token_id)
+        self._trigram_postings: Dict[str, Dict[int, frozenset]] = {
+            trigram: {length: frozenset(token_ids) for length, token_ids in by_length.items()}
+            for trigram, by_length in buckets.items()
+        }
+
+        deletion_postings: Dict[str, List[int]] = defaultdict(list)
+        for token_id, token in enumerate(self._tokens):
+            if len(token) >= MIN_EDIT_TOKEN_LENGTH:
+                for key in deletions(token):
+                    deletion_postings[key].append(token_id)
+        self._deletion_postings = dict(deletion_postings)
+
+        self._similar_tokens = lru_cache(maxsize=token_cache_size)(self._find_similar_tokens)
+
+    def _token_id(self, token: str) -> int:
+        token_id = self._token_ids.get(token)
+        if token_id is None:
+            token_id = len(self._token_trigrams)
+            self._token_ids[token] = token_id
+            self._tokens.append(token)
+            self._token_trigrams.append(frozenset(trigrams(token)))
+        return token_id
+
+    def _find_similar_tokens(self, token: str, threshold: float) -> tuple:
+        """Similar vocabulary tokens with their scores, and the ids matched only by an edit"""
+        query_trigrams = trigrams(token)
+        size = len(query_trigrams)
+        # Dice >= threshold bounds the candidate's trigram count
+        min_length = math.ceil(threshold * size / (2 - threshold))
+        max_length = math.floor((2 - threshold) * size / threshold)
+
+        candidates = set()
+        for length in range(min_length, max_length + 1):
+            needed = math.ceil(threshold * (size + length) / 2)
+            postings = [
+                self._trigram_postings[trigram][length] for trigram in query_trigrams
+                if length in self._trigram_postings.get(trigram, ())
+            ]
+            if len(postings) < needed:
+                continue
+            # A match shares at least `required` of any (len - needed + required) of
+            # these trigrams, so only the rarest few postings are intersected
+            required = min(2, needed)
+            postings.sort(key=len)
+            prefix = postings[:len(postings) - needed + required]
+            if required == 1:
+                candidates.update(*prefix)
+            else:
+                for first, second in combinations(prefix, 2):
+                    candidates |= first & second
+
+        similar = {}
+        for token_id in candidates:
+            candidate_trigrams = self._token_trigrams[token_id]
+            score = 2 * len(query_trigrams & candidate_trigrams) / (size + len(candidate_trigrams))
+            if score >= threshold:
+                similar[token_id] = score
+
+        edited = set()
+        if len(token) < MIN_EDIT_TOKEN_LENGTH or token in self._token_ids:
+            return similar, frozenset(edited)
+        for key in deletions(token):
+            for token_id in self._deletion_postings.get(key, ()):
+                candidate = self._tokens[token_id]
+                if token_id in similar or not within_one_edit(token, candidate):
+                    continue
+                score = 1 - 1 / max(len(token), len(candidate))
+                if score >= threshold:
+                    similar[token_id] = score
+                    edited.add(token_id)
+        split = self._split(token)
+        if split:
+            # Both halves are spelled right; the edit is charged to the first
+            similar.update(dict.fromkeys(split, 1.0))
+            edited.add(split[0])
+            edited.discard(split[1])
+        return similar, frozenset(edited)
+
+    def _split(self, token: str) -> Optional[tuple]:
+        """Ids of two listed tokens that token joins without, or over, the space between them"""
+        for i in range(MIN_EDIT_TOKEN_LENGTH, len(token) - MIN_EDIT_TOKEN_LENGTH + 1):
+            head = self._token_ids.get(token[:i])
+            if head is None:
+                continue
+            for tail in (token[i:], token[i + 1:]):
+                tail_id = self._token_ids.get(tail)
+                if tail_id is not None and len(tail) >= MIN_EDIT_TOKEN_LENGTH:
+                    return head, tail_id
+        return None
+
+    def search(self, name: str, threshold: float = 0.85, token_threshold: float = 0.7,
+               list_type: Optional[str] = None, limit: int = 5) -> List[Dict[str, Any]]:
+        """Entries whose name or an alias matches name at or above threshold"""
+        matched: Dict[int, float] = {}
+        edited = set()
+        for token in set(normalize_name(name).split()):
+            similar, by_edit = self._similar_tokens(token, token_threshold)
+            for token_id, similarity in similar.items():
+                if similarity > matched.get(token_id, 0.0):
+                    matched[token_id] = similarity
+                    if token_id in by_edit:
+                        edited.add(token_id)
+                    else:
+                        edited.discard(token_id)
+
+        matches: Dict[str, Dict[str, Any]] = {}
+        for token_id in matched:
+            for variant_id in self._anchor_postings.get(token_id, ()):
+                entry_id, token_ids = self._variants[variant_id]
+                total = 0.0
+                edits = 0
+                for variant_token in token_ids:
+                    similarity = matched.get(variant_token)
+                    if similarity is None:
+                        break
+                    # One typo is a near miss; a typo in every token is a different name
+                    edits += variant_token in edited
+                    if edits > 1:
+                        break
+                    total += similarity
+                else:
+                    score = total / len(token_ids)
+                    if score < threshold:
+                        continue
+                    entry = self.entries[entry_id]
+                    if list_type and entry["list_type"] != list_type:
+                        continue
+                    if entry_id not in matches or score > matches[entry_id]["score"]:
+                        matches[entry_id] = {
+                            "entry_id": entry_id,
+                            "list": entry["list"],
+                            "list_type": entry["list_type"],
+                            "name": entry["name"],
+                            "score": round(score, 4)
+                        }
+
+        return sorted(matches.values(), key=lambda match: match["score"], reverse=True)[:limit]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+def load_list_files(list_dir: Path) -> tuple:
+    """Read every *.csv list in list_dir; returns (entries, version)"""
+    entries = []
+    digest = hashlib.sha256()
+    for path in sorted(Path(list_dir).glob("*.csv")):
+        content = path.read_bytes()
+        digest.update(path.name.encode())
+        digest.update(content)
+        reader = csv.DictReader(content.decode("utf-8-sig").splitlines())
+        for row in reader:
+            if not row.get("entry_id") or not row.get("name"):
+                continue
+            entry = {
+                "entry_id": f"{path.stem}:{row['entry_id'].strip()}",
+                "list": path.stem,
+                "list_type": (row.get("list_type") or "sanctions").strip().lower(),
+                "name": row["name"].strip(),
+                "aliases": [alias.strip() for alias in (row.get("aliases") or "").split("|") if alias.strip()]
+            }
+            entry["fingerprint"] = entry_fingerprint(entry)
+            entries.append(entry)
+    return entries, digest.hexdigest()[:16]
+
+class SanctionsScreener:
+    """Holds the live screening index and swaps it atomically on reload.
+
+    Screening reads self.index once per call, so a reload running alongside
+    never exposes a half-built index; callers see either the old lists or
+    the new ones.
+    """
+
+    def __init__(self, list_dir: Path, threshold: float = 0.85, token_threshold: float = 0.7,
+                 block_threshold: float = 0.95):
+        self.list_dir = Path(list_dir)
+        self.threshold = threshold
+        self.token_threshold = token_threshold
+        self.block_threshold = block_threshold
+        self.index: Optional[ScreeningIndex] = None
+        self.loaded_at: Optional[datetime] = None
+        self.latency = LatencyStats()
+        self._reload_lock = asyncio.Lock()
+
+    def _build(self) -> ScreeningIndex:
+        entries, version = load_list_files(self.list_dir)
+        return ScreeningIndex(entries, version)
+
+    async def reload(self) -> Dict[str, Any]:
+        """Rebuild the index from disk off the event loop and swap it in"""
+        async with self._reload_lock:
+            started = datetime.utcnow()
+            new_index = await asyncio.get_running_loop().run_in_executor(None, self._build)
+            old_index = self.index
+            self.index = new_index
+            self.loaded_at = datetime.utcnow()
+            logger.info(f"Screening lists loaded: {len(new_index)} entries, version {new_index.version}")
+
+            return {
+                "version": new_index.version,
+                "entries": len(new_index),
+                "previous_version": old_index.version if old_index else None,
+                "duration_ms": round((self.loaded_at - started).total_seconds() * 1000, 3)
+            }
+
+    def screen(self, name: str, list_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Matches for a name, best first"""
+        index = self.index
+        if index is None:
+            # First use before startup loaded the lists
+            index = self.index = self._build()
+            self.loaded_at = datetime.utcnow()
+        with self.latency.time():
+            return index.search(name, self.threshold, self.token_threshold, list_type)
+
+    def blocking(self, matches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Matches close enough to refuse outright; weaker ones go to review"""
+        return [match for match in matches if match["score"] >= self.block_threshold]
+
+    def stats(self) -> Dict[str, Any]:
+        """Screening statistics for the admin performance view"""
+        return {
+            "version": self.index.version if self.index else None,
+            "entries": len(self.index) if self.index else 0,
+            "loaded_at": self.loaded_at,
+            "latency": self.latency.snapshot()
+        }
+
+# Initialize the sanctions screener
+sanctions_screener = SanctionsScreener(
+    os.getenv('SANCTIONS_LIST_DIR', str(DEFAULT_LIST_DIR)),
+    threshold=float(os.getenv('SANCTIONS_MATCH_THRESHOLD', '0.85')),
+    token_threshold=float(os.getenv('SANCTIONS_TOKEN_THRESHOLD', '0.7')),
+    block_threshold=float(os.getenv('SANCTIONS_BLOCK_THRESHOLD', '0.95'))
+)
@@ -0,0 +1,217 @@
+"""
+DalePay Job Scheduler
+Runs periodic jobs on exactly one worker using MongoDB leases
+"""
+
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, Callable, Awaitable, Optional
+
+from pymongo import ReturnDocument
+
+from perf_stats import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+class ScheduledJob:
+    """A registered job and its in-process statistics"""
+
+    def __init__(self, name: str, func: Callable[[], Awaitable[Any]], interval_seconds: int,
+                 lease_seconds: int, initial_delay: int):
+        self.name = name
+        self.func = func
+        self.interval_seconds = interval_seconds
+        self.lease_seconds = lease_seconds
+        self.initial_delay = initial_delay
+        self.duration = LatencyStats()
+        self.counters = {"runs": 0, "failures": 0, "leases_lost": 0}
+
+class JobScheduler:
+    """Periodic jobs shared by every worker process.
+
+    Each job has a document in scheduled_jobs holding its next run time and
+    lease. Every worker polls for due jobs, but a run only starts after a
+    find_one_and_update claims the lease, so with any number of uvicorn
+    workers each run happens once. The lease is renewed while the job runs;
+    if a worker dies mid-run the lease expires and another worker retries
+    the run. Next and last run times live in MongoDB, so a restart does not
+    reset a job's timer.
+    """
+
+    def __init__(self, db, poll_seconds: float = 15.0):
+        self.collection = db.scheduled_jobs
+        self.poll_seconds = poll_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._running: Dict[str, asyncio.Task] = {}
+
+    def add_job(self, name: str, func: Callable[[], Awaitable[Any]], interval_seconds: int,
+                lease_seconds: Optional[int] = None, initial_delay: int = 0):
+        """Run func every interval_seconds on one worker"""
+        self.jobs[name] = ScheduledJob(
+            name, func, interval_seconds, lease_seconds or max(60, interval_seconds // 2), initial_delay
+        )
+
+    async def _register(self):
+        now = datetime.utcnow()
+        for job in self.jobs.values():
+            await self.collection.update_one(
+                {"_id": job.name},
+                {
+                    "$set": {"interval_seconds": job.interval_seconds},
+                    "$setOnInsert": {
+                        "next_run_at": now + timedelta(seconds=job.initial_delay),
+                        "last_run_at": None,
+                        "lease_owner": None,
+                        "lease_until": None,
+                        "runs": 0,
+                        "failures": 0
+                    }
+                },
+                upsert=True
+            )
+
+    async def start(self):
+        """Register the jobs and start polling for due runs"""
+        if self._task is None or self._task.done():
+            await self._register()
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Scheduler {self.owner} started with jobs {sorted(self.jobs)}")
+
+    async def _run(self):
+        while True:
+            wait = self.poll_seconds
+            try:
+                wait = min(wait, await self._start_due_jobs())
+            except Exception as e:
+                logger.error(f"Scheduler poll error: {e}")
+            await asyncio.sleep(max(1.0, wait))
+
+    async def _start_due_jobs(self) -> float:
+        """Claim and start due jobs; returns seconds until the next one is due"""
+        now = datetime.utcnow()
+        documents = await self.collection.find(
+            {"_id": {"$in": list(self.jobs)}}, {"next_run_at": 1}
+        ).to_list(None)
+        next_due = self.poll_seconds
+        for document in documents:
+            name = document["_id"]
+            if name in self._running:
+                continue
+            if document["next_run_at"] > now:
+                next_due = min(next_due, (document["next_run_at"] - now).total_seconds())
+                continue
+            if await self._claim(self.jobs[name], now):
+                self._running[name] = asyncio.create_task(self._execute(self.jobs[name]))
+        return next_due
+
+    async def _claim(self, job: ScheduledJob, now: datetime) -> bool:
+        claimed = await self.collection.find_one_and_update(
+            {
+                "_id": job.name,
+                "next_run_at": {"$lte": now},
+                "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]
+            },
+            {"$set": {"lease_owner": self.owner, "lease_until": now + timedelta(seconds=job.lease_seconds)}},
+            projection={"_id": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        return claimed is not None
+
+    async def _renew(self, job: ScheduledJob):
+        while True:
+            await asyncio.sleep(job.lease_seconds / 3)
+            result = await self.collection.update_one(
+                {"_id": job.name, "lease_owner": self.owner},
+                {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=job.lease_seconds)}}
+            )
+            if result.matched_count == 0:
+                job.counters["leases_lost"] += 1
+                logger.warning(f"Scheduler lost the lease on {job.name} while it was running")
+                return
+
+    async def _execute(self, job: ScheduledJob):
+        started_at = datetime.utcnow()
+        started = time.perf_counter()
+        renewer = asyncio.create_task(self._renew(job))
+        error = None
+        try:
+            await job.func()
+        except Exception as e:
+            error = str(e)
+            job.counters["failures"] += 1
+            logger.error(f"Scheduled job {job.name} failed: {e}")
+        finally:
+            renewer.cancel()
+            duration = time.perf_counter() - started
+            job.duration.record(duration, error is not None)
+            job.counters["runs"] += 1
+            self._running.pop(job.name, None)
+
+        try:
+            await self.collection.update_one(
+                {"_id": job.name, "lease_owner": self.owner},
+                {
+                    "$set": {
+                        "last_run_at": started_at,
+                        "last_duration_ms": round(duration * 1000, 3),
+                        "last_status": "failed" if error else "completed",
+                        "last_error": error,
+                        "last_owner": self.owner,
+                        "next_run_at": started_at + timedelta(seconds=job.interval_seconds),
+                        "lease_owner": None,
+                        "lease_until": None
+                    },
+                    "$inc": {"runs": 1, "failures": 1 if error else 0}
+                }
+            )
+        except Exception as e:
+            # The lease expires on its own; another worker reruns the job
+            logger.error(f"Error recording run of {job.name}: {e}")
+
+    async def run_now(self, name: str) -> bool:
+        """Make a job due immediately; the next poll on any worker runs it"""
+        result = await self.collection.update_one({"_id": name}, {"$set": {"next_run_at": datetime.utcnow()}})
+        return result.matched_count > 0
+
+    async def status(self) -> Dict[str, Any]:
+        """Persisted run history for every job"""
+        documents = await self.collection.find({"_id": {"$in": list(self.jobs)}}).to_list(None)
+        return {document.pop("_id"): document for document in documents}
+
+    async def shutdown(self):
+        """Stop polling and hand leases of interrupted runs back"""
+        if self._task is not None:
+            self._task.cancel()
+        for name, task in list(self._running.items()):
+            task.cancel()
+            # Interrupted runs stay due, so another worker picks them up right away
+            await self.collection.update_one(
+                {"_id": name, "lease_owner": self.owner},
+                {"$set": {"lease_owner": None, "lease_until": None}}
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """Scheduler statistics for the admin performance view"""
+        return {
+            "owner": self.owner,
+            "running": sorted(self._running),
+            "jobs": {
+                name: {
+                    "interval_seconds": job.interval_seconds,
+                    "duration": job.duration.snapshot(),
+                    **job.counters
+                }
+                for name, job in self.jobs.items()
+            }
+        }
+
+def get_scheduler(db):
+    """Get job scheduler instance"""
+    return JobScheduler(db, poll_seconds=float(os.getenv('SCHEDULER_POLL_SECONDS', '15')))
@@ -1,29 +1,37 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, BackgroundTasks
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, status, BackgroundTasks
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr, validator
 from typing import List, Optional, Dict, Any
 import uuid
+import time
 from datetime import datetime, timedelta
 import hashlib
 import hmac
 import jwt
 import httpx
 import asyncio
+import contextlib
 import json
+import heapq
 from decimal import Decimal, ROUND_HALF_UP
 import re
 from cryptography.fernet import Fernet
 import base64
 
-from passlib.context import CryptContext
-from passlib.hash import bcrypt
+# Production Configuration
+# Loaded before the local imports below, whose module-level singletons read their settings from the environment
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
 
 # Import real banking and wallet systems
 import sys
@@ -49,15 +57,42 @@ except ImportError as e:
     PaymentRequest = None
     MerchantPayment = None
 
-# Production Configuration
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+from principal_cache import principal_cache
+from password_hashing import password_hasher
+from transfer_engine import TransferEngine, ReconciliationNeeded, spend_window
+from ledger import Ledger, to_cents, from_cents, percent_of_cents
+from idempotency import get_idempotency_store
+from index_manager import IndexManager
+from velocity import get_velocity_counters
+from risk_features import get_risk_feature_loader
+from sanctions_screening import sanctions_screener
+from compliance_module import ComplianceManager, FraudDetectionEngine
+from rescreening import get_rescreening_job
+from audit_log import get_audit_log_writer
+from metric_rollups import get_metric_rollups
+from scheduler import get_scheduler
+from fraud_monitor import get_fraud_monitor
+from alerts import get_alert_store
+from perf_stats import LatencyStats
+from logging_pipeline import setup_logging, request_id_var
+import metrics
+from query_monitor import get_query_monitor
+
+try:
+    import h2  # noqa: F401 - enables HTTP/2 in httpx
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+query_monitor = get_query_monitor()
+client = AsyncIOMotorClient(mongo_url, event_listeners=[metrics.MongoCommandMetrics(), query_monitor])
 db = client[os.environ['DB_NAME']]
 
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+loop_lag_monitor = metrics.LoopLagMonitor(float(os.environ.get('LOOP_LAG_INTERVAL_SECONDS', '0.5')))
+
 # Create the main app
 app = FastAPI(
     title="DalePay Financial Services API", 
@@ -72,7 +107,6 @@ api_router = APIRouter(prefix="/api")
 
 # Security Configuration
 security = HTTPBearer()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.environ.get("SECRET_KEY")
 ALGORITHM = "HS256"
 ENCRYPTION_KEY = os.environ.get("ENCRYPTION_KEY", Fernet.generate_key())
@@ -82,6 +116,22 @@ MOOV_PUBLIC_KEY = os.environ.get("MOOV_PUBLIC_KEY")
 MOOV_SECRET_KEY = os.environ.get("MOOV_SECRET_KEY") 
 MOOV_ACCOUNT_ID = os.environ.get("MOOV_ACCOUNT_ID")
 MOOV_BASE_URL = "https://api.moov.io"
+MOOV_HTTP2_ENABLED = os.environ.get("MOOV_HTTP2_ENABLED", "true").lower() == "true"
+MOOV_MAX_CONNECTIONS = int(os.environ.get("MOOV_MAX_CONNECTIONS", "100"))
+MOOV_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("MOOV_MAX_KEEPALIVE_CONNECTIONS", "20"))
+MOOV_KEEPALIVE_EXPIRY = float(os.environ.get("MOOV_KEEPALIVE_EXPIRY", "30"))
+MOOV_TIMEOUT_SECONDS = float(os.environ.get("MOOV_TIMEOUT_SECONDS", "10"))
+MOOV_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("MOOV_CONNECT_TIMEOUT_SECONDS", "5"))
+MOOV_POOL_TIMEOUT_SECONDS = float(os.environ.get("MOOV_POOL_TIMEOUT_SECONDS", "5"))
+
+# Bulk payout limits
+MAX_BATCH_TRANSFER_ITEMS = int(os.environ.get("MAX_BATCH_TRANSFER_ITEMS", "10000"))
+BATCH_TRANSFER_CHUNK_SIZE = int(os.environ.get("BATCH_TRANSFER_CHUNK_SIZE", "500"))
+
+# Transaction history page size cap
+MAX_TRANSACTIONS_PAGE_SIZE = int(os.environ.get("MAX_TRANSACTIONS_PAGE_SIZE", "100"))
+# Deepest row a legacy page= request may start at; deeper pages must use cursors
+MAX_TRANSACTIONS_PAGE_OFFSET = int(os.environ.get("MAX_TRANSACTIONS_PAGE_OFFSET", "1000"))
 
 # FinCEN Registration Details
 FINCEN_REGISTRATION = {
@@ -94,15 +144,8 @@ FINCEN_REGISTRATION = {
 # Initialize encryption
 fernet = Fernet(ENCRYPTION_KEY)
 
-# Configure logging for production
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/var/log/dalepay.log'),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging for production; disk writes happen on the pipeline's writer thread
+log_pipeline = setup_logging()
 logger = logging.getLogger(__name__)
 
 # Models for Production Financial Application
@@ -180,6 +223,18 @@ class MoneyTransfer(BaseModel):
             raise ValueError('Transfer amount exceeds daily limit')
         return v.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
 
+class BatchTransfer(BaseModel):
+    items: List[MoneyTransfer]
+    description: Optional[str] = None
+    
+    @validator('items')
+    def validate_items(cls, v):
+        if not v:
+            raise ValueError('Batch must contain at least one transfer')
+        if len(v) > MAX_BATCH_TRANSFER_ITEMS:
+            raise ValueError(f'Batch exceeds {MAX_BATCH_TRANSFER_ITEMS} transfers')
+        return v
+
 class WithdrawRequest(BaseModel):
     amount: Decimal
     destination_type: str  # bank, debit_card
@@ -208,6 +263,79 @@ class MoovAPI:
         self.public_key = MOOV_PUBLIC_KEY
         self.secret_key = MOOV_SECRET_KEY
         self.account_id = MOOV_ACCOUNT_ID
+        self.client: Optional[httpx.AsyncClient] = None
+        self.latency: Dict[str, LatencyStats] = {}
+        self.pool_wait = LatencyStats()
+    
+    async def startup(self):
+        """Open the shared keep-alive connection pool"""
+        if self.client is not None:
+            return
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=MOOV_HTTP2_ENABLED and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=MOOV_MAX_CONNECTIONS,
+                max_keepalive_connections=MOOV_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=MOOV_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(
+                MOOV_TIMEOUT_SECONDS,
+                connect=MOOV_CONNECT_TIMEOUT_SECONDS,
+                pool=MOOV_POOL_TIMEOUT_SECONDS
+            )
+        )
+        logger.info(f"Moov HTTP client started (http2={MOOV_HTTP2_ENABLED and HTTP2_AVAILABLE})")
+    
+    async def shutdown(self):
+        """Close the shared connection pool"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+    
+    async def _request(self, endpoint: str, method: str, path: str, **kwargs) -> httpx.Response:
+        """Send a request on the shared client, recording latency and pool wait"""
+        if self.client is None:
+            await self.startup()
+        
+        headers = await self.get_headers()
+        started = time.perf_counter()
+        connection_ready = None
+        
+        async def trace(event_name: str, info: dict):
+            # First connect or header write marks the end of the wait for a pooled connection
+            nonlocal connection_ready
+            if connection_ready is None and event_name in (
+                "connection.connect_tcp.started",
+                "http11.send_request_headers.started",
+                "http2.send_request_headers.started"
+            ):
+                connection_ready = time.perf_counter()
+        
+        failed = True
+        try:
+            response = await self.client.request(
+                method, path, headers=headers, extensions={"trace": trace}, **kwargs
+            )
+            failed = response.status_code >= 500
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self.latency.setdefault(endpoint, LatencyStats())
+            stats.record(elapsed, error=failed)
+            metrics.moov_request_duration.observe(elapsed, endpoint)
+            if failed:
+                metrics.moov_request_errors.inc(endpoint)
+            if connection_ready is not None:
+                self.pool_wait.record(connection_ready - started)
+    
+    def stats(self) -> dict:
+        """Moov client statistics for the admin performance view"""
+        return {
+            "http2": bool(self.client and MOOV_HTTP2_ENABLED and HTTP2_AVAILABLE),
+            "pool_wait": self.pool_wait.snapshot(),
+            "endpoints": {name: stats.snapshot() for name, stats in self.latency.items()}
+        }
         
     async def get_headers(self) -> dict:
         """Get authentication headers for Moov API"""
@@ -220,54 +348,47 @@ class MoovAPI:
     async def create_account(self, user_data: dict) -> str:
         """Create real Moov account for user"""
         try:
-            async with httpx.AsyncClient() as client:
-                headers = await self.get_headers()
-                
-                account_data = {
-                    "accountType": "individual",
-                    "profile": {
-                        "individual": {
-                            "name": {
-                                "firstName": user_data["full_name"].split()[0],
-                                "lastName": " ".join(user_data["full_name"].split()[1:])
-                            },
-                            "email": user_data["email"],
-                            "phone": {
-                                "number": user_data["phone"],
-                                "countryCode": "1"
-                            },
-                            "address": {
-                                "addressLine1": user_data["address_line_1"],
-                                "addressLine2": user_data.get("address_line_2", ""),
-                                "city": user_data["city"],
-                                "stateOrProvince": user_data["state"],
-                                "postalCode": user_data["zip_code"],
-                                "country": user_data["country"]
-                            },
-                            "birthDate": user_data["date_of_birth"],
-                            "governmentID": {
-                                "ssn": {
-                                    "lastFourSSN": user_data["ssn_last_4"]
-                                }
+            account_data = {
+                "accountType": "individual",
+                "profile": {
+                    "individual": {
+                        "name": {
+                            "firstName": user_data["full_name"].split()[0],
+                            "lastName": " ".join(user_data["full_name"].split()[1:])
+                        },
+                        "email": user_data["email"],
+                        "phone": {
+                            "number": user_data["phone"],
+                            "countryCode": "1"
+                        },
+                        "address": {
+                            "addressLine1": user_data["address_line_1"],
+                            "addressLine2": user_data.get("address_line_2", ""),
+                            "city": user_data["city"],
+                            "stateOrProvince": user_data["state"],
+                            "postalCode": user_data["zip_code"],
+                            "country": user_data["country"]
+                        },
+                        "birthDate": user_data["date_of_birth"],
+                        "governmentID": {
+                            "ssn": {
+                                "lastFourSSN": user_data["ssn_last_4"]
                             }
                         }
                     }
                 }
+            }
+            
+            response = await self._request("create_account", "POST", "/accounts", json=account_data)
+            
+            if response.status_code == 201:
+                account_info = response.json()
+                logger.info(f"Moov account created: {account_info['accountID']}")
+                return account_info["accountID"]
+            else:
+                logger.error(f"Moov account creation failed: {response.text}")
+                raise HTTPException(status_code=400, detail="Failed to create financial account")
                 
-                response = await client.post(
-                    f"{self.base_url}/accounts",
-                    headers=headers,
-                    json=account_data
-                )
-                
-                if response.status_code == 201:
-                    account_info = response.json()
-                    logger.info(f"Moov account created: {account_info['accountID']}")
-                    return account_info["accountID"]
-                else:
-                    logger.error(f"Moov account creation failed: {response.text}")
-                    raise HTTPException(status_code=400, detail="Failed to create financial account")
-                    
         except Exception as e:
             logger.error(f"Error creating Moov account: {e}")
             raise HTTPException(status_code=500, detail="Account creation error")
@@ -275,33 +396,31 @@ class MoovAPI:
     async def link_bank_account(self, moov_account_id: str, bank_data: BankAccountLink) -> str:
         """Link real bank account via Moov"""
         try:
-            async with httpx.AsyncClient() as client:
-                headers = await self.get_headers()
-                
-                bank_account_data = {
-                    "account": {
-                        "accountNumber": bank_data.account_number,
-                        "routingNumber": bank_data.routing_number,
-                        "accountType": bank_data.account_type,
-                        "holderName": bank_data.account_holder_name,
-                        "holderType": "individual"
-                    }
+            bank_account_data = {
+                "account": {
+                    "accountNumber": bank_data.account_number,
+                    "routingNumber": bank_data.routing_number,
+                    "accountType": bank_data.account_type,
+                    "holderName": bank_data.account_holder_name,
+                    "holderType": "individual"
                 }
+            }
+            
+            response = await self._request(
+                "link_bank_account",
+                "POST",
+                f"/accounts/{moov_account_id}/bank-accounts",
+                json=bank_account_data
+            )
+            
+            if response.status_code == 201:
+                bank_info = response.json()
+                logger.info(f"Bank account linked: {bank_info['bankAccountID']}")
+                return bank_info["bankAccountID"]
+            else:
+                logger.error(f"Bank linking failed: {response.text}")
+                raise HTTPException(status_code=400, detail="Failed to link bank account")
                 
-                response = await client.post(
-                    f"{self.base_url}/accounts/{moov_account_id}/bank-accounts",
-                    headers=headers,
-                    json=bank_account_data
-                )
-                
-                if response.status_code == 201:
-                    bank_info = response.json()
-                    logger.info(f"Bank account linked: {bank_info['bankAccountID']}")
-                    return bank_info["bankAccountID"]
-                else:
-                    logger.error(f"Bank linking failed: {response.text}")
-                    raise HTTPException(status_code=400, detail="Failed to link bank account")
-                    
         except Exception as e:
             logger.error(f"Error linking bank account: {e}")
             raise HTTPException(status_code=500, detail="Bank linking error")
@@ -309,23 +428,21 @@ class MoovAPI:
     async def get_account_balance(self, moov_account_id: str) -> Decimal:
         """Get real account balance from Moov"""
         try:
-            async with httpx.AsyncClient() as client:
-                headers = await self.get_headers()
-                
-                response = await client.get(
-                    f"{self.base_url}/accounts/{moov_account_id}/balance",
-                    headers=headers
-                )
+            response = await self._request(
+                "get_account_balance",
+                "GET",
+                f"/accounts/{moov_account_id}/balance"
+            )
+            
+            if response.status_code == 200:
+                balance_data = response.json()
+                # Convert from cents to dollars
+                balance = Decimal(balance_data.get("amount", 0)) / 100
+                return balance
+            else:
+                logger.error(f"Balance fetch failed: {response.text}")
+                return Decimal('0.00')
                 
-                if response.status_code == 200:
-                    balance_data = response.json()
-                    # Convert from cents to dollars
-                    balance = Decimal(balance_data.get("amount", 0)) / 100
-                    return balance
-                else:
-                    logger.error(f"Balance fetch failed: {response.text}")
-                    return Decimal('0.00')
-                    
         except Exception as e:
             logger.error(f"Error getting balance: {e}")
             return Decimal('0.00')
@@ -333,41 +450,34 @@ class MoovAPI:
     async def process_transfer(self, from_account: str, to_account: str, amount: Decimal, description: str) -> dict:
         """Process real money transfer via Moov"""
         try:
-            async with httpx.AsyncClient() as client:
-                headers = await self.get_headers()
-                
-                transfer_data = {
-                    "amount": {
-                        "currency": "USD",
-                        "value": int(amount * 100)  # Convert to cents
-                    },
-                    "source": {
-                        "accountID": from_account
-                    },
-                    "destination": {
-                        "accountID": to_account
-                    },
-                    "description": description,
-                    "metadata": {
-                        "platform": "DalePay",
-                        "transfer_type": "p2p"
-                    }
+            transfer_data = {
+                "amount": {
+                    "currency": "USD",
+                    "value": int(amount * 100)  # Convert to cents
+                },
+                "source": {
+                    "accountID": from_account
+                },
+                "destination": {
+                    "accountID": to_account
+                },
+                "description": description,
+                "metadata": {
+                    "platform": "DalePay",
+                    "transfer_type": "p2p"
                 }
+            }
+            
+            response = await self._request("process_transfer", "POST", "/transfers", json=transfer_data)
+            
+            if response.status_code == 201:
+                transfer_info = response.json()
+                logger.info(f"Transfer processed: {transfer_info['transferID']}")
+                return transfer_info
+            else:
+                logger.error(f"Transfer failed: {response.text}")
+                raise HTTPException(status_code=400, detail="Transfer processing failed")
                 
-                response = await client.post(
-                    f"{self.base_url}/transfers",
-                    headers=headers,
-                    json=transfer_data
-                )
-                
-                if response.status_code == 201:
-                    transfer_info = response.json()
-                    logger.info(f"Transfer processed: {transfer_info['transferID']}")
-                    return transfer_info
-                else:
-                    logger.error(f"Transfer failed: {response.text}")
-                    raise HTTPException(status_code=400, detail="Transfer processing failed")
-                    
         except Exception as e:
             logger.error(f"Error processing transfer: {e}")
             raise HTTPException(status_code=500, detail="Transfer error")
@@ -375,6 +485,24 @@ class MoovAPI:
 # Initialize Moov API
 moov_api = MoovAPI()
 
+# Initialize ledger and transfer engine
+ledger = Ledger(db)
+velocity_counters = get_velocity_counters(db)
+risk_features = get_risk_feature_loader(db, velocity_counters)
+metric_rollups = get_metric_rollups(db)
+transfer_engine = TransferEngine(client, db, ledger, velocity_counters, metric_rollups)
+
+# Initialize idempotency store for money-moving endpoints
+idempotency_store = get_idempotency_store(db)
+index_manager = IndexManager(db)
+audit_log = get_audit_log_writer(db)
+scheduler = get_scheduler(db)
+alert_store = get_alert_store(db)
+fraud_monitor = get_fraud_monitor(db, alert_store)
+compliance_manager = ComplianceManager(db, risk_features, audit_log=audit_log, rollups=metric_rollups, alerts=alert_store)
+fraud_engine = FraudDetectionEngine(db, risk_features, alerts=alert_store)
+rescreening_job = get_rescreening_job(db, sanctions_screener, compliance_manager)
+
 # Utility Functions
 def serialize_mongo_doc(doc):
     """Convert MongoDB document to JSON-serializable format"""
@@ -400,11 +528,11 @@ def serialize_mongo_doc(doc):
         return result
     return doc
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    return await password_hasher.hash(password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.verify(plain_password, hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -425,9 +553,12 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication")
     
-    user = await db.users.find_one({"id": user_id})
+    user = principal_cache.get(user_id)
     if user is None:
-        raise HTTPException(status_code=401, detail="User not found")
+        user = await db.users.find_one({"id": user_id}, {"password_hash": 0})
+        if user is None:
+            raise HTTPException(status_code=401, detail="User not found")
+        principal_cache.put(user)
     
     # Check if account is frozen or suspended
     if user.get("account_status") == "frozen":
@@ -498,12 +629,10 @@ async def aml_screening(user_data: dict, transaction_data: dict = None) -> dict:
 
 async def log_compliance_action(action_data: dict):
     """Log compliance actions for audit trail"""
-    try:
-        action_data["id"] = str(uuid.uuid4())
-        await db.compliance_logs.insert_one(action_data)
-        logger.info(f"Compliance action logged: {action_data['action']}")
-    except Exception as e:
-        logger.error(f"Error logging compliance action: {e}")
+    action_data["id"] = str(uuid.uuid4())
+    # Buffered; the audit log writer batches inserts off the request path
+    audit_log.write(action_data)
+    logger.info(f"Compliance action logged: {action_data['action']}")
 
 # API Routes - Production Financial Services
 
@@ -550,11 +679,12 @@ async def register_user(user_data: UserCreate, background_tasks: BackgroundTasks
         user_record = {
             "id": user_id,
             "email": user_data.email,
-            "password_hash": hash_password(user_data.password),
+            "password_hash": await hash_password(user_data.password),
             "full_name": user_data.full_name,
             "phone": user_data.phone,
             "moov_account_id": moov_account_id,
             "wallet_balance": float(Decimal('100.00')),  # Demo: Start with $100
+            "wallet_balance_cents": to_cents(Decimal('100.00')),
             "account_status": "active",  # active, frozen, suspended, closed
             "kyc_status": kyc_result["status"],
             "kyc_level": kyc_result["verification_level"],
@@ -579,7 +709,12 @@ async def register_user(user_data: UserCreate, background_tasks: BackgroundTasks
             "privacy_accepted_at": datetime.utcnow()
         }
         
-        await db.users.insert_one(user_record)
+        try:
+            await transfer_engine.create_account(user_record)
+        except DuplicateKeyError:
+            # A concurrent registration with this email won the unique index
+            raise HTTPException(status_code=400, detail="User already exists")
+        await metric_rollups.record_signup(user_record)
         
         # Create access token
         access_token = create_access_token(data={"sub": user_id})
@@ -628,7 +763,7 @@ async def login_user(login_data: dict):
             raise HTTPException(status_code=422, detail="Email and password are required")
             
         user = await db.users.find_one({"email": email})
-        if not user or not verify_password(password, user["password_hash"]):
+        if not user or not await verify_password(password, user["password_hash"]):
             # Log failed login attempt
             await log_compliance_action({
                 "action": "failed_login_attempt",
@@ -646,6 +781,7 @@ async def login_user(login_data: dict):
             {"id": user["id"]},
             {"$set": {"last_login": datetime.utcnow()}}
         )
+        principal_cache.invalidate(user["id"])
         
         # Create access token
         access_token = create_access_token(data={"sub": user["id"]})
@@ -703,10 +839,12 @@ async def get_user_profile(current_user: dict = Depends(get_current_user)):
         
         # Update user's wallet balance with real balance
         if real_balance > 0:
-            await db.users.update_one(
-                {"id": current_user["id"]},
-                {"$set": {"wallet_balance": real_balance, "last_balance_update": datetime.utcnow()}}
-            )
+            if await transfer_engine.adjust_balance(current_user["id"], to_cents(real_balance), "moov_balance_sync"):
+                await db.users.update_one(
+                    {"id": current_user["id"]},
+                    {"$set": {"last_balance_update": datetime.utcnow()}}
+                )
+                principal_cache.invalidate(current_user["id"])
         
         return {
             "user_id": current_user["id"],
@@ -795,9 +933,38 @@ async def get_linked_accounts(current_user: dict = Depends(get_current_user)):
         logger.error(f"Error fetching linked accounts: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch linked accounts")
 
+async def screen_transfer(sender: dict, transaction: dict) -> Dict[str, Any]:
+    """Fraud analysis and AML screening for a transfer, from one risk feature load"""
+    features = await risk_features.load(sender["id"], transaction["amount"])
+    fraud, aml = await asyncio.gather(
+        fraud_engine.analyze_transaction(sender["id"], transaction, features=features),
+        compliance_manager.aml_screening(sender, transaction, features=features)
+    )
+    if fraud.get("recommendation") == "block_transaction" or aml.get("status") == "blocked":
+        await log_compliance_action({
+            "user_id": sender["id"],
+            "action": "transfer_blocked",
+            "amount": transaction["amount"],
+            "fraud_score": fraud.get("fraud_score"),
+            "aml_flags": aml.get("flags", []),
+            "timestamp": datetime.utcnow()
+        })
+        raise HTTPException(status_code=403, detail="Transfer blocked by risk screening")
+    return {"fraud": fraud, "aml": aml}
+
 @api_router.post("/transfer/send")
-async def send_money(transfer_data: MoneyTransfer, current_user: dict = Depends(get_current_user)):
+async def send_money(
+    transfer_data: MoneyTransfer,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
     """Send money to another user"""
+    return await idempotency_store.run(
+        idempotency_key, current_user["id"], "transfer_send", transfer_data,
+        lambda: _send_money(transfer_data, current_user)
+    )
+
+async def _send_money(transfer_data: MoneyTransfer, current_user: dict):
     try:
         # Find recipient user
         recipient = None
@@ -815,20 +982,28 @@ async def send_money(transfer_data: MoneyTransfer, current_user: dict = Depends(
                 "full_name": "Demo Recipient",
                 "phone": transfer_data.recipient_phone or "787-000-0000",
                 "wallet_balance": 0.0,
+                "wallet_balance_cents": 0,
                 "account_status": "active",
                 "kyc_status": "approved",
                 "created_at": datetime.utcnow()
             }
             await db.users.insert_one(demo_recipient)
+            await metric_rollups.record_signup(demo_recipient)
             recipient = demo_recipient
+        else:
+            await transfer_engine.open_account(recipient)
+        
+        if recipient["id"] == current_user["id"]:
+            raise HTTPException(status_code=400, detail="Cannot send money to yourself")
+        if await screen_recipient(current_user, recipient):
+            raise HTTPException(status_code=403, detail="Recipient failed sanctions screening")
         
-        # Check if user has sufficient balance
-        current_balance = float(current_user.get("wallet_balance", 0))
-        fee = float(transfer_data.amount) * 0.015 if transfer_data.transfer_type == "instant" else 0.0
-        total_cost = float(transfer_data.amount) + fee
+        # Legacy accounts move their float balance into the ledger on first use
+        await transfer_engine.open_account(current_user)
         
-        if total_cost > current_balance:
-            raise HTTPException(status_code=400, detail="Insufficient funds")
+        amount_cents = to_cents(transfer_data.amount)
+        fee_cents = percent_of_cents(amount_cents, "0.015") if transfer_data.transfer_type == "instant" else 0
+        fee = from_cents(fee_cents)
         
         # Create transaction record
         transaction_id = str(uuid.uuid4())
@@ -838,6 +1013,8 @@ async def send_money(transfer_data: MoneyTransfer, current_user: dict = Depends(
             "to_user_id": recipient["id"],
             "amount": float(transfer_data.amount),
             "fee": fee,
+            "amount_cents": amount_cents,
+            "fee_cents": fee_cents,
             "description": transfer_data.description or "DalePay Transfer",
             "transfer_type": transfer_data.transfer_type,
             "status": "completed",  # Demo: Auto-complete
@@ -845,18 +1022,12 @@ async def send_money(transfer_data: MoneyTransfer, current_user: dict = Depends(
             "completed_at": datetime.utcnow()
         }
         
-        await db.transactions.insert_one(transaction)
+        await screen_transfer(current_user, transaction)
+        limits = await spend_limits(current_user, amount_cents)
         
-        # Update balances
-        await db.users.update_one(
-            {"id": current_user["id"]},
-            {"$inc": {"wallet_balance": -total_cost}}
-        )
-        
-        await db.users.update_one(
-            {"id": recipient["id"]},
-            {"$inc": {"wallet_balance": float(transfer_data.amount)}}
-        )
+        # Debit (only if funds suffice and limits allow), credit and record atomically
+        await transfer_engine.transfer(transaction, limits)
+        principal_cache.invalidate(current_user["id"], recipient["id"])
         
         # Log compliance action
         await log_compliance_action({
@@ -881,46 +1052,381 @@ async def send_money(transfer_data: MoneyTransfer, current_user: dict = Depends(
         logger.error(f"Transfer error: {e}")
         raise HTTPException(status_code=500, detail="Transfer failed")
 
+@api_router.post("/transfer/batch")
+async def send_money_batch(
+    batch: BatchTransfer,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Pay many recipients at once, streaming one NDJSON result line per item.
+    
+    With an Idempotency-Key the whole batch settles before the response
+    starts, so a retry replays exactly the same result lines.
+    """
+    if not idempotency_key:
+        results = await _send_money_batch(batch, current_user)
+        return StreamingResponse(ndjson_lines(results), media_type="application/x-ndjson")
+    
+    async def settle_all():
+        results = await _send_money_batch(batch, current_user)
+        async with contextlib.aclosing(results):
+            return [result async for result in results]
+    
+    lines = await idempotency_store.run(
+        idempotency_key, current_user["id"], "transfer_batch", batch, settle_all
+    )
+    return StreamingResponse((json.dumps(line) + "\n" for line in lines), media_type="application/x-ndjson")
+
+async def ndjson_lines(results):
+    """Encode result dicts as NDJSON, closing the source if the client leaves"""
+    async with contextlib.aclosing(results):
+        async for result in results:
+            yield json.dumps(result) + "\n"
+
+async def amount_sent_since(user_id: str, since: datetime) -> float:
+    """Total the sender has moved since a point in time, read from the transactions themselves.
+
+    Limits are enforced from here rather than the velocity counters: counters
+    are recorded after commit, best effort, and never for wallet transfers,
+    which are counted here while still processing.
+    """
+    sent = await db.transactions.aggregate([
+        {"$match": {
+            "from_user_id": user_id,
+            "created_at": {"$gte": since},
+            "status": {"$in": ["completed", "pending", "processing"]}
+        }},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+    ]).to_list(1)
+    return sent[0]["total"] if sent else 0
+
+async def spend_limits(user: dict, amount_cents: int) -> Dict[str, Any]:
+    """Daily and monthly limits for a debit of amount_cents, checked atomically by the transfer engine.
+
+    The engine keeps running totals on the user document. The first debit of
+    a day or month seeds its counter from the sender's transactions, so
+    transfers made before the counters existed still count.
+    """
+    now = datetime.utcnow()
+    window = spend_window(now)
+    spend = user.get("spend") or {}
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    limits = {
+        **window,
+        "amount_cents": amount_cents,
+        "daily_cents": to_cents(user.get("daily_limit", 2500)),
+        "monthly_cents": to_cents(user.get("monthly_limit", 10000)),
+        "day_seed_cents": 0,
+        "month_seed_cents": 0
+    }
+    if spend.get("day") != window["day"]:
+        limits["day_seed_cents"] = to_cents(await amount_sent_since(user["id"], today))
+    if spend.get("month") != window["month"]:
+        limits["month_seed_cents"] = to_cents(await amount_sent_since(user["id"], today.replace(day=1)))
+    return limits
+
+async def screen_recipient(sender: dict, recipient: dict, **context) -> bool:
+    """Screen a payee against the sanctions lists; True when the transfer must be refused.
+
+    Exact and near-exact matches block. Weaker fuzzy matches open a review
+    alert and the transfer goes ahead.
+    """
+    matches = sanctions_screener.screen(recipient.get("full_name", ""), list_type="sanctions")
+    if not matches:
+        return False
+    best = matches[0]
+    blocked = bool(sanctions_screener.blocking(matches))
+    await log_compliance_action({
+        "user_id": sender["id"],
+        "action": "sanctions_block" if blocked else "sanctions_review",
+        "recipient_id": recipient["id"],
+        "entry_id": best["entry_id"],
+        "confidence": best["score"],
+        "timestamp": datetime.utcnow(),
+        **context
+    })
+    if not blocked:
+        await alert_store.raise_alert({
+            "type": "sanctions_review",
+            "user_id": recipient["id"],
+            "description": f"Possible sanctions match: {best['name']} ({best['score']:.2f})",
+            "severity": "medium",
+            "data": {"sender_id": sender["id"], "matches": matches, **context}
+        })
+    return blocked
+
+async def _send_money_batch(batch: BatchTransfer, current_user: dict):
+    """Check and reserve the batch, returning an async generator of per-item results"""
+    started = time.perf_counter()
+    batch_id = str(uuid.uuid4())
+    hold_id = f"hold:{batch_id}"
+    
+    # Resolve every recipient with a single query
+    emails = {item.recipient_email for item in batch.items if item.recipient_email}
+    phones = {item.recipient_phone for item in batch.items if not item.recipient_email and item.recipient_phone}
+    by_email, by_phone = {}, {}
+    if emails or phones:
+        async for user in db.users.find(
+            {"$or": [{"email": {"$in": list(emails)}}, {"phone": {"$in": list(phones)}}]},
+            {"_id": 0, "id": 1, "email": 1, "phone": 1, "full_name": 1, "wallet_balance": 1, "wallet_balance_cents": 1}
+        ):
+            by_email.setdefault(user.get("email"), user)
+            by_phone.setdefault(user.get("phone"), user)
+    
+    await transfer_engine.open_account(current_user)
+    
+    rejected = []
+    transactions = []
+    item_indexes = []
+    opened = set()
+    screened = {}
+    for index, item in enumerate(batch.items):
+        recipient = by_email.get(item.recipient_email) if item.recipient_email else by_phone.get(item.recipient_phone)
+        if recipient is None:
+            rejected.append({"index": index, "status": "failed", "error": "Recipient not found"})
+            continue
+        if recipient["id"] == current_user["id"]:
+            rejected.append({"index": index, "status": "failed", "error": "Cannot send money to yourself"})
+            continue
+        
+        # Each recipient is screened once, however many items pay them
+        if recipient["id"] not in screened:
+            screened[recipient["id"]] = await screen_recipient(current_user, recipient, batch_id=batch_id)
+        if screened[recipient["id"]]:
+            rejected.append({"index": index, "status": "failed", "error": "Recipient failed sanctions screening"})
+            continue
+        
+        if "wallet_balance_cents" not in recipient and recipient["id"] not in opened:
+            await transfer_engine.open_account(recipient)
+            opened.add(recipient["id"])
+        
+        amount_cents = to_cents(item.amount)
+        fee_cents = percent_of_cents(amount_cents, "0.015") if item.transfer_type == "instant" else 0
+        transactions.append({
+            "id": str(uuid.uuid4()),
+            "batch_id": batch_id,
+            "from_user_id": current_user["id"],
+            "to_user_id": recipient["id"],
+            "amount": float(item.amount),
+            "fee": from_cents(fee_cents),
+            "amount_cents": amount_cents,
+            "fee_cents": fee_cents,
+            "description": item.description or batch.description or "DalePay Transfer",
+            "transfer_type": item.transfer_type,
+            "status": "completed",
+            "created_at": datetime.utcnow(),
+            "completed_at": datetime.utcnow()
+        })
+        item_indexes.append(index)
+    
+    # Reserve the whole batch up front so no chunk can overdraw the sender;
+    # limits are checked and counted against the batch total in the same update
+    reserved = sum(t["amount_cents"] + t["fee_cents"] for t in transactions)
+    held = sum(t["amount_cents"] for t in transactions)
+    limits = await spend_limits(current_user, held)
+    if reserved:
+        await transfer_engine.reserve(current_user["id"], reserved, limits, hold_id)
+    principal_cache.invalidate(current_user["id"])
+    
+    async def settle_chunk(chunk: list, chunk_cost: int, chunk_amount: int) -> bool:
+        try:
+            await transfer_engine.settle_batch(chunk, hold_id)
+            return True
+        except ReconciliationNeeded as e:
+            # Credits from this chunk are still applied, so its funds stay spent
+            logger.critical(f"Batch {batch_id} chunk needs manual reconciliation: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Batch {batch_id} chunk failed: {e}")
+            await transfer_engine.release(current_user["id"], chunk_cost, limits, chunk_amount, hold_id)
+            return False
+    
+    async def results():
+        nonlocal reserved, held
+        succeeded = 0
+        try:
+            for result in rejected:
+                yield result
+            
+            for start in range(0, len(transactions), BATCH_TRANSFER_CHUNK_SIZE):
+                chunk = transactions[start:start + BATCH_TRANSFER_CHUNK_SIZE]
+                indexes = item_indexes[start:start + BATCH_TRANSFER_CHUNK_SIZE]
+                chunk_cost = sum(t["amount_cents"] + t["fee_cents"] for t in chunk)
+                chunk_amount = sum(t["amount_cents"] for t in chunk)
+                
+                # The shielded settle owns this chunk's funds even if the client disconnects
+                reserved -= chunk_cost
+                held -= chunk_amount
+                if not await asyncio.shield(settle_chunk(chunk, chunk_cost, chunk_amount)):
+                    for index in indexes:
+                        yield {"index": index, "status": "failed", "error": "Transfer failed"}
+                    continue
+                
+                succeeded += len(chunk)
+                principal_cache.invalidate(*{t["to_user_id"] for t in chunk})
+                
+                # Buffered like every other compliance record; the audit log batches the inserts
+                for t in chunk:
+                    audit_log.write({
+                        "id": str(uuid.uuid4()),
+                        "user_id": current_user["id"],
+                        "action": "money_transfer",
+                        "amount": t["amount"],
+                        "recipient_id": t["to_user_id"],
+                        "transaction_id": t["id"],
+                        "batch_id": batch_id,
+                        "timestamp": datetime.utcnow()
+                    })
+                
+                for index, t in zip(indexes, chunk):
+                    yield {
+                        "index": index,
+                        "status": "completed",
+                        "transaction_id": t["id"],
+                        "amount": t["amount"],
+                        "fee": t["fee"]
+                    }
+            
+            elapsed = time.perf_counter() - started
+            logger.info(f"Batch {batch_id}: {succeeded} of {len(batch.items)} transfers completed")
+            yield {"summary": {
+                "batch_id": batch_id,
+                "total_items": len(batch.items),
+                "succeeded": succeeded,
+                "failed": len(batch.items) - succeeded,
+                "elapsed_seconds": round(elapsed, 3),
+                "items_per_second": round(len(batch.items) / elapsed, 1) if elapsed > 0 else None
+            }}
+        finally:
+            # Client went away mid-stream: return funds for chunks never settled
+            if reserved:
+                await transfer_engine.release(current_user["id"], reserved, limits, held, hold_id)
+    
+    return results()
+
+def encode_transaction_cursor(transaction: dict) -> str:
+    """Opaque cursor pointing just past a transaction in (created_at, _id) order"""
+    position = json.dumps({"created_at": transaction["created_at"].isoformat(), "_id": str(transaction["_id"])})
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+def decode_transaction_cursor(cursor: str) -> dict:
+    """Keyset filter selecting transactions older than the cursor position"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = datetime.fromisoformat(position["created_at"])
+        object_id = ObjectId(position["_id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": object_id}}
+        ]
+    }
+
+async def fetch_transaction_side(field: str, user_id: str, keyset: Optional[dict], fetch: int) -> List[dict]:
+    """Newest transactions where user_id is on one side, served by that side's index.
+
+    Ties on created_at break on _id: wallet transfers recorded by moov_wallet
+    carry transaction_id rather than id.
+    """
+    query = {field: user_id}
+    if keyset:
+        query.update(keyset)
+    return await db.transactions.find(query).sort(
+        [("created_at", -1), ("_id", -1)]
+    ).limit(fetch).to_list(fetch)
+
 @api_router.get("/transactions")
 async def get_transactions(
     page: int = 1,
     limit: int = 20,
     type: Optional[str] = None,
+    cursor: Optional[str] = None,
+    include_total: bool = False,
     current_user: dict = Depends(get_current_user)
 ):
-    """Get user's transaction history"""
+    """Get user's transaction history.
+
+    Pass next_cursor back as cursor to fetch the following page; has_more
+    comes from fetching one row past the page. Counting the whole history
+    is linear in its size, so total/pages are only returned when asked for
+    with include_total=true.
+    """
     try:
-        query = {
-            "$or": [
-                {"from_user_id": current_user["id"]},
-                {"to_user_id": current_user["id"]}
-            ]
-        }
-        
-        skip = (page - 1) * limit
-        
-        transactions = await db.transactions.find(query).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-        total = await db.transactions.count_documents(query)
-        
+        user_id = current_user["id"]
+        limit = max(1, min(limit, MAX_TRANSACTIONS_PAGE_SIZE))
+        keyset = decode_transaction_cursor(cursor) if cursor else None
+        # Legacy page numbers only apply when no cursor is given; each one
+        # re-reads every earlier row, so they stop at a fixed depth
+        skip = 0 if cursor else max(0, page - 1) * limit
+        if skip > MAX_TRANSACTIONS_PAGE_OFFSET:
+            raise HTTPException(status_code=400, detail="Page too deep - use next_cursor to page further")
+        fetch = skip + limit + 1
+
+        sides = []
+        if type in (None, "", "all", "sent"):
+            sides.append("from_user_id")
+        if type in (None, "", "all", "received"):
+            sides.append("to_user_id")
+        if not sides:
+            raise HTTPException(status_code=400, detail="type must be all, sent or received")
+
+        # One indexed range scan per side, merged newest first
+        results = await asyncio.gather(*[
+            fetch_transaction_side(field, user_id, keyset, fetch) for field in sides
+        ])
+        merged = heapq.merge(*results, key=lambda t: (t["created_at"], t["_id"]), reverse=True)
+
+        transactions = []
+        seen = set()
+        for transaction in merged:
+            # A transfer to oneself appears on both sides
+            if transaction["_id"] in seen:
+                continue
+            seen.add(transaction["_id"])
+            transactions.append(transaction)
+            if len(transactions) == fetch:
+                break
+
+        transactions = transactions[skip:]
+        has_more = len(transactions) > limit
+        transactions = transactions[:limit]
+
         # Add type field based on user perspective
         for transaction in transactions:
-            if transaction["from_user_id"] == current_user["id"]:
+            transaction.setdefault("id", transaction.get("transaction_id"))
+            if type in ("sent", "received"):
+                transaction["type"] = type
+            elif transaction["from_user_id"] == user_id:
                 transaction["type"] = "sent"
             else:
                 transaction["type"] = "received"
-        
-        # Filter by type if specified
-        if type and type != "all":
-            transactions = [t for t in transactions if t["type"] == type]
-        
-        return {
+
+        response = {
             "transactions": serialize_mongo_doc(transactions),
-            "total": total,
-            "page": page,
             "limit": limit,
-            "pages": (total + limit - 1) // limit
+            "has_more": has_more,
+            "next_cursor": encode_transaction_cursor(transactions[-1]) if has_more else None
         }
-        
+
+        if include_total:
+            counts = await asyncio.gather(*[
+                db.transactions.count_documents({field: user_id}) for field in sides
+            ])
+            total = sum(counts)
+            if len(sides) == 2:
+                total -= await db.transactions.count_documents({"from_user_id": user_id, "to_user_id": user_id})
+            response.update({
+                "total": total,
+                "page": page,
+                "pages": (total + limit - 1) // limit
+            })
+
+        return response
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching transactions: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch transactions")
@@ -940,6 +1446,21 @@ async def get_wallet_service():
         dalepay_wallet_service = get_dalepay_wallet(db)
     return dalepay_wallet_service
 
+async def sync_wallet_transfers():
+    """Record wallet transfers that Moov has settled since the last run"""
+    if not MOOV_WALLET_AVAILABLE:
+        return
+    wallet_service = await get_wallet_service()
+    result = await wallet_service.sync_transfer_statuses()
+    if result["settled"]:
+        logger.info(f"Wallet transfer sync: {result['settled']} of {result['checked']} processing transfers settled")
+
+scheduler.add_job(
+    "wallet_transfer_sync",
+    sync_wallet_transfers,
+    int(os.getenv('MOOV_TRANSFER_SYNC_INTERVAL_SECONDS', '300'))
+)
+
 # WORKING Real Money Wallet API Routes
 @api_router.post("/wallet/create")
 async def create_user_wallet(current_user: dict = Depends(get_current_user)):
@@ -961,6 +1482,7 @@ async def create_user_wallet(current_user: dict = Depends(get_current_user)):
             {"id": current_user["id"]},
             {"$set": {"wallet_id": wallet["wallet_id"], "moov_account_id": wallet["moov_account_id"]}}
         )
+        principal_cache.invalidate(current_user["id"])
         
         return wallet
     except HTTPException:
@@ -1040,9 +1562,16 @@ async def delete_bank_account(
 @api_router.post("/wallet/send-money")
 async def send_money_real(
     payment_data: dict,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """Send REAL money via DalePay wallet"""
+    return await idempotency_store.run(
+        idempotency_key, current_user["id"], "wallet_send_money", payment_data,
+        lambda: _send_money_real(payment_data, current_user)
+    )
+
+async def _send_money_real(payment_data: dict, current_user: dict):
     try:
         wallet_service = await get_wallet_service()
         
@@ -1062,7 +1591,11 @@ async def send_money_real(
             current_user["id"]
         )
         
+        limits = await spend_limits(current_user, to_cents(payment_request.amount))
         result = await wallet_service.send_money(payment_request, current_user["id"])
+        # Wallet transfers settle through Moov but still count towards the engine's limits
+        await transfer_engine.count_spend(current_user["id"], limits)
+        principal_cache.invalidate(current_user["id"])
         return result
     except HTTPException:
         raise
@@ -1073,9 +1606,16 @@ async def send_money_real(
 @api_router.post("/pos/payment")
 async def process_merchant_payment(
     payment_data: dict,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """Process POS payment - MERCHANT REVENUE SYSTEM"""
+    return await idempotency_store.run(
+        idempotency_key, current_user["id"], "pos_payment", payment_data,
+        lambda: _process_merchant_payment(payment_data, current_user)
+    )
+
+async def _process_merchant_payment(payment_data: dict, current_user: dict):
     try:
         wallet_service = await get_wallet_service()
         
@@ -1104,6 +1644,36 @@ app.include_router(api_router)
 from admin_api import admin_router
 app.include_router(admin_router)
 
+@app.middleware("http")
+async def track_request_metrics(request, call_next):
+    """Latency and status counts per route template, plus requests in flight"""
+    started = time.perf_counter()
+    status_code = 500
+    metrics.http_in_flight.inc()
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        metrics.http_in_flight.dec()
+        # Templates like /api/transfer/{id} keep label cardinality bounded
+        route = request.scope.get("route")
+        template = route.path if route is not None else "unmatched"
+        metrics.http_request_duration.observe(time.perf_counter() - started, request.method, template)
+        metrics.http_requests.inc(request.method, template, str(status_code))
+
+@app.middleware("http")
+async def assign_request_id(request, call_next):
+    """Tag every log record written while handling the request with its id"""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 # CORS Configuration for production
 app.add_middleware(
     CORSMiddleware,
@@ -1118,6 +1688,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Prometheus scrape endpoint, served from in-process counters
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(authorization: Optional[str] = Header(None)):
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
@@ -1129,9 +1706,68 @@ async def health_check():
         "version": "1.0.0"
     }
 
+@app.on_event("startup")
+async def startup_audit_log():
+    try:
+        await audit_log.start()
+    except Exception as e:
+        logger.error(f"Error starting audit log writer: {e}")
+
+@app.on_event("startup")
+async def startup_db_indexes():
+    index_manager.start()
+
+@app.on_event("startup")
+async def startup_sanctions_lists():
+    try:
+        await sanctions_screener.reload()
+        # Screen users against whatever changed since the last completed rescreen
+        rescreening_job.start()
+    except Exception as e:
+        logger.error(f"Error loading screening lists: {e}")
+
+@app.on_event("startup")
+async def startup_velocity_counters():
+    try:
+        # Start the warm-up clock; earlier windows fall back to scanning transactions
+        await velocity_counters.started_at()
+    except Exception as e:
+        logger.error(f"Error starting velocity counters: {e}")
+
+@app.on_event("startup")
+async def startup_metric_rollups():
+    try:
+        # First run on an existing database backfills from users and transactions
+        await metric_rollups.ensure_built()
+    except Exception as e:
+        logger.error(f"Error building metric rollups: {e}")
+
+@app.on_event("startup")
+async def startup_fraud_monitor():
+    fraud_monitor.start()
+
+@app.on_event("startup")
+async def startup_loop_lag_monitor():
+    loop_lag_monitor.start()
+
+@app.on_event("startup")
+async def startup_query_monitor():
+    query_monitor.start(client)
+
+@app.on_event("startup")
+async def startup_http_clients():
+    await moov_api.startup()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await scheduler.shutdown()
+    await fraud_monitor.shutdown()
+    await audit_log.shutdown()
     client.close()
+    await moov_api.shutdown()
+    password_hasher.shutdown()
+    loop_lag_monitor.shutdown()
+    log_pipeline.shutdown()
 
 # Security Middleware for transaction validation
 class SecurityMiddleware:
@@ -1142,19 +1778,7 @@ class SecurityMiddleware:
         
         # Check daily transaction total
         today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        daily_total_cursor = db.transactions.aggregate([
-            {
-                "$match": {
-                    "from_user_id": user_id,
-                    "created_at": {"$gte": today},
-                    "status": {"$in": ["completed", "pending"]}
-                }
-            },
-            {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-        ])
-        
-        daily_results = await daily_total_cursor.to_list(1)
-        current_total = daily_results[0]['total'] if daily_results else 0
+        current_total = await amount_sent_since(user_id, today)
         
         if current_total + amount > daily_limit:
             raise HTTPException(
@@ -0,0 +1,536 @@
+"""
+DalePay Transfer Engine
+Atomic wallet-to-wallet transfers with conditional balance debits
+"""
+
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
+
+from ledger import (
+    BALANCE_ADJUSTMENT_ACCOUNT, balance_update, ledger_entry, transfer_entries, opening_entries,
+    hold_entries, release_entries
+)
+from perf_stats import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+# Error code returned by a standalone mongod when a session starts a transaction
+TRANSACTIONS_NOT_SUPPORTED = 20
+
+# Accounts that may not move money, checked on the debit itself rather than through any cached user
+BLOCKED_ACCOUNT_STATUSES = ["frozen", "suspended", "closed"]
+
+def spend_window(now: datetime) -> Dict[str, str]:
+    """The day and month a debit counts against for transfer limits"""
+    return {"day": now.strftime("%Y-%m-%d"), "month": now.strftime("%Y-%m")}
+
+def _spent(limits: Dict[str, Any], period: str) -> Dict[str, Any]:
+    """Amount already counted in the current period, or the seed when the counter is from an earlier one"""
+    return {"$cond": [
+        {"$eq": [f"$spend.{period}", limits[period]]},
+        f"$spend.{period}_cents",
+        limits[f"{period}_seed_cents"]
+    ]}
+
+def spend_update(limits: Dict[str, Any]) -> Dict[str, Any]:
+    """Update stage adding a transfer amount to the sender's daily and monthly spend counters"""
+    return {"$set": {"spend": {
+        "day": limits["day"],
+        "day_cents": {"$add": [_spent(limits, "day"), limits["amount_cents"]]},
+        "month": limits["month"],
+        "month_cents": {"$add": [_spent(limits, "month"), limits["amount_cents"]]}
+    }}}
+
+def within_limits(limits: Dict[str, Any]) -> Dict[str, Any]:
+    """Filter matching a sender whose counters leave room for the transfer amount"""
+    return {"$expr": {"$and": [
+        {"$lte": [{"$add": [_spent(limits, "day"), limits["amount_cents"]]}, limits["daily_cents"]]},
+        {"$lte": [{"$add": [_spent(limits, "month"), limits["amount_cents"]]}, limits["monthly_cents"]]}
+    ]}}
+
+class CreditsFailed(Exception):
+    """A batch credit bulk_write failed for some recipients; the others were credited"""
+
+    def __init__(self, error: BulkWriteError):
+        super().__init__(str(error))
+        self.error = error
+
+class ReconciliationNeeded(Exception):
+    """Some batch credits landed and could not be taken back; do not release the reserve"""
+
+class TransferEngine:
+    """Moves wallet balances between users without overdrawing the sender.
+
+    The debit is a conditional find_one_and_update (balance >= cost), so two
+    concurrent sends can never spend the same funds. On a replica set the
+    debit, credit, transaction record and ledger entries commit together in
+    one multi-document transaction. On a standalone mongod the other writes
+    follow the debit and the debit is refunded if any of them fails.
+
+    When limits are given, the same conditional update checks and adds to
+    the sender's daily and monthly spend counters, so concurrent sends and
+    batches cannot both pass a limit check and together exceed it.
+
+    Every other balance change (account opening, balance sync, batch holds
+    and their release) is written together with its ledger entries the same
+    way, so wallets never drift from the ledger. A batch reserve moves its
+    total into the holds account; each settled chunk releases its cost back
+    before the per-transfer entries, and unpaid funds are released at the end.
+    """
+
+    def __init__(self, client, db, ledger, velocity=None, rollups=None, max_attempts: int = 3):
+        self.client = client
+        self.db = db
+        self.ledger = ledger
+        self.velocity = velocity
+        self.rollups = rollups
+        self.max_attempts = max_attempts
+        self.transactions_supported = None
+        self.latency = LatencyStats()
+        self.batch_latency = LatencyStats()
+        self.counters = {
+            "committed": 0,
+            "insufficient_funds": 0,
+            "blocked_accounts": 0,
+            "limits_exceeded": 0,
+            "write_conflicts": 0,
+            "commit_retries": 0,
+            "fallback_transfers": 0,
+            "compensations": 0
+        }
+
+    async def _atomically(self, write, post, undo):
+        """Run write(session) then post(session, written) in one transaction.
+
+        On a standalone mongod write runs on its own and undo(written)
+        reverts it if post fails.
+        """
+        if self.transactions_supported is not False:
+            async def work(session):
+                written = await write(session)
+                await post(session, written)
+                return written
+            try:
+                result = await self._run_in_transaction(work)
+                self.transactions_supported = True
+                return result
+            except OperationFailure as e:
+                if e.code != TRANSACTIONS_NOT_SUPPORTED:
+                    raise
+                self.transactions_supported = False
+                logger.warning("MongoDB transactions not supported, using compensating transfers")
+
+        written = await write(None)
+        try:
+            await post(None, written)
+        except BaseException:
+            self.counters["compensations"] += 1
+            await undo(written)
+            raise
+        return written
+
+    async def create_account(self, user: Dict[str, Any]):
+        """Insert a new user together with the entries funding its opening balance"""
+        async def insert(session):
+            await self.db.users.insert_one(user, session=session)
+
+        async def post(session, _):
+            if user["wallet_balance_cents"]:
+                await self.ledger.post(
+                    opening_entries(user["id"], user["wallet_balance_cents"], user["created_at"]), session=session
+                )
+
+        async def undo(_):
+            await self.db.users.delete_one({"id": user["id"]})
+
+        await self._atomically(insert, post, undo)
+
+    async def open_account(self, user: Dict[str, Any]) -> int:
+        """Move a legacy float wallet_balance into integer cents and the ledger"""
+        if "wallet_balance_cents" in user:
+            return user["wallet_balance_cents"]
+
+        async def migrate(session):
+            return await self.db.users.find_one_and_update(
+                {"id": user["id"], "wallet_balance_cents": {"$exists": False}},
+                [{"$set": {"wallet_balance_cents": {
+                    "$toLong": {"$round": [{"$multiply": [{"$ifNull": ["$wallet_balance", 0]}, 100]}, 0]}
+                }}}],
+                projection={"_id": 0, "wallet_balance_cents": 1},
+                return_document=ReturnDocument.AFTER,
+                session=session
+            )
+
+        async def post(session, migrated):
+            if migrated and migrated["wallet_balance_cents"]:
+                await self.ledger.post(
+                    opening_entries(user["id"], migrated["wallet_balance_cents"], datetime.utcnow()), session=session
+                )
+
+        async def undo(migrated):
+            if migrated is None:
+                return
+            result = await self.db.users.update_one(
+                {"id": user["id"], "wallet_balance_cents": migrated["wallet_balance_cents"]},
+                {"$unset": {"wallet_balance_cents": ""}}
+            )
+            if result.modified_count == 0:
+                logger.critical(f"Could not undo the ledger migration of user {user['id']}, balance needs reconciling")
+
+        migrated = await self._atomically(migrate, post, undo)
+        if migrated is None:
+            # Another request migrated the account first
+            current = await self.db.users.find_one({"id": user["id"]}, {"_id": 0, "wallet_balance_cents": 1})
+            return current.get("wallet_balance_cents", 0) if current else 0
+
+        opening = migrated["wallet_balance_cents"]
+        logger.info(f"Ledger account opened for user {user['id']} with {opening} cents")
+        return opening
+
+    async def adjust_balance(self, user_id: str, target_cents: int, reason: str) -> bool:
+        """Set a wallet to an externally reported balance, posting the difference"""
+        user = await self.db.users.find_one({"id": user_id}, {"_id": 0, "id": 1, "wallet_balance_cents": 1, "wallet_balance": 1})
+        if user is None:
+            return False
+        current = await self.open_account(user)
+        delta = target_cents - current
+        if delta == 0:
+            return False
+
+        async def update(session):
+            result = await self.db.users.update_one(
+                {"id": user_id, "wallet_balance_cents": current},
+                balance_update(delta),
+                session=session
+            )
+            # Balance moved concurrently; the next sync will retry
+            return result.modified_count > 0
+
+        async def post(session, updated):
+            if updated:
+                transaction_id = f"adjustment:{uuid.uuid4()}"
+                posted_at = datetime.utcnow()
+                await self.ledger.post([
+                    ledger_entry(transaction_id, user_id, delta, reason, posted_at),
+                    ledger_entry(transaction_id, BALANCE_ADJUSTMENT_ACCOUNT, -delta, reason, posted_at)
+                ], session=session)
+
+        async def undo(updated):
+            if updated:
+                await self._credit(user_id, -delta)
+
+        return await self._atomically(update, post, undo)
+
+    async def transfer(self, transaction: Dict[str, Any], limits: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Debit the sender, credit the recipient and record the transaction"""
+        total_cost = transaction["amount_cents"] + transaction["fee_cents"]
+        entries = transfer_entries(
+            transaction["id"],
+            transaction["from_user_id"],
+            transaction["to_user_id"],
+            transaction["amount_cents"],
+            transaction["fee_cents"],
+            transaction["created_at"]
+        )
+
+        with self.latency.time():
+            result = None
+            if self.transactions_supported is not False:
+                try:
+                    result = await self._transfer_in_transaction(transaction, entries, total_cost, limits)
+                    self.transactions_supported = True
+                except OperationFailure as e:
+                    if e.code != TRANSACTIONS_NOT_SUPPORTED:
+                        raise
+                    self.transactions_supported = False
+                    logger.warning("MongoDB transactions not supported, using compensating transfers")
+
+            if result is None:
+                result = await self._transfer_with_compensation(transaction, entries, total_cost, limits)
+
+        if self.velocity is not None:
+            await self.velocity.record([transaction])
+        if self.rollups is not None:
+            await self.rollups.record_transactions([transaction])
+        return result
+
+    async def _debit(self, user_id: str, total_cost: int, session=None,
+                     limits: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        query = {
+            "id": user_id,
+            "wallet_balance_cents": {"$gte": total_cost},
+            "account_status": {"$nin": BLOCKED_ACCOUNT_STATUSES}
+        }
+        update = balance_update(-total_cost)
+        if limits is not None:
+            query.update(within_limits(limits))
+            update = [spend_update(limits)] + update
+        sender = await self.db.users.find_one_and_update(
+            query,
+            update,
+            projection={"_id": 0, "id": 1, "wallet_balance_cents": 1},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if sender is None:
+            current = await self.db.users.find_one(
+                {"id": user_id}, {"_id": 0, "account_status": 1, "wallet_balance_cents": 1, "spend": 1},
+                session=session
+            )
+            if current is not None and current.get("account_status") in BLOCKED_ACCOUNT_STATUSES:
+                self.counters["blocked_accounts"] += 1
+                raise HTTPException(status_code=403, detail="Account frozen - Contact support")
+            if current is not None and limits is not None and current.get("wallet_balance_cents", 0) >= total_cost:
+                self.counters["limits_exceeded"] += 1
+                spend = current.get("spend") or {}
+                spent_today = spend["day_cents"] if spend.get("day") == limits["day"] else limits["day_seed_cents"]
+                if spent_today + limits["amount_cents"] > limits["daily_cents"]:
+                    raise HTTPException(status_code=400, detail="Daily transaction limit exceeded")
+                raise HTTPException(status_code=400, detail="Monthly transaction limit exceeded")
+            self.counters["insufficient_funds"] += 1
+            raise HTTPException(status_code=400, detail="Insufficient funds")
+        return sender
+
+    async def _unspend(self, user_id: str, limits: Dict[str, Any], amount_cents: int):
+        """Take an amount that never moved back off the spend counters it was added to"""
+        def refunded(period: str) -> Dict[str, Any]:
+            return {"$cond": [
+                {"$eq": [f"$spend.{period}", limits[period]]},
+                {"$subtract": [f"$spend.{period}_cents", amount_cents]},
+                f"$spend.{period}_cents"
+            ]}
+        await self.db.users.update_one(
+            {"id": user_id, "spend": {"$exists": True}},
+            [{"$set": {"spend": {
+                "day": "$spend.day",
+                "day_cents": refunded("day"),
+                "month": "$spend.month",
+                "month_cents": refunded("month")
+            }}}]
+        )
+
+    async def count_spend(self, user_id: str, limits: Dict[str, Any]):
+        """Add a transfer that moved outside the engine to the sender's spend counters"""
+        await self.db.users.update_one({"id": user_id}, [spend_update(limits)])
+
+    async def _credit(self, user_id: str, amount: int, session=None):
+        await self.db.users.update_one(
+            {"id": user_id},
+            balance_update(amount),
+            session=session
+        )
+
+    async def _transfer_in_transaction(self, transaction: Dict[str, Any], entries: List[Dict[str, Any]],
+                                       total_cost: int, limits: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        async def work(session):
+            sender = await self._debit(transaction["from_user_id"], total_cost, session, limits)
+            await self._credit(transaction["to_user_id"], transaction["amount_cents"], session)
+            await self.db.transactions.insert_one(transaction, session=session)
+            await self.ledger.post(entries, session=session)
+            return sender
+
+        result = await self._run_in_transaction(work)
+        self.counters["committed"] += 1
+        return result
+
+    async def _run_in_transaction(self, work):
+        """Run work(session) in a transaction, retrying transient write conflicts"""
+        for attempt in range(1, self.max_attempts + 1):
+            async with await self.client.start_session() as session:
+                session.start_transaction()
+                try:
+                    result = await work(session)
+                except BaseException as e:
+                    await session.abort_transaction()
+                    if (isinstance(e, PyMongoError) and e.has_error_label("TransientTransactionError")
+                            and attempt < self.max_attempts):
+                        self.counters["write_conflicts"] += 1
+                        continue
+                    raise
+
+                await self._commit(session)
+                return result
+
+    async def _commit(self, session):
+        """Commit, retrying a commit whose outcome is unknown; committing twice is safe"""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await session.commit_transaction()
+                return
+            except PyMongoError as e:
+                if not e.has_error_label("UnknownTransactionCommitResult") or attempt == self.max_attempts:
+                    raise
+                self.counters["commit_retries"] += 1
+
+    async def _transfer_with_compensation(self, transaction: Dict[str, Any], entries: List[Dict[str, Any]],
+                                          total_cost: int, limits: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        sender = await self._debit(transaction["from_user_id"], total_cost, limits=limits)
+        self.counters["fallback_transfers"] += 1
+
+        credit, record, posting = await asyncio.gather(
+            self._credit(transaction["to_user_id"], transaction["amount_cents"]),
+            self.db.transactions.insert_one(transaction),
+            self.ledger.post(entries),
+            return_exceptions=True
+        )
+        failures = [result for result in (credit, record, posting) if isinstance(result, BaseException)]
+        if failures:
+            self.counters["compensations"] += 1
+            logger.error(f"Transfer {transaction['id']} failed after debit, refunding sender")
+            await self._credit(transaction["from_user_id"], total_cost)
+            if limits is not None:
+                await self._unspend(transaction["from_user_id"], limits, limits["amount_cents"])
+            if not isinstance(credit, BaseException):
+                await self._credit(transaction["to_user_id"], -transaction["amount_cents"])
+            if not isinstance(record, BaseException):
+                await self.db.transactions.delete_one({"id": transaction["id"]})
+            await self.db.ledger_entries.delete_many({"transaction_id": transaction["id"]})
+            raise failures[0]
+
+        self.counters["committed"] += 1
+        return sender
+
+    async def reserve(self, user_id: str, total_cost: int, limits: Optional[Dict[str, Any]] = None,
+                      hold_id: Optional[str] = None) -> Dict[str, Any]:
+        """Debit a batch total up front into the holds account; chunks that fail are released again"""
+        hold_id = hold_id or f"hold:{user_id}"
+        posted_at = datetime.utcnow()
+
+        async def debit(session):
+            return await self._debit(user_id, total_cost, session, limits)
+
+        async def post(session, _):
+            await self.ledger.post(hold_entries(hold_id, user_id, total_cost, posted_at), session=session)
+
+        async def undo(_):
+            await self._credit(user_id, total_cost)
+            if limits is not None:
+                await self._unspend(user_id, limits, limits["amount_cents"])
+
+        return await self._atomically(debit, post, undo)
+
+    async def release(self, user_id: str, amount: int, limits: Optional[Dict[str, Any]] = None,
+                      spent_cents: int = 0, hold_id: Optional[str] = None):
+        """Return reserved funds that were not paid out, and their share of the spend counters"""
+        hold_id = hold_id or f"hold:{user_id}"
+        posted_at = datetime.utcnow()
+
+        async def credit(session):
+            await self._credit(user_id, amount, session)
+
+        async def post(session, _):
+            await self.ledger.post(release_entries(hold_id, user_id, amount, posted_at), session=session)
+
+        async def undo(_):
+            await self._credit(user_id, -amount)
+
+        await self._atomically(credit, post, undo)
+        if limits is not None and spent_cents:
+            await self._unspend(user_id, limits, spent_cents)
+
+    async def settle_batch(self, transactions: List[Dict[str, Any]], hold_id: Optional[str] = None):
+        """Credit recipients and record a chunk of pre-funded transfers.
+
+        The sender was already debited by reserve(), so each chunk only needs
+        one bulk_write for the credits and one insert_many each for the
+        transaction records and ledger entries. The entries release the
+        chunk's cost from the hold before paying it out.
+        """
+        credits: Dict[str, int] = {}
+        costs: Dict[str, int] = {}
+        entries: List[Dict[str, Any]] = []
+        for transaction in transactions:
+            credits[transaction["to_user_id"]] = credits.get(transaction["to_user_id"], 0) + transaction["amount_cents"]
+            costs[transaction["from_user_id"]] = (costs.get(transaction["from_user_id"], 0)
+                                                  + transaction["amount_cents"] + transaction["fee_cents"])
+        posted_at = datetime.utcnow()
+        for sender_id, cost in costs.items():
+            entries.extend(release_entries(hold_id or f"hold:{sender_id}", sender_id, cost, posted_at))
+        for transaction in transactions:
+            entries.extend(transfer_entries(
+                transaction["id"],
+                transaction["from_user_id"],
+                transaction["to_user_id"],
+                transaction["amount_cents"],
+                transaction["fee_cents"],
+                transaction["created_at"]
+            ))
+        credits = list(credits.items())
+        updates = [UpdateOne({"id": user_id}, balance_update(amount)) for user_id, amount in credits]
+
+        with self.batch_latency.time():
+            settled = False
+            if self.transactions_supported is not False:
+                try:
+                    await self._run_in_transaction(
+                        lambda session: self._write_batch(transactions, entries, updates, session)
+                    )
+                    self.transactions_supported = True
+                    settled = True
+                except OperationFailure as e:
+                    if e.code != TRANSACTIONS_NOT_SUPPORTED:
+                        raise
+                    self.transactions_supported = False
+                    logger.warning("MongoDB transactions not supported, using compensating transfers")
+
+            if not settled:
+                try:
+                    await self._write_batch(transactions, entries, updates)
+                except Exception as e:
+                    self.counters["compensations"] += 1
+                    if isinstance(e, CreditsFailed):
+                        # Records stay in place if the credits cannot be taken back, so the ledger still explains them
+                        await self._reverse_credits(credits, e.error)
+                    transaction_ids = [transaction["id"] for transaction in transactions]
+                    await self.db.transactions.delete_many({"id": {"$in": transaction_ids}})
+                    await self.db.ledger_entries.delete_many({"id": {"$in": [entry["id"] for entry in entries]}})
+                    logger.error(f"Batch chunk of {len(transactions)} transfers failed, records removed")
+                    raise
+
+        if self.velocity is not None:
+            await self.velocity.record(transactions)
+        if self.rollups is not None:
+            await self.rollups.record_transactions(transactions)
+
+    async def _reverse_credits(self, credits: List[Tuple[str, int]], error: BulkWriteError):
+        """Take back the credits of a partly applied bulk_write"""
+        failed = {item["index"] for item in error.details.get("writeErrors", [])}
+        reversals = [
+            UpdateOne({"id": user_id}, balance_update(-amount))
+            for index, (user_id, amount) in enumerate(credits) if index not in failed
+        ]
+        if not reversals:
+            return
+        try:
+            await self.db.users.bulk_write(reversals, ordered=False)
+        except PyMongoError as e:
+            logger.critical(f"Could not reverse {len(reversals)} batch credits, balances need reconciling: {e}")
+            raise ReconciliationNeeded(str(e)) from e
+
+    async def _write_batch(self, transactions, entries, updates, session=None):
+        # Records first so a failed chunk can be rolled back before any credit lands
+        await self.db.transactions.insert_many(transactions, ordered=False, session=session)
+        await self.ledger.post(entries, session=session)
+        try:
+            await self.db.users.bulk_write(updates, ordered=False, session=session)
+        except BulkWriteError as e:
+            if session is not None:
+                # The transaction aborts as a whole; keep the error for its retry logic
+                raise
+            raise CreditsFailed(e) from e
+
+    def stats(self) -> Dict[str, Any]:
+        """Transfer statistics for the admin performance view"""
+        return {
+            "transactions_supported": self.transactions_supported,
+            "latency": self.latency.snapshot(),
+            "batch_chunk_latency": self.batch_latency.snapshot(),
+            **self.counters
+        }
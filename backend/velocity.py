@@ -0,0 +1,172 @@
+"""
+DalePay Velocity Counters
+Time-bucketed per-user send counts and totals for fraud and AML checks
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Bucket width and how long buckets are kept
+GRANULARITIES = {
+    "5m": (timedelta(minutes=5), timedelta(hours=2)),
+    "1h": (timedelta(hours=1), timedelta(days=2)),
+    "1d": (timedelta(days=1), timedelta(days=9))
+}
+
+META_ID = "meta"
+
+def bucket_start(at: datetime, granularity: str) -> datetime:
+    """Start of the bucket containing at"""
+    if granularity == "5m":
+        return at.replace(minute=at.minute - at.minute % 5, second=0, microsecond=0)
+    if granularity == "1h":
+        return at.replace(minute=0, second=0, microsecond=0)
+    return at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+class VelocityCounters:
+    """Per-sender counters kept in the velocity_counters collection.
+
+    Every completed transfer increments one 5-minute, one hourly and one daily
+    bucket for the sender; daily buckets also count sends per exact amount.
+    Reading a user's windows is one indexed query over at most ~45 small
+    documents, however long their history. A window reaches back to the start
+    of the bucket containing its lower bound, so counts may include up to one
+    bucket more than the exact window, never less. Windows starting before
+    the counters were first enabled are reported as None so callers can fall
+    back to scanning transactions until the counters have warmed up.
+    """
+
+    def __init__(self, db):
+        self.collection = db.velocity_counters
+        self._started_at: Optional[datetime] = None
+        self.counters = {"recorded": 0, "record_errors": 0, "reads": 0}
+
+    async def started_at(self) -> datetime:
+        """When counting began; windows before this are not covered"""
+        if self._started_at is None:
+            meta = await self.collection.find_one_and_update(
+                {"_id": META_ID},
+                {"$setOnInsert": {"started_at": datetime.utcnow()}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            self._started_at = meta["started_at"]
+        return self._started_at
+
+    def _updates(self, user_id: str, amount_cents: int, count: int, at: datetime,
+                 amounts: Dict[int, int]) -> List[UpdateOne]:
+        updates = []
+        for granularity, (_, retention) in GRANULARITIES.items():
+            bucket = bucket_start(at, granularity)
+            increments = {"count": count, "amount_cents": amount_cents}
+            if granularity == "1d":
+                for amount, times in amounts.items():
+                    increments[f"amounts.{amount}"] = times
+            updates.append(UpdateOne(
+                {"_id": f"{user_id}:{granularity}:{bucket.isoformat()}"},
+                {
+                    "$inc": increments,
+                    "$setOnInsert": {
+                        "user_id": user_id,
+                        "granularity": granularity,
+                        "bucket": bucket,
+                        "expires_at": bucket + retention
+                    }
+                },
+                upsert=True
+            ))
+        return updates
+
+    async def record(self, transactions: List[Dict[str, Any]]):
+        """Count completed transfers against their senders' buckets"""
+        if not transactions:
+            return
+        grouped: Dict[tuple, Dict[str, Any]] = {}
+        for transaction in transactions:
+            created_at = transaction["created_at"]
+            key = (transaction["from_user_id"], bucket_start(created_at, "5m"))
+            group = grouped.setdefault(key, {"at": created_at, "count": 0, "amount_cents": 0, "amounts": {}})
+            group["count"] += 1
+            group["amount_cents"] += transaction["amount_cents"]
+            group["amounts"][transaction["amount_cents"]] = group["amounts"].get(transaction["amount_cents"], 0) + 1
+
+        updates = []
+        for (user_id, _), group in grouped.items():
+            updates.extend(self._updates(user_id, group["amount_cents"], group["count"], group["at"], group["amounts"]))
+
+        try:
+            await self.collection.bulk_write(updates, ordered=False)
+            self.counters["recorded"] += len(transactions)
+        except Exception as e:
+            # Counters are advisory; a missed increment must not fail the transfer
+            self.counters["record_errors"] += 1
+            logger.error(f"Error recording velocity counters: {e}")
+
+    async def windows(self, user_id: str, amount_cents: Optional[int] = None,
+                      now: Optional[datetime] = None) -> Dict[str, Optional[int]]:
+        """Send counts and totals for the windows the risk checks use"""
+        now = now or datetime.utcnow()
+        started_at = await self.started_at()
+        bounds = {
+            "hour": now - timedelta(hours=1),
+            "day": now - timedelta(days=1),
+            "today": now.replace(hour=0, minute=0, second=0, microsecond=0),
+            "week": now - timedelta(days=7)
+        }
+
+        projection = {"granularity": 1, "bucket": 1, "count": 1, "amount_cents": 1}
+        if amount_cents is not None:
+            projection[f"amounts.{amount_cents}"] = 1
+        buckets = await self.collection.find({
+            "user_id": user_id,
+            "$or": [
+                {"granularity": "5m", "bucket": {"$gte": bucket_start(bounds["hour"], "5m")}},
+                {"granularity": "1h", "bucket": {"$gte": bucket_start(min(bounds["day"], bounds["today"]), "1h")}},
+                {"granularity": "1d", "bucket": {"$gte": bucket_start(bounds["week"], "1d")}}
+            ]
+        }, projection).to_list(None)
+        self.counters["reads"] += 1
+
+        result = {
+            "count_1h": 0,
+            "amount_24h_cents": 0,
+            "count_today": 0,
+            "amount_today_cents": 0,
+            "same_amount_7d": 0 if amount_cents is not None else None
+        }
+        for bucket in buckets:
+            if bucket["granularity"] == "5m":
+                result["count_1h"] += bucket["count"]
+            elif bucket["granularity"] == "1h":
+                if bucket["bucket"] >= bucket_start(bounds["day"], "1h"):
+                    result["amount_24h_cents"] += bucket["amount_cents"]
+                if bucket["bucket"] >= bounds["today"]:
+                    result["count_today"] += bucket["count"]
+                    result["amount_today_cents"] += bucket["amount_cents"]
+            elif amount_cents is not None:
+                result["same_amount_7d"] += bucket.get("amounts", {}).get(str(amount_cents), 0)
+
+        # Counts from before the counters existed are missing, so those windows are unknown
+        if started_at > bounds["hour"]:
+            result["count_1h"] = None
+        if started_at > bounds["day"]:
+            result["amount_24h_cents"] = None
+        if started_at > bounds["today"]:
+            result["count_today"] = None
+            result["amount_today_cents"] = None
+        if started_at > bounds["week"]:
+            result["same_amount_7d"] = None
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Counter statistics for the admin performance view"""
+        return {"started_at": self._started_at, **self.counters}
+
+def get_velocity_counters(db):
+    """Get velocity counters instance"""
+    return VelocityCounters(db)
@@ -7,7 +7,8 @@ const TransactionHistory = ({ user, onBack, darkMode }) => {
   const [error, setError] = useState('');
   const [filter, setFilter] = useState('all'); // all, sent, received
   const [currentPage, setCurrentPage] = useState(1);
-  const [totalPages, setTotalPages] = useState(1);
+  const [cursors, setCursors] = useState([null]); // cursors[n] fetches page n + 1
+  const [hasMore, setHasMore] = useState(false);
 
   useEffect(() => {
     fetchTransactions();
@@ -16,10 +17,11 @@ const TransactionHistory = ({ user, onBack, darkMode }) => {
   const fetchTransactions = async () => {
     setLoading(true);
     try {
-      const params = new URLSearchParams({
-        page: currentPage,
-        limit: 20
-      });
+      const params = new URLSearchParams({ limit: 20 });
+      const cursor = cursors[currentPage - 1];
+      if (cursor) {
+        params.append('cursor', cursor);
+      }
       
       if (filter !== 'all') {
         params.append('type', filter);
@@ -27,7 +29,14 @@ const TransactionHistory = ({ user, onBack, darkMode }) => {
 
       const response = await axios.get(`/transactions?${params}`);
       setTransactions(response.data.transactions || []);
-      setTotalPages(response.data.pages || 1);
+      setHasMore(Boolean(response.data.has_more));
+      if (response.data.next_cursor) {
+        setCursors(prev => {
+          const next = [...prev];
+          next[currentPage] = response.data.next_cursor;
+          return next;
+        });
+      }
     } catch (error) {
       setError('Failed to load transaction history');
       setTransactions([]);
@@ -165,6 +174,7 @@ const TransactionHistory = ({ user, onBack, darkMode }) => {
                     onClick={() => {
                       setFilter(filterOption.value);
                       setCurrentPage(1);
+                      setCursors([null]);
                     }}
                     className={`flex items-center space-x-2 px-4 py-2 rounded-lg font-medium transition-colors ${
                       filter === filterOption.value
@@ -301,7 +311,7 @@ const TransactionHistory = ({ user, onBack, darkMode }) => {
             )}
 
             {/* Pagination */}
-            {totalPages > 1 && (
+            {(currentPage > 1 || hasMore) && (
               <div className="flex items-center justify-between mt-8 pt-6 border-t border-gray-200 dark:border-gray-700">
                 <button
                   onClick={() => setCurrentPage(Math.max(1, currentPage - 1))}
@@ -319,12 +329,12 @@ const TransactionHistory = ({ user, onBack, darkMode }) => {
                 </button>
                 
                 <span className={`text-sm ${darkMode ? 'text-gray-400' : 'text-gray-600'}`}>
-                  Page {currentPage} of {totalPages}
+                  Page {currentPage}
                 </span>
 
                 <button
-                  onClick={() => setCurrentPage(Math.min(totalPages, currentPage + 1))}
-                  disabled={currentPage === totalPages}
+                  onClick={() => setCurrentPage(currentPage + 1)}
+                  disabled={!hasMore}
                   className={`flex items-center space-x-2 px-4 py-2 rounded-lg font-medium transition-colors disabled:opacity-50 disabled:cursor-not-allowed ${
                     darkMode 
                       ? 'bg-gray-700 text-white hover:bg-gray-600' 
@@ -0,0 +1,161 @@
+import sys
+import uuid
+import asyncio
+from pathlib import Path
+from datetime import datetime
+
+import pytest
+import mongomock
+from pymongo import ReturnDocument
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+# The backend modules import each other as top-level modules. Import the app
+# while backend/ leads sys.path: pytest puts the repo root back in front
+# later, and the stale top-level admin_api.py there would shadow the real one.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+import server  # noqa: E402
+import admin_api  # noqa: E402
+from principal_cache import principal_cache  # noqa: E402
+from ledger import Ledger, opening_entries  # noqa: E402
+from transfer_engine import TransferEngine  # noqa: E402
+
+def _project(document, projection):
+    if document is None or not projection:
+        return document
+    fields = projection if isinstance(projection, dict) else dict.fromkeys(projection, 1)
+    included = {key for key, value in fields.items() if value and key != "_id"}
+    if included:
+        projected = {key: value for key, value in document.items() if key in included or key == "_id"}
+    else:
+        projected = {key: value for key, value in document.items() if key not in fields}
+    if not fields.get("_id", 1):
+        projected.pop("_id", None)
+    return projected
+
+_find_and_modify = mongomock.collection.Collection._find_and_modify
+
+def _find_and_modify_by_id(self, query, projection=None, update=None, upsert=False, sort=None,
+                           return_document=ReturnDocument.BEFORE, session=None, **kwargs):
+    """mongomock re-reads the updated document by the original filter when the
+    projection drops _id, so a debit that takes the balance below its own
+    $gte guard comes back as None. Look it up by _id, as mongod does."""
+    before = _find_and_modify(self, query, None, update, upsert, sort, ReturnDocument.BEFORE, session, **kwargs)
+    if return_document is ReturnDocument.AFTER or kwargs.get("new"):
+        if before is not None:
+            return self.find_one({"_id": before["_id"]}, projection)
+        return self.find_one(query, projection) if upsert else None
+    return _project(before, projection)
+
+@pytest.fixture(autouse=True)
+def mongod_find_and_modify(monkeypatch):
+    monkeypatch.setattr(mongomock.collection.Collection, "_find_and_modify", _find_and_modify_by_id)
+
+@pytest.fixture
+def run():
+    """Run a coroutine to completion on a fresh event loop"""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+@pytest.fixture
+def mongo():
+    return AsyncMongoMockClient()
+
+@pytest.fixture
+def db(mongo):
+    return mongo["dalepay_test"]
+
+def make_user(user_id: str, balance_cents: int, **fields) -> dict:
+    """A user document in the shape register_user writes"""
+    user = {
+        "id": user_id,
+        "email": f"{user_id}@example.com",
+        "full_name": f"Test {user_id}",
+        "phone": f"787-555-{abs(hash(user_id)) % 10000:04d}",
+        "wallet_balance": balance_cents / 100,
+        "wallet_balance_cents": balance_cents,
+        "account_status": "active",
+        "kyc_status": "approved",
+        "daily_limit": 2500.0,
+        "monthly_limit": 10000.0,
+        "created_at": datetime.utcnow()
+    }
+    user.update(fields)
+    return user
+
+def make_transaction(from_user_id: str, to_user_id: str, amount_cents: int, fee_cents: int = 0, **fields) -> dict:
+    """A completed transfer record in the shape send_money writes"""
+    now = datetime.utcnow()
+    transaction = {
+        "id": str(uuid.uuid4()),
+        "from_user_id": from_user_id,
+        "to_user_id": to_user_id,
+        "amount": amount_cents / 100,
+        "fee": fee_cents / 100,
+        "amount_cents": amount_cents,
+        "fee_cents": fee_cents,
+        "description": "DalePay Transfer",
+        "transfer_type": "instant" if fee_cents else "standard",
+        "status": "completed",
+        "created_at": now,
+        "completed_at": now
+    }
+    transaction.update(fields)
+    return transaction
+
+@pytest.fixture
+def client(mongo, db, monkeypatch):
+    """The app wired to mongomock, without running the startup hooks"""
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(admin_api, "db", db)
+    monkeypatch.setattr(server.ledger, "db", db)
+    monkeypatch.setattr(server.transfer_engine, "db", db)
+    monkeypatch.setattr(server.transfer_engine, "client", mongo)
+    monkeypatch.setattr(server.transfer_engine, "transactions_supported", False)
+    monkeypatch.setattr(server.idempotency_store, "collection", db.idempotency_keys)
+    monkeypatch.setattr(server.velocity_counters, "collection", db.velocity_counters)
+    monkeypatch.setattr(server.risk_features, "db", db)
+    monkeypatch.setattr(server.compliance_manager, "db", db)
+    monkeypatch.setattr(server.fraud_engine, "db", db)
+    monkeypatch.setattr(server.alert_store, "collection", db.alerts)
+    monkeypatch.setattr(server.audit_log, "collection", db.compliance_logs)
+    monkeypatch.setattr(server.metric_rollups, "db", db)
+    monkeypatch.setattr(server.metric_rollups, "collection", db.metric_rollups)
+    principal_cache.clear()
+    yield TestClient(server.app)
+    principal_cache.clear()
+
+def auth(user_id: str) -> dict:
+    return {"Authorization": "Bearer " + server.create_access_token({"sub": user_id})}
+
+@pytest.fixture
+def ledger(db):
+    return Ledger(db)
+
+@pytest.fixture
+def engine(mongo, db, ledger):
+    engine = TransferEngine(mongo, db, ledger)
+    # mongomock has no sessions, like a standalone mongod
+    engine.transactions_supported = False
+    return engine
+
+@pytest.fixture
+def users(run, db, ledger):
+    accounts = [make_user("alice", 10000), make_user("bob", 500), make_user("carol", 0)]
+    run(db.users.insert_many(accounts))
+    for account in accounts:
+        if account["wallet_balance_cents"]:
+            run(ledger.post(opening_entries(account["id"], account["wallet_balance_cents"], account["created_at"])))
+    return accounts
+
+def balance(run, db, user_id):
+    user = run(db.users.find_one({"id": user_id}))
+    assert user["wallet_balance"] == user["wallet_balance_cents"] / 100
+    return user["wallet_balance_cents"]
+
+def assert_ledger_matches_wallets(run, db, ledger):
+    """Every wallet equals its opening balance plus its ledger entries"""
+    for user in run(db.users.find({}, {"id": 1}).to_list(None)):
+        result = run(ledger.reconcile(user["id"]))
+        assert result["in_balance"], result
@@ -0,0 +1,46 @@
+from alerts import AlertStore
+
+def hit(severity="medium", **data):
+    return {"type": "fraud_alert", "user_id": "alice", "description": "Burst of transfers",
+            "severity": severity, "data": data}
+
+def test_repeats_fold_into_one_open_alert(run, db):
+    store = AlertStore(db)
+
+    first = run(store.raise_alert(hit(transfer_count=6)))
+    second = run(store.raise_alert(hit(transfer_count=7)))
+
+    assert first["id"] == second["id"]
+    alerts = run(db.alerts.find().to_list(None))
+    assert len(alerts) == 1
+    assert alerts[0]["occurrences"] == 2 and alerts[0]["data"] == {"transfer_count": 7}
+    assert store.counters == {"raised": 2, "opened": 1, "folded": 1}
+
+def test_more_severe_repeat_raises_the_severity(run, db):
+    store = AlertStore(db)
+
+    run(store.raise_alert(hit("high")))
+    run(store.raise_alert(hit("low")))
+    assert run(db.alerts.find_one())["severity"] == "high"
+
+    run(store.raise_alert(hit("critical")))
+    assert run(db.alerts.find_one())["severity"] == "critical"
+
+def test_other_users_and_types_get_their_own_alert(run, db):
+    store = AlertStore(db)
+
+    run(store.raise_alert(hit()))
+    run(store.raise_alert({**hit(), "user_id": "bob"}))
+    run(store.raise_alert({**hit(), "type": "sanctions_review"}))
+
+    assert run(db.alerts.count_documents({})) == 3
+
+def test_resolved_alert_is_not_reopened(run, db):
+    store = AlertStore(db)
+    first = run(store.raise_alert(hit()))
+    run(db.alerts.update_one({"id": first["id"]}, {"$set": {"status": "resolved"}}))
+
+    second = run(store.raise_alert(hit()))
+
+    assert second["id"] != first["id"]
+    assert run(db.alerts.count_documents({"status": "open"})) == 1
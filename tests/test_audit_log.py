@@ -0,0 +1,87 @@
+import pytest
+from pymongo.errors import AutoReconnect
+
+from audit_log import AuditLogWriter, _read_lines
+
+class FlakyCollection:
+    """Passes inserts through to the real collection unless it is down"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.down = False
+
+    async def insert_many(self, documents, ordered=True):
+        if self.down:
+            raise AutoReconnect("connection refused")
+        return await self.collection.insert_many(documents, ordered=ordered)
+
+@pytest.fixture
+def collection(db):
+    return FlakyCollection(db.compliance_logs)
+
+def test_spilled_records_are_replayed_once_inserts_succeed(run, db, collection, tmp_path):
+    spill_path = tmp_path / "audit_spill.jsonl"
+
+    async def scenario():
+        writer = AuditLogWriter(collection, spill_path, retry_interval=0)
+        collection.down = True
+        for number in range(3):
+            writer.write({"action": "money_transfer", "number": number})
+        await writer.flush()
+        assert spill_path.exists()
+
+        collection.down = False
+        writer.write({"action": "money_transfer", "number": 3})
+        await writer.flush()
+        await writer.shutdown()
+        return writer
+
+    writer = run(scenario())
+
+    assert writer.counters["spilled"] == 3 and writer.counters["replayed"] == 3
+    assert not spill_path.exists()
+    assert sorted(record["number"] for record in run(db.compliance_logs.find().to_list(None))) == [0, 1, 2, 3]
+
+def test_replay_at_startup_skips_records_already_stored(run, db, collection, tmp_path):
+    spill_path = tmp_path / "audit_spill.jsonl"
+
+    async def scenario():
+        crashed = AuditLogWriter(collection, spill_path)
+        collection.down = True
+        crashed.write({"action": "user_login"})
+        crashed.write({"action": "user_logout"})
+        await crashed.shutdown()
+        collection.down = False
+        # The first record landed before the outage was noticed
+        await db.compliance_logs.insert_one(_read_lines(spill_path)[0])
+
+        restarted = AuditLogWriter(collection, spill_path)
+        await restarted.start()
+        await restarted.shutdown()
+        return restarted
+
+    restarted = run(scenario())
+
+    assert restarted.counters["replayed"] == 2
+    assert run(db.compliance_logs.count_documents({})) == 2
+
+def test_batch_that_cannot_be_spilled_stays_buffered(run, db, collection, tmp_path):
+    spill_path = tmp_path / "missing" / "audit_spill.jsonl"
+
+    async def scenario():
+        writer = AuditLogWriter(collection, spill_path, retry_interval=0)
+        collection.down = True
+        writer.write({"action": "money_transfer"})
+        with pytest.raises(OSError):
+            await writer.flush()
+        assert writer.stats()["buffered"] == 1
+
+        collection.down = False
+        await writer.flush()
+        await writer.shutdown()
+        return writer
+
+    writer = run(scenario())
+
+    assert writer.counters["failed_spills"] == 1 and writer.counters["dropped"] == 0
+    assert run(db.compliance_logs.count_documents({})) == 1
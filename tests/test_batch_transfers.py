@@ -0,0 +1,97 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+from .conftest import make_user, make_transaction, auth, balance, assert_ledger_matches_wallets
+
+def test_batch_reserve_and_settle(run, db, engine, ledger, users):
+    chunk = [make_transaction("alice", "bob", 1000, 15), make_transaction("alice", "carol", 2000, 30),
+             make_transaction("alice", "bob", 500)]
+    reserved = sum(t["amount_cents"] + t["fee_cents"] for t in chunk)
+
+    run(engine.reserve("alice", reserved + 400))
+    assert balance(run, db, "alice") == 10000 - reserved - 400
+    run(engine.settle_batch(chunk))
+    run(engine.release("alice", 400))
+
+    assert balance(run, db, "alice") == 10000 - reserved
+    assert balance(run, db, "bob") == 500 + 1500
+    assert balance(run, db, "carol") == 2000
+    assert run(db.transactions.count_documents({})) == 3
+    assert_ledger_matches_wallets(run, db, ledger)
+
+def test_reserve_refuses_more_than_the_balance(run, db, engine, users):
+    with pytest.raises(HTTPException) as raised:
+        run(engine.reserve("bob", 501))
+    assert raised.value.status_code == 400
+    assert balance(run, db, "bob") == 500
+
+def test_concurrent_batches_cannot_both_pass_the_daily_limit(run, db, client):
+    sender = make_user("merchant", 10 ** 7, daily_limit=100.0)
+    run(db.users.insert_one(sender))
+    # Both batches read the same starting position before either reserves
+    first = run(server.spend_limits(sender, 6000))
+    second = run(server.spend_limits(sender, 6000))
+
+    run(server.transfer_engine.reserve("merchant", 6000, first))
+    with pytest.raises(HTTPException) as raised:
+        run(server.transfer_engine.reserve("merchant", 6000, second))
+
+    assert raised.value.detail == "Daily transaction limit exceeded"
+    assert balance(run, db, "merchant") == 10 ** 7 - 6000
+
+def test_released_funds_come_off_the_spend_counters(run, db, client):
+    sender = make_user("merchant", 10 ** 7, daily_limit=100.0)
+    run(db.users.insert_one(sender))
+
+    limits = run(server.spend_limits(sender, 8000))
+    run(server.transfer_engine.reserve("merchant", 8000, limits))
+    run(server.transfer_engine.release("merchant", 8000, limits, 8000))
+
+    run(server.transfer_engine.reserve("merchant", 8000, run(server.spend_limits(sender, 8000))))
+    assert run(db.users.find_one({"id": "merchant"}))["spend"]["day_cents"] == 8000
+
+def post_batch(client, sender_id, items):
+    response = client.post("/api/transfer/batch", json={"items": items}, headers=auth(sender_id))
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+def test_fuzzy_sanctions_hits_go_to_review(run, db, client):
+    run(db.users.insert_many([
+        make_user("merchant", 10 ** 6),
+        make_user("listed", 0, full_name="Jane Smith"),
+        make_user("near", 0, full_name="Jane Smyth")
+    ]))
+
+    results = post_batch(client, "merchant", [
+        {"recipient_email": "listed@example.com", "amount": 10},
+        {"recipient_email": "near@example.com", "amount": 10}
+    ])
+
+    by_index = {result["index"]: result for result in results if "index" in result}
+    assert by_index[0]["error"] == "Recipient failed sanctions screening"
+    assert by_index[1]["status"] == "completed"
+    assert balance(run, db, "near") == 1000
+    review = run(db.alerts.find_one({"type": "sanctions_review"}))
+    assert review["user_id"] == "near" and review["status"] == "open"
+
+def test_single_transfers_get_the_same_limits_and_screening(run, db, client):
+    run(db.users.insert_many([
+        make_user("alice", 10 ** 6, daily_limit=50.0),
+        make_user("bob", 0),
+        make_user("listed", 0, full_name="Jane Smith")
+    ]))
+
+    def send(email, amount):
+        return client.post("/api/transfer/send", headers=auth("alice"),
+                           json={"recipient_email": email, "amount": amount, "transfer_type": "standard"})
+
+    assert send("listed@example.com", 10).status_code == 403
+    assert send("bob@example.com", 40).status_code == 200
+    refused = send("bob@example.com", 20)
+    assert refused.status_code == 400
+    assert refused.json()["detail"] == "Daily transaction limit exceeded"
+    assert balance(run, db, "bob") == 4000
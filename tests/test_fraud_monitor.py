@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from alerts import AlertStore
+from fraud_monitor import FraudMonitor
+from .conftest import make_transaction
+
+def make_monitor(db, **settings):
+    return FraudMonitor(db, window_seconds=600, max_transfers=3, max_amount_cents=100000,
+                        alerts=AlertStore(db), **settings)
+
+def transfer(amount_cents, created_at, sender="alice"):
+    transaction = make_transaction(sender, "bob", amount_cents, created_at=created_at)
+    transaction["_id"] = ObjectId()
+    return transaction
+
+def test_burst_alerts_once_per_window(run, db):
+    monitor = make_monitor(db)
+    start = datetime.utcnow()
+
+    for minute in range(5):
+        run(monitor._process(transfer(1000, start + timedelta(minutes=minute))))
+
+    assert monitor.counters["alerts"] == 1
+    alert = run(db.alerts.find_one({"user_id": "alice"}))
+    assert alert["data"]["transfer_count"] == 4
+
+def test_transfers_outside_the_window_do_not_count(run, db):
+    monitor = make_monitor(db)
+    start = datetime.utcnow()
+
+    for hour in range(6):
+        run(monitor._process(transfer(1000, start + timedelta(hours=hour))))
+
+    assert monitor.counters["alerts"] == 0
+    assert len(monitor._windows["alice"]) == 1
+
+def test_amount_over_the_window_limit_alerts(run, db):
+    monitor = make_monitor(db)
+    start = datetime.utcnow()
+
+    run(monitor._process(transfer(60000, start)))
+    run(monitor._process(transfer(50000, start + timedelta(minutes=1))))
+
+    assert monitor.counters["alerts"] == 1
+
+def test_backdated_transfer_lands_in_its_window(run, db):
+    monitor = make_monitor(db)
+    start = datetime.utcnow()
+
+    run(monitor._process(transfer(1000, start)))
+    run(monitor._process(transfer(1000, start - timedelta(hours=1))))
+
+    window = monitor._windows["alice"]
+    assert [created_at for created_at, _ in window] == [start]
+    assert monitor._position["last_created_at"] == start
+
+def test_polling_reads_backdated_inserts_in_id_order(run, db):
+    monitor = make_monitor(db)
+    monitor._position = {"resume_token": None, "last_created_at": None, "last_object_id": ObjectId()}
+    # A batch payout row written now with a created_at from before the last position
+    backdated = make_transaction("alice", "bob", 1000, created_at=datetime.utcnow() - timedelta(minutes=5))
+    run(db.transactions.insert_one(backdated))
+
+    batch = run(monitor._poll_once())
+
+    assert [transaction["id"] for transaction in batch] == [backdated["id"]]
+    assert monitor._position["last_object_id"] == backdated["_id"]
+    assert run(monitor._poll_once()) == []
+
+def test_stream_without_token_catches_up_from_last_position(run, db):
+    monitor = make_monitor(db)
+    monitor._position = {"resume_token": None, "last_created_at": None, "last_object_id": ObjectId()}
+    missed = [make_transaction("alice", "bob", 1000) for _ in range(2)]
+    run(db.transactions.insert_many(missed))
+
+    caught_up = run(monitor._catch_up())
+
+    assert caught_up == {transaction["_id"] for transaction in missed}
+    assert monitor.counters["events"] == 2
+
+def test_first_start_does_not_replay_history(run, db):
+    monitor = make_monitor(db)
+    monitor._position = {"resume_token": None, "last_created_at": None, "last_object_id": None}
+    run(db.transactions.insert_one(make_transaction("alice", "bob", 1000)))
+
+    assert run(monitor._catch_up()) == set()
+    assert monitor.counters["events"] == 0
@@ -0,0 +1,124 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from idempotency import IdempotencyStore
+
+@pytest.fixture
+def store(db):
+    return IdempotencyStore(db, lease_seconds=0.3, wait_timeout=2)
+
+def counting_handler(calls):
+    async def handler():
+        calls.append(1)
+        return {"call": len(calls)}
+    return handler
+
+def test_retry_replays_the_stored_response(run, store):
+    calls = []
+    handler = counting_handler(calls)
+
+    first = run(store.run("key", "alice", "transfer", {"amount": 10}, handler))
+    second = run(store.run("key", "alice", "transfer", {"amount": 10}, handler))
+
+    assert first == second == {"call": 1}
+    assert calls == [1]
+    assert store.counters["executions"] == 1
+
+def test_replay_survives_a_restart(run, db, store):
+    calls = []
+    run(store.run("key", "alice", "transfer", {"amount": 10}, counting_handler(calls)))
+
+    restarted = IdempotencyStore(db)
+    replayed = run(restarted.run("key", "alice", "transfer", {"amount": 10}, counting_handler(calls)))
+
+    assert replayed == {"call": 1}
+    assert restarted.counters["stored_hits"] == 1
+
+def test_key_reused_with_a_different_payload_conflicts(run, store):
+    calls = []
+    run(store.run("key", "alice", "transfer", {"amount": 10}, counting_handler(calls)))
+
+    with pytest.raises(HTTPException) as raised:
+        run(store.run("key", "alice", "transfer", {"amount": 20}, counting_handler(calls)))
+
+    assert raised.value.status_code == 422
+    assert calls == [1]
+
+def test_keys_are_scoped_to_the_user(run, store):
+    calls = []
+    run(store.run("key", "alice", "transfer", {"amount": 10}, counting_handler(calls)))
+    run(store.run("key", "bob", "transfer", {"amount": 10}, counting_handler(calls)))
+    assert calls == [1, 1]
+
+def test_failed_handler_releases_the_key(run, db, store):
+    async def failing():
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+
+    with pytest.raises(HTTPException):
+        run(store.run("key", "alice", "transfer", {}, failing))
+
+    assert run(db.idempotency_keys.count_documents({})) == 0
+    assert run(store.run("key", "alice", "transfer", {}, counting_handler([]))) == {"call": 1}
+
+def test_lapsed_lease_is_taken_over(run, db, store):
+    now = datetime.utcnow()
+    run(db.idempotency_keys.insert_one({
+        "_id": "alice:transfer:key", "fingerprint": store._fingerprint({}), "status": "in_progress",
+        "owner": "dead-worker", "locked_until": now - timedelta(seconds=1), "created_at": now
+    }))
+
+    assert run(store.run("key", "alice", "transfer", {}, counting_handler([]))) == {"call": 1}
+    assert store.counters["takeovers"] == 1
+
+def test_cancelled_request_still_stores_the_response(run, db, store):
+    async def scenario():
+        async def slow():
+            await asyncio.sleep(0.2)
+            return {"done": True}
+        request = asyncio.ensure_future(store.run("key", "alice", "transfer", {}, slow))
+        await asyncio.sleep(0.05)
+        request.cancel()
+        await asyncio.sleep(0.4)
+        return await db.idempotency_keys.find_one({"_id": "alice:transfer:key"})
+
+    record = run(scenario())
+
+    assert record["status"] == "completed"
+    assert record["response"] == {"done": True}
+
+def test_slow_handler_keeps_its_lease(run, db, store):
+    calls = []
+
+    async def scenario():
+        async def slow():
+            calls.append(1)
+            await asyncio.sleep(1.0)
+            return {"call": len(calls)}
+        other_worker = IdempotencyStore(db, lease_seconds=0.3, wait_timeout=3)
+        first = asyncio.ensure_future(store.run("key", "alice", "transfer", {}, slow))
+        await asyncio.sleep(0.6)
+        retry = await other_worker.run("key", "alice", "transfer", {}, slow)
+        return await first, retry, other_worker
+
+    first, retry, other_worker = run(scenario())
+
+    assert first == retry == {"call": 1}
+    assert calls == [1]
+    assert other_worker.counters["takeovers"] == 0
+    assert store.counters["leases_lost"] == 0
+
+def test_completion_after_a_takeover_is_reported(run, db, store, caplog):
+    async def scenario():
+        async def taken_over():
+            await db.idempotency_keys.update_one({"_id": "alice:transfer:key"}, {"$set": {"owner": "other-worker"}})
+            return {"done": True}
+        return await store.run("key", "alice", "transfer", {}, taken_over)
+
+    assert run(scenario()) == {"done": True}
+    assert store.counters["completions_lost"] == 1
+    assert "response not stored" in caplog.text
+    record = run(db.idempotency_keys.find_one({"_id": "alice:transfer:key"}))
+    assert record["owner"] == "other-worker" and record["status"] == "in_progress"
@@ -0,0 +1,55 @@
+import pytest
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from index_manager import IndexManager, DECLARED_INDEXES
+
+def declared(*models):
+    return {"transactions": list(models)}
+
+def names(run, collection):
+    return set(run(collection.index_information()))
+
+def test_reconcile_creates_missing_indexes_once(run, db):
+    manager = IndexManager(db, declared(IndexModel([("status", ASCENDING)], name="status")))
+
+    first = run(manager.reconcile())
+    second = run(manager.reconcile())
+
+    assert first["created"] == ["transactions.status"]
+    assert second["created"] == [] and second["existing"] == ["transactions.status"]
+    assert "status" in names(run, db.transactions)
+
+def test_reconcile_adopts_an_index_with_the_same_key_under_another_name(run, db):
+    run(db.transactions.create_index([("from_user_id", ASCENDING), ("created_at", DESCENDING)],
+                                     name="legacy_from_user"))
+    manager = IndexManager(db, declared(
+        IndexModel([("from_user_id", ASCENDING), ("created_at", DESCENDING)], name="from_user_created_at")
+    ))
+
+    summary = run(manager.reconcile())
+
+    assert summary["existing"] == ["transactions.from_user_created_at"]
+    assert summary["created"] == []
+    assert "from_user_created_at" not in names(run, db.transactions)
+
+def test_reconcile_reports_conflicting_options(run, db):
+    run(db.transactions.create_index([("id", ASCENDING)], name="id_unique"))
+    manager = IndexManager(db, declared(IndexModel([("id", ASCENDING)], name="id_unique", unique=True)))
+
+    summary = run(manager.reconcile())
+
+    assert summary["conflicts"] == ["transactions.id_unique"]
+    assert manager.stats()["reconciled"]
+
+def test_wallet_transactions_without_an_id_can_share_the_collection(run, db):
+    run(IndexManager(db, {"transactions": DECLARED_INDEXES["transactions"]}).reconcile())
+
+    # moov_wallet records transaction_id only
+    run(db.transactions.insert_one({"transaction_id": "wallet-1", "status": "processing"}))
+    run(db.transactions.insert_one({"transaction_id": "wallet-2", "status": "processing"}))
+    run(db.transactions.insert_one({"id": "transfer-1"}))
+
+    with pytest.raises(DuplicateKeyError):
+        run(db.transactions.insert_one({"id": "transfer-1"}))
+    assert run(db.transactions.count_documents({})) == 3
@@ -0,0 +1,57 @@
+import pytest
+from fastapi import HTTPException
+
+from ledger import BATCH_HOLD_ACCOUNT
+
+from .conftest import make_user, make_transaction, balance, assert_ledger_matches_wallets
+
+def failing_post(ledger, monkeypatch):
+    async def post(entries, session=None):
+        raise RuntimeError("ledger write failed")
+    monkeypatch.setattr(ledger, "post", post)
+
+def test_ledger_stays_in_balance_across_transfers(run, db, engine, ledger, users):
+    transfers = [("alice", "bob", 1234, 19), ("bob", "carol", 700, 0), ("carol", "alice", 350, 5), ("alice", "carol", 99, 0)]
+    for sender, recipient, amount_cents, fee_cents in transfers:
+        run(engine.transfer(make_transaction(sender, recipient, amount_cents, fee_cents)))
+    with pytest.raises(HTTPException):
+        run(engine.transfer(make_transaction("carol", "bob", 10 ** 6)))
+
+    assert_ledger_matches_wallets(run, db, ledger)
+    assert balance(run, db, "alice") + balance(run, db, "bob") + balance(run, db, "carol") == 10500 - 19 - 5
+
+def test_batch_hold_is_posted_and_released(run, db, engine, ledger, users):
+    chunk = [make_transaction("alice", "bob", 1000, 15), make_transaction("alice", "carol", 2000)]
+    run(engine.reserve("alice", 5000, hold_id="hold:batch-1"))
+    assert_ledger_matches_wallets(run, db, ledger)
+    assert run(ledger.get_balance_cents(BATCH_HOLD_ACCOUNT)) == 5000
+
+    run(engine.settle_batch(chunk, "hold:batch-1"))
+    run(engine.release("alice", 5000 - 3015, hold_id="hold:batch-1"))
+
+    assert balance(run, db, "alice") == 10000 - 3015
+    assert run(ledger.get_balance_cents(BATCH_HOLD_ACCOUNT)) == 0
+    assert_ledger_matches_wallets(run, db, ledger)
+    kinds = {entry["kind"] for entry in run(db.ledger_entries.find({"transaction_id": "hold:batch-1"}).to_list(None))}
+    assert kinds == {"hold", "release"}
+
+def test_reserve_is_refunded_when_the_hold_cannot_be_posted(run, db, engine, ledger, users, monkeypatch):
+    failing_post(ledger, monkeypatch)
+
+    with pytest.raises(RuntimeError):
+        run(engine.reserve("alice", 3000))
+
+    assert balance(run, db, "alice") == 10000
+    monkeypatch.undo()
+    assert_ledger_matches_wallets(run, db, ledger)
+
+def test_account_is_not_created_without_its_opening_entries(run, db, engine, ledger, monkeypatch):
+    failing_post(ledger, monkeypatch)
+
+    with pytest.raises(RuntimeError):
+        run(engine.create_account(make_user("dave", 2500)))
+
+    assert run(db.users.count_documents({"id": "dave"})) == 0
+    monkeypatch.undo()
+    run(engine.create_account(make_user("dave", 2500)))
+    assert_ledger_matches_wallets(run, db, ledger)
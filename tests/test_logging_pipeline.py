@@ -0,0 +1,49 @@
+import json
+import logging
+
+import pytest
+
+from logging_pipeline import setup_logging
+
+@pytest.fixture
+def pipeline_env(monkeypatch):
+    """Restore the root logger that setup_logging replaces"""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    monkeypatch.setenv("LOG_FILE_PER_PROCESS", "false")
+    pipelines = []
+    yield pipelines
+    for pipeline in pipelines:
+        pipeline.shutdown()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+def test_log_file_directory_is_created(tmp_path, monkeypatch, pipeline_env):
+    log_file = tmp_path / "dalepay" / "app.log"
+    monkeypatch.setenv("LOG_FILE", str(log_file))
+
+    pipeline = setup_logging()
+    pipeline_env.append(pipeline)
+    logging.getLogger("server").warning("hello")
+    pipeline.shutdown()
+
+    assert pipeline.stats()["log_file"] == str(log_file)
+    entry = json.loads(log_file.read_text().splitlines()[-1])
+    assert entry["message"] == "hello"
+
+def test_unwritable_log_file_is_reported_on_stderr(tmp_path, monkeypatch, capsys, pipeline_env):
+    blocker = tmp_path / "not-a-directory"
+    blocker.write_text("")
+    monkeypatch.setenv("LOG_FILE", str(blocker / "app.log"))
+
+    pipeline = setup_logging()
+    pipeline_env.append(pipeline)
+    pipeline.shutdown()
+
+    assert pipeline.stats()["log_file"] is None
+    captured = capsys.readouterr()
+    assert "not writable" in captured.err
+    assert "not writable" not in captured.out
@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+from datetime import datetime
+
+from metric_rollups import MetricRollups
+from moov_wallet import DalePayWallet
+
+class FakeTransfers:
+    def __init__(self, statuses):
+        self.statuses = statuses
+
+    async def get(self, transfer_id):
+        return SimpleNamespace(transferID=transfer_id, status=self.statuses[transfer_id])
+
+def wallet_transfer(transfer_id, amount):
+    return {"transaction_id": f"tx-{transfer_id}", "moov_transfer_id": transfer_id, "from_user_id": "alice",
+            "to_user_id": "bob", "amount": amount, "fee": 0.0, "status": "processing", "created_at": datetime.utcnow()}
+
+def test_settled_wallet_transfers_move_into_completed(run, db):
+    rollups = MetricRollups(db)
+    wallet = DalePayWallet(SimpleNamespace(moov_client=SimpleNamespace(transfers=FakeTransfers(
+        {"mv-1": "completed", "mv-2": "failed", "mv-3": "pending"}
+    ))), db)
+    wallet.rollups = rollups
+    transfers = [wallet_transfer("mv-1", 25.0), wallet_transfer("mv-2", 10.0), wallet_transfer("mv-3", 5.0)]
+    run(db.transactions.insert_many([dict(transfer) for transfer in transfers]))
+    run(rollups.record_transactions(transfers))
+    assert run(rollups.summary())["today"]["completed_transactions"] == 0
+
+    result = run(wallet.sync_transfer_statuses())
+
+    assert result == {"checked": 3, "settled": 2, "errors": 0}
+    today = run(rollups.summary())["today"]
+    assert today["transactions"] == 3
+    assert today["completed_transactions"] == 1 and today["volume_cents"] == 2500
+    statuses = {t["moov_transfer_id"]: t["status"] for t in run(db.transactions.find().to_list(None))}
+    assert statuses == {"mv-1": "completed", "mv-2": "failed", "mv-3": "processing"}
+
+def test_a_status_is_only_counted_once(run, db):
+    rollups = MetricRollups(db)
+    wallet = DalePayWallet(SimpleNamespace(moov_client=None), db)
+    wallet.rollups = rollups
+    transfer = wallet_transfer("mv-1", 25.0)
+    run(db.transactions.insert_one(dict(transfer)))
+    run(rollups.record_transactions([transfer]))
+
+    assert run(wallet.update_transfer_status("mv-1", "completed"))
+    assert not run(wallet.update_transfer_status("mv-1", "completed"))
+    assert run(rollups.summary())["today"]["completed_transactions"] == 1
+
+    # A reversal takes the volume back out
+    assert run(wallet.update_transfer_status("mv-1", "reversed"))
+    today = run(rollups.summary())["today"]
+    assert today["completed_transactions"] == 0 and today["volume_cents"] == 0
@@ -0,0 +1,26 @@
+import server
+from metrics import MetricsRegistry
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    latency = registry.histogram("test_seconds", "Test latency", ("route",), buckets=(0.1, 1.0))
+    latency.observe(0.05, "/a")
+    latency.observe(0.5, "/a")
+    latency.observe(5.0, "/a")
+
+    lines = registry.render().splitlines()
+
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{route="/a"} 3' in lines
+
+def test_requests_are_labelled_by_route_template(client, monkeypatch):
+    monkeypatch.setattr(server, "METRICS_TOKEN", "secret")
+    status = client.get("/api/transactions?limit=5").status_code
+
+    assert client.get("/metrics").status_code == 401
+    body = client.get("/metrics", headers={"Authorization": "Bearer secret"}).text
+
+    assert f'dalepay_http_requests_total{{method="GET",route="/api/transactions",status="{status}"}}' in body
+    assert "limit=5" not in body
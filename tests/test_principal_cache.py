@@ -0,0 +1,17 @@
+from principal_cache import principal_cache
+
+from .conftest import make_user, auth
+
+def test_freeze_invalidates_the_cached_principal(run, db, client):
+    run(db.users.insert_many([make_user("alice", 10000), make_user("admin", 0, email="admin@dalepay.com")]))
+
+    # The first request caches alice's principal
+    assert client.get("/api/transactions", headers=auth("alice")).status_code == 200
+    assert principal_cache.get("alice") is not None
+
+    frozen = client.post("/admin/users/alice/freeze?reason=test", headers=auth("admin"))
+    assert frozen.status_code == 200
+
+    response = client.get("/api/transactions", headers=auth("alice"))
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Account frozen - Contact support"
@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+from query_monitor import QueryMonitor
+
+def run_command(monitor, request_id, command_name, command, duration_ms):
+    event = SimpleNamespace(connection_id=("localhost", 27017), request_id=request_id, database_name="dalepay",
+                            command_name=command_name, command=command, duration_micros=int(duration_ms * 1000))
+    monitor.started(event)
+    monitor.succeeded(event)
+
+def test_slow_queries_are_grouped_by_shape():
+    monitor = QueryMonitor(threshold_ms=100, explain=False)
+
+    run_command(monitor, 1, "find", {"find": "users", "filter": {"email": "a@example.com"}}, 150)
+    run_command(monitor, 2, "find", {"find": "users", "filter": {"email": "b@example.com"}}, 250)
+    run_command(monitor, 3, "find", {"find": "users", "filter": {"email": "c@example.com"}}, 5)
+
+    shapes = monitor.report()["shapes"]
+    assert len(shapes) == 1
+    assert shapes[0]["count"] == 2 and shapes[0]["max_ms"] == 250
+    assert "a@example.com" not in shapes[0]["shape"]
+
+def test_awaiting_change_stream_get_mores_are_not_slow_queries():
+    monitor = QueryMonitor(threshold_ms=100, explain=False)
+
+    run_command(monitor, 1, "getMore", {"getMore": 42, "collection": "transactions", "maxTimeMS": 1000}, 1000)
+    run_command(monitor, 2, "getMore", {"getMore": 43, "collection": "transactions"}, 300)
+
+    shapes = monitor.report()["shapes"]
+    assert [shape["command"] for shape in shapes] == ["getMore"]
+    assert shapes[0]["max_ms"] == 300
+    assert monitor.stats()["awaits_skipped"] == 1
@@ -0,0 +1,20 @@
+from rescreening import diff_entries
+
+from .test_sanctions_screening import make_index
+
+def test_only_added_and_changed_entries_are_rescreened():
+    before = make_index("Jane Smith", "John Doe", "Ivan Petrov")
+    previous = {entry_id: entry["fingerprint"] for entry_id, entry in before.entries.items()}
+    previous["test:9"] = "delisted"
+
+    diff = diff_entries(previous, make_index("Jane Smith", "Jon Doe", "Ivan Petrov", "Pablo Ortiz"))
+
+    assert [entry["name"] for entry in diff["changed"]] == ["Jon Doe"]
+    assert [entry["name"] for entry in diff["added"]] == ["Pablo Ortiz"]
+    assert diff["removed"] == ["test:9"]
+
+def test_unchanged_lists_rescreen_nothing():
+    index = make_index("Jane Smith", "John Doe")
+    previous = {entry_id: entry["fingerprint"] for entry_id, entry in index.entries.items()}
+
+    assert diff_entries(previous, index) == {"added": [], "changed": [], "removed": []}
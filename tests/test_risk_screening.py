@@ -0,0 +1,42 @@
+import server
+
+from .conftest import make_user, auth
+
+def seed(run, db):
+    run(db.users.insert_many([make_user(user_id, 100000) for user_id in ("alice", "bob")]))
+
+def count_loads(monkeypatch):
+    loads = []
+    real_load = server.risk_features.load
+
+    async def load(user_id, amount=0):
+        loads.append((user_id, amount))
+        return await real_load(user_id, amount)
+    monkeypatch.setattr(server.risk_features, "load", load)
+    return loads
+
+def test_transfer_loads_risk_features_once_for_both_engines(run, db, client, monkeypatch):
+    seed(run, db)
+    loads = count_loads(monkeypatch)
+
+    response = client.post("/api/transfer/send", json={"recipient_email": "bob@example.com", "amount": 25},
+                           headers=auth("alice"))
+
+    assert response.status_code == 200
+    assert loads == [("alice", 25.0)]
+    assert run(db.fraud_analyses.count_documents({"user_id": "alice"})) == 1
+    assert run(db.aml_screenings.count_documents({"user_id": "alice"})) == 1
+
+def test_blocked_screening_stops_the_transfer(run, db, client, monkeypatch):
+    seed(run, db)
+
+    async def sanctioned(user_data):
+        return {"status": "match", "entry_id": "test-entry", "confidence": 1.0}
+    monkeypatch.setattr(server.compliance_manager, "_check_sanctions_list", sanctioned)
+
+    response = client.post("/api/transfer/send", json={"recipient_email": "bob@example.com", "amount": 25},
+                           headers=auth("alice"))
+
+    assert response.status_code == 403
+    assert run(db.users.find_one({"id": "alice"}))["wallet_balance_cents"] == 100000
+    assert run(db.transactions.count_documents({})) == 0
@@ -0,0 +1,37 @@
+from sanctions_screening import ScreeningIndex, entry_fingerprint
+
+def make_index(*names):
+    entries = []
+    for number, name in enumerate(names):
+        entry = {"entry_id": f"test:{number}", "list": "test", "list_type": "sanctions", "name": name, "aliases": []}
+        entry["fingerprint"] = entry_fingerprint(entry)
+        entries.append(entry)
+    return ScreeningIndex(entries, "test")
+
+def names(matches):
+    return [match["name"] for match in matches]
+
+def test_single_typo_matches_below_an_exact_hit():
+    index = make_index("Jane Smith", "John Doe")
+
+    assert index.search("Jane Smith")[0]["score"] == 1.0
+    assert names(index.search("Jane Smyth")) == ["Jane Smith"]
+    assert 0.85 <= index.search("Jon Doe")[0]["score"] < 1.0
+
+def test_listed_token_is_not_a_typo_of_another():
+    index = make_index("Maria Rabi", "Jose Radi")
+
+    assert names(index.search("Maria Radi")) == []
+    assert names(index.search("Maria Rabii")) == ["Maria Rabi"]
+
+def test_dropped_or_overtyped_space_matches():
+    index = make_index("Jane Smith")
+
+    assert names(index.search("JaneSmith")) == ["Jane Smith"]
+    assert names(index.search("Janexsmith")) == ["Jane Smith"]
+
+def test_a_typo_in_every_token_is_a_different_name():
+    index = make_index("Jane Smith")
+
+    assert names(index.search("Jane Smyth")) == ["Jane Smith"]
+    assert names(index.search("Jame Smyth")) == []
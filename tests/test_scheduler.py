@@ -0,0 +1,61 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from scheduler import JobScheduler
+
+def make_schedulers(db, func, count=2):
+    schedulers = [JobScheduler(db) for _ in range(count)]
+    for scheduler in schedulers:
+        scheduler.add_job("rollup", func, interval_seconds=60, lease_seconds=60)
+    return schedulers
+
+def test_due_job_runs_on_one_worker(run, db):
+    runs = []
+
+    async def job():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+
+    async def scenario():
+        first, second = make_schedulers(db, job)
+        await first._register()
+        await second._register()
+        await asyncio.gather(first._start_due_jobs(), second._start_due_jobs())
+        await asyncio.gather(*first._running.values(), *second._running.values())
+        # Not due again until the interval has passed
+        await asyncio.gather(first._start_due_jobs(), second._start_due_jobs())
+        return await db.scheduled_jobs.find_one({"_id": "rollup"})
+
+    document = run(scenario())
+
+    assert runs == [1]
+    assert document["runs"] == 1 and document["lease_owner"] is None
+    assert document["next_run_at"] - document["last_run_at"] == timedelta(seconds=60)
+
+def test_lapsed_lease_is_run_by_another_worker(run, db):
+    runs = []
+
+    async def job():
+        runs.append(1)
+
+    async def scenario():
+        crashed, survivor = make_schedulers(db, job)
+        await survivor._register()
+        now = datetime.utcnow()
+        # The crashed worker claimed the run and died before finishing it
+        await db.scheduled_jobs.update_one({"_id": "rollup"}, {"$set": {
+            "lease_owner": crashed.owner, "lease_until": now + timedelta(seconds=30)
+        }})
+        await survivor._start_due_jobs()
+        assert not survivor._running
+
+        await db.scheduled_jobs.update_one({"_id": "rollup"}, {"$set": {"lease_until": now - timedelta(seconds=1)}})
+        await survivor._start_due_jobs()
+        await asyncio.gather(*survivor._running.values())
+        return survivor, await db.scheduled_jobs.find_one({"_id": "rollup"})
+
+    survivor, document = run(scenario())
+
+    assert runs == [1]
+    assert document["last_owner"] == survivor.owner
+    assert document["last_status"] == "completed"
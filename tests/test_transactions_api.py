@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+from .conftest import make_user, make_transaction, auth
+
+@pytest.fixture
+def history(run, db):
+    """alice and bob with 25 transfers between them, one minute apart"""
+    run(db.users.insert_many([make_user("alice", 10000), make_user("bob", 10000)]))
+    start = datetime(2026, 1, 1)
+    transactions = []
+    for i in range(25):
+        sender, recipient = ("alice", "bob") if i % 3 else ("bob", "alice")
+        transactions.append(make_transaction(sender, recipient, 100 + i, created_at=start + timedelta(minutes=i)))
+    run(db.transactions.insert_many(transactions))
+    return transactions
+
+def test_cursor_pagination_walks_every_transaction_once(client, history):
+    page = client.get("/api/transactions?limit=10", headers=auth("alice")).json()
+    pages = [page]
+    while page["has_more"]:
+        page = client.get(f"/api/transactions?limit=10&cursor={page['next_cursor']}", headers=auth("alice")).json()
+        pages.append(page)
+
+    assert [len(p["transactions"]) for p in pages] == [10, 10, 5]
+    ids = [t["id"] for p in pages for t in p["transactions"]]
+    assert len(set(ids)) == 25
+    newest_first = sorted(history, key=lambda t: t["created_at"], reverse=True)
+    assert ids == [t["id"] for t in newest_first]
+    assert "total" not in pages[0]
+
+def test_pagination_counts_only_on_request(client, history):
+    sent = [t for t in history if t["from_user_id"] == "alice"]
+
+    page = client.get("/api/transactions?limit=10&type=sent&include_total=true", headers=auth("alice")).json()
+
+    assert page["total"] == len(sent)
+    assert all(t["from_user_id"] == "alice" for t in page["transactions"])
+
+def test_invalid_cursor_is_rejected(client, history):
+    response = client.get("/api/transactions?cursor=not-a-cursor", headers=auth("alice"))
+    assert response.status_code == 400
+
+def test_wallet_transfers_without_an_id_page_by_insert_order(run, db, client):
+    run(db.users.insert_many([make_user("alice", 10000), make_user("bob", 10000)]))
+    # moov_wallet rows carry transaction_id only, and may share a timestamp
+    same_time = datetime(2026, 1, 1)
+    run(db.transactions.insert_many([
+        {"transaction_id": f"wallet-{i}", "from_user_id": "alice", "to_user_id": "bob", "amount": 1.0,
+         "status": "processing", "created_at": same_time}
+        for i in range(5)
+    ]))
+
+    ids = []
+    cursor = ""
+    while True:
+        page = client.get(f"/api/transactions?limit=2{cursor}", headers=auth("alice"))
+        assert page.status_code == 200
+        page = page.json()
+        ids += [t["id"] for t in page["transactions"]]
+        if not page["has_more"]:
+            break
+        cursor = f"&cursor={page['next_cursor']}"
+
+    assert ids == [f"wallet-{i}" for i in reversed(range(5))]
+
+def test_legacy_pages_stop_at_the_offset_cap(client, history, monkeypatch):
+    monkeypatch.setattr(server, "MAX_TRANSACTIONS_PAGE_OFFSET", 10)
+
+    assert client.get("/api/transactions?limit=10&page=2", headers=auth("alice")).status_code == 200
+    assert client.get("/api/transactions?limit=10&page=3", headers=auth("alice")).status_code == 400
@@ -0,0 +1,84 @@
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import BulkWriteError
+
+from transfer_engine import CreditsFailed
+
+from .conftest import make_transaction, balance, assert_ledger_matches_wallets
+
+def test_transfer_debits_sender_and_credits_recipient(run, db, engine, ledger, users):
+    transaction = make_transaction("alice", "bob", 2500, fee_cents=38)
+
+    sender = run(engine.transfer(transaction))
+
+    assert sender["wallet_balance_cents"] == 10000 - 2538
+    assert balance(run, db, "alice") == 7462
+    assert balance(run, db, "bob") == 3000
+    assert run(db.transactions.count_documents({"id": transaction["id"]})) == 1
+    entries = run(db.ledger_entries.find({"transaction_id": transaction["id"]}).to_list(None))
+    assert entries and sum(entry["amount_cents"] for entry in entries) == 0
+    assert_ledger_matches_wallets(run, db, ledger)
+
+def test_insufficient_funds_moves_nothing(run, db, engine, users):
+    with pytest.raises(HTTPException) as raised:
+        run(engine.transfer(make_transaction("bob", "carol", 501)))
+
+    assert raised.value.status_code == 400
+    assert balance(run, db, "bob") == 500
+    assert balance(run, db, "carol") == 0
+    assert run(db.transactions.count_documents({})) == 0
+    assert engine.counters["insufficient_funds"] == 1
+
+def test_frozen_sender_cannot_be_debited(run, db, engine, users):
+    run(db.users.update_one({"id": "alice"}, {"$set": {"account_status": "frozen"}}))
+
+    with pytest.raises(HTTPException) as raised:
+        run(engine.transfer(make_transaction("alice", "bob", 100)))
+
+    assert raised.value.status_code == 403
+    assert balance(run, db, "alice") == 10000
+    assert engine.counters["blocked_accounts"] == 1
+
+def test_failed_write_after_debit_is_compensated(run, db, engine, ledger, users, monkeypatch):
+    async def failing_post(entries, session=None):
+        raise RuntimeError("ledger unavailable")
+    monkeypatch.setattr(ledger, "post", failing_post)
+    transaction = make_transaction("alice", "bob", 1000)
+
+    with pytest.raises(RuntimeError):
+        run(engine.transfer(transaction))
+
+    assert balance(run, db, "alice") == 10000
+    assert balance(run, db, "bob") == 500
+    assert run(db.transactions.count_documents({"id": transaction["id"]})) == 0
+    assert engine.counters["compensations"] == 1
+    monkeypatch.undo()
+    assert_ledger_matches_wallets(run, db, ledger)
+
+def test_partly_applied_batch_credits_are_reversed(run, db, engine, ledger, users, monkeypatch):
+    chunk = [make_transaction("alice", "bob", 1000), make_transaction("alice", "carol", 2000)]
+    run(engine.reserve("alice", 3000))
+
+    users_class = type(db.users)
+    real_bulk_write = users_class.bulk_write
+    failed = []
+
+    async def partial_bulk_write(self, requests, *args, **kwargs):
+        if self.name != "users" or failed:
+            return await real_bulk_write(self, requests, *args, **kwargs)
+        # The first credit lands, the second one fails
+        await real_bulk_write(self, requests[:1], *args, **kwargs)
+        failed.append(True)
+        raise BulkWriteError({"writeErrors": [{"index": 1, "code": 1, "errmsg": "simulated"}], "nModified": 1})
+    monkeypatch.setattr(users_class, "bulk_write", partial_bulk_write)
+
+    with pytest.raises(CreditsFailed):
+        run(engine.settle_batch(chunk))
+    run(engine.release("alice", 3000))
+
+    assert balance(run, db, "alice") == 10000
+    assert balance(run, db, "bob") == 500
+    assert balance(run, db, "carol") == 0
+    assert run(db.transactions.count_documents({})) == 0
+    monkeypatch.undo()
+    assert_ledger_matches_wallets(run, db, ledger)
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+from .conftest import make_user, make_transaction
+
+@pytest.fixture
+def sender(run, db, client):
+    user = make_user("alice", 10 ** 7, daily_limit=100.0, monthly_limit=300.0)
+    run(db.users.insert_one(user))
+    return user
+
+def reserve(run, user, amount_cents):
+    limits = run(server.spend_limits(user, amount_cents))
+    run(server.transfer_engine.reserve(user["id"], amount_cents, limits))
+    return limits
+
+def test_daily_limit_counts_transfers_the_counters_missed(run, db, sender):
+    # Nothing was recorded in velocity_counters for these
+    run(db.transactions.insert_one(make_transaction("alice", "bob", 6000)))
+    run(db.transactions.insert_one({"transaction_id": "wallet-1", "from_user_id": "alice", "to_user_id": "bob",
+                                    "amount": 30.0, "status": "processing", "created_at": datetime.utcnow()}))
+
+    reserve(run, sender, 1000)
+    with pytest.raises(HTTPException) as raised:
+        reserve(run, sender, 1)
+    assert raised.value.detail == "Daily transaction limit exceeded"
+
+def test_failed_transfers_do_not_count(run, db, sender):
+    run(db.transactions.insert_one(make_transaction("alice", "bob", 9000, status="failed")))
+    reserve(run, sender, 10000)
+
+def test_security_middleware_reads_wallet_transfers(run, db, client):
+    run(db.transactions.insert_one({"transaction_id": "wallet-1", "from_user_id": "alice", "to_user_id": "bob",
+                                    "amount": 9999.0, "status": "processing", "created_at": datetime.utcnow()}))
+
+    run(server.SecurityMiddleware.validate_transaction_limits(1.0, "alice"))
+    with pytest.raises(HTTPException):
+        run(server.SecurityMiddleware.validate_transaction_limits(1.01, "alice"))
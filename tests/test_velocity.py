@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+from velocity import VelocityCounters, META_ID
+
+from .conftest import make_transaction
+
+def test_windows_sum_the_senders_buckets(run, db):
+    counters = VelocityCounters(db)
+    now = datetime.utcnow().replace(hour=12)
+    run(db.velocity_counters.insert_one({"_id": META_ID, "started_at": now - timedelta(days=30)}))
+    run(counters.record([
+        make_transaction("alice", "bob", 1000, created_at=now - timedelta(minutes=10)),
+        make_transaction("alice", "bob", 1000, created_at=now - timedelta(hours=3)),
+        make_transaction("alice", "carol", 2500, created_at=now - timedelta(days=3)),
+        make_transaction("bob", "alice", 9900, created_at=now - timedelta(minutes=5))
+    ]))
+
+    windows = run(counters.windows("alice", amount_cents=1000, now=now))
+
+    assert windows == {
+        "count_1h": 1,
+        "amount_24h_cents": 2000,
+        "count_today": 2,
+        "amount_today_cents": 2000,
+        "same_amount_7d": 2
+    }
+
+def test_windows_before_counting_began_are_unknown(run, db):
+    counters = VelocityCounters(db)
+    now = datetime.utcnow()
+    run(db.velocity_counters.insert_one({"_id": META_ID, "started_at": now - timedelta(hours=2)}))
+
+    windows = run(counters.windows("alice", now=now))
+
+    assert windows["count_1h"] == 0
+    assert windows["amount_24h_cents"] is None and windows["same_amount_7d"] is None